@@ -0,0 +1,59 @@
+#! /usr/local/epd/bin/python
+"""
+Render colorbars from the json colormaps saved by bss_run.py
+"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2014, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "sjoshi@bmap.ucla.edu"
+__credits__ = 'Contributions and ideas: Shantanu H. Joshi, Roger P. Woods, David Shattuck. ' \
+              'Inspired by the stats package rshape by Roger P. Woods'
+
+
+import argparse
+import os
+import sys
+from bss.colormaps import Colormap
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render pdf colorbars from the json colormaps saved by bss_run.py.\n')
+    parser.add_argument('jsonfiles', nargs='+', help='<json colormap files or output directories of bss_run.py>')
+    args = parser.parse_args()
+    bss_colorbar(args.jsonfiles)
+
+
+def bss_colorbar(jsonfiles):
+
+    for jsonfile in jsonfiles:
+        if os.path.isdir(jsonfile):
+            cbar_files = sorted(os.path.join(jsonfile, fname) for fname in os.listdir(jsonfile) if fname.endswith('_cbar.json'))
+        else:
+            cbar_files = [jsonfile]
+        for cbar_file in cbar_files:
+            sys.stdout.write('Saving colorbar ' + os.path.splitext(cbar_file)[0] + '.pdf\n')
+            Colormap.save_colorbar_from_json(cbar_file)
+    sys.stdout.write('Done.\n')
+
+
+if __name__ == '__main__':
+    main()
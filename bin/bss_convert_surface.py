@@ -33,7 +33,7 @@ from bss import surfio
 
 
 
-def bss_convert_surface(surfin, surfout, surf_conn=None):
+def bss_convert_surface(surfin, surfout, surf_conn=None, vtp_format='binary', compress=True):
     sin_name, sin_ext = os.path.splitext(surfin)
 
     if surfin == surfout:
@@ -54,7 +54,7 @@ def bss_convert_surface(surfin, surfout, surf_conn=None):
     if not len(in_faces):
         in_faces = temp_faces
 
-    surfio.writesurface_new(surfout, in_coords, in_faces, in_attributes)
+    surfio.writesurface_new(surfout, in_coords, in_faces, in_attributes, vtp_format=vtp_format, compress=compress)
 
     return None
 
@@ -65,8 +65,12 @@ def main():
     parser.add_argument('-surfout', dest='surfout', help='output surface [ucf,vtp]', required=True)
     parser.add_argument('-conn', dest='surfconn', default="", help='template surf with connectivity [vtp,pial]',
                         required=False)
+    parser.add_argument('-vtpformat', dest='vtpformat', default='binary', choices=surfio.vtp_formats,
+                        help='format of the data arrays in an output vtp surface', required=False)
+    parser.add_argument('-nocompress', dest='nocompress', action='store_true', default=False,
+                        help='do not zlib compress the binary data arrays of an output vtp surface', required=False)
     args = parser.parse_args()
-    bss_convert_surface(args.surfin, args.surfout, args.surfconn)
+    bss_convert_surface(args.surfin, args.surfout, args.surfconn, args.vtpformat, not args.nocompress)
     return None
 
 if __name__ == '__main__':
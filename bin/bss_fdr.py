@@ -41,7 +41,7 @@ def main():
     parser = argparse.ArgumentParser(description='Adjust p-values by testing for multiple comparisons using fdr.\n')
     parser.add_argument('pvaluein', help='input surface/curve or text file')
     parser.add_argument('pvalueout', help='output surface/curve or text file')
-    parser.add_argument('-method', dest='method', help='correction method - BH, BY, bonferroni, holm, hochbergh',
+    parser.add_argument('-method', dest='method', help='correction method - BH, BY, bonferroni, holm, hochberg',
                         required=False, default='BH')
     args = parser.parse_args()
     shape_fdr(args.pvaluein, args.pvalueout, args.method)
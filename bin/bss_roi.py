@@ -63,8 +63,9 @@ def main():
     parser = argparse.ArgumentParser(description='Perform statistical analysis on ROIs from Brainsuite processed data.\n')
     parser.add_argument('modelspec', help='<txt file for model specification [ini]>')
     parser.add_argument('outdir', help='<output directory>')
+    parser.add_argument('-statsengine', dest='statsengine', help='<statistical engine [sm/np]>',
+                        required=False, choices=['sm', 'np'], default='sm')
     args = parser.parse_args()
-    args.statsengine = 'sm'
     t = time.time()
 
     bss_roi(args.modelspec, args.outdir, args.statsengine)
@@ -95,10 +96,16 @@ def bss_roi(modelspec, outdir, opt_statsengine):
             statsdata.write_phenotype_array_to_csv(os.path.join(outdir, 'roidata.csv'))
             # Reload the roidata.csv file
             statsdata.demographic_data = pandas.read_csv(os.path.join(outdir, 'roidata.csv'), dtype={'subjID': object})
-            logging.info('Computing ' + model.modeltype + ' with ' + model.stat_test + '...')
+            for design in model.designs:
+                logging.info('Computing ' + design.modeltype + ' with ' + design.stat_test + '...')
             statsengine = StatsEngine(model, statsdata, engine=opt_statsengine, roi=True)
-            statsroiresult = statsengine.run()
-            statsroiresult.save(outdir + '/results.txt', statsdata, modelspec)
+            statsroiresults = statsengine.run_designs()
+            for design, statsroiresult in zip(model.designs, statsroiresults):
+                # With more than one design in the modelspec file, the results of each design are saved separately
+                if len(model.designs) == 1:
+                    statsroiresult.save(outdir + '/results.txt', statsdata, modelspec)
+                else:
+                    statsroiresult.save(outdir + '/' + design.result_prefix() + '_results.txt', statsdata, modelspec)
             # Copy the modelspec to the output directory
             try:
                 copy(os.path.abspath(modelspec), outdir)
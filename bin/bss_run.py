@@ -38,6 +38,7 @@ import os
 import sys
 import subprocess
 import shutil
+import urllib2
 # from bss import rimport
 
 # rimport.check_R_path()
@@ -46,10 +47,13 @@ try:
     from bss import excepts
     from bss.modelspec import ModelSpec
     from bss.stats_data import StatsData
+    from bss.stats_data_cache import StatsDataCache
+    from bss.stats_checkpoint import StatsCheckpoint
     from bss.stats_engine import StatsEngine
     from bss.stats_vertex_output import StatsVtxOutput
     import traceback
     from bss.stats_nimg_output import StatsNimgOutput
+    from bss.stats_server import StatsServer
 except Exception as e:
     sys.stdout.write('\nError: ' + e.message + '\n')
     sys.stdout.write('\nSomething happened during imports. \nPerhaps R is not installed properly or R_HOME is not set'
@@ -68,18 +72,86 @@ def main():
     # parser.add_argument('-prefix', dest='outprefix', help='<output prefix>', required=False, default='left')
     parser.add_argument('-statsengine', dest='statsengine', help='<statistical engine [R/sm]>',
                         required=False, choices=['R', 'sm', 'np'], default='np')
+    parser.add_argument('-readworkers', dest='readworkers', help='<number of parallel workers for reading subject files>',
+                        required=False, type=int, default=1)
+    parser.add_argument('-writeworkers', dest='writeworkers', help='<number of parallel workers for writing the output files>',
+                        required=False, type=int, default=4)
+    parser.add_argument('-blocksize', dest='blocksize', help='<number of vertices/voxels processed together by the np engine>',
+                        required=False, type=int, default=20000)
+    parser.add_argument('-jobs', dest='jobs', help='<number of parallel processes for the np statistical engine>',
+                        required=False, type=int, default=1)
+    parser.add_argument('-permutations', dest='permutations',
+                        help='<number of permutations for family-wise error corrected p-values [0 = off]>',
+                        required=False, type=int, default=0)
+    parser.add_argument('-seed', dest='seed', help='<seed of the random number generator for permutations>',
+                        required=False, type=int, default=None)
+    parser.add_argument('-cachedir', dest='cachedir',
+                        help='<directory for caching the subject data between runs [default = no caching]>',
+                        required=False, default=None)
+    parser.add_argument('-rebuildcache', dest='rebuildcache', help='reread the subject files and rebuild the cache in -cachedir',
+                        required=False, action='store_true', default=False)
+    parser.add_argument('-checkpoint', dest='checkpoint',
+                        help='save finished blocks and permutations in the output directory, so that an interrupted '
+                             'run can be resumed with -resume',
+                        required=False, action='store_true', default=False)
+    parser.add_argument('-resume', dest='resume',
+                        help='resume an interrupted run from the checkpoint saved in the output directory',
+                        required=False, action='store_true', default=False)
+    parser.add_argument('-colorbars', dest='colorbars',
+                        help='render the colorbars as pdf files (otherwise only the json colormaps are saved, '
+                             'see bss_colorbar.py)',
+                        required=False, action='store_true', default=False)
+    parser.add_argument('-resultformat', dest='resultformat',
+                        help='<save the maps as separate files, as a single .npz archive, or both [files/archive/both]>',
+                        required=False, choices=StatsNimgOutput.result_formats, default='files')
+    parser.add_argument('-server', dest='server',
+                        help='<port of a bss server (see bss_server.py) on localhost to run the model on>',
+                        required=False, type=int, default=None)
     args = parser.parse_args()
     t = time.time()
 
-    bss_run(args.modelspec, args.outdir, args.statsengine)
+    if args.server is not None:
+        bss_run_on_server(args.server, args.modelspec, args.outdir, args.statsengine, args.blocksize, args.jobs,
+                          args.permutations, args.seed, args.resume, args.colorbars, args.writeworkers,
+                          args.resultformat, args.checkpoint)
+        elapsed = time.time() - t
+        os.sys.stdout.write("Elapsed time " + str(elapsed) + " sec.\n")
+        return
+
+    cache = None
+    if args.cachedir:
+        cache = StatsDataCache(args.cachedir, rebuild=args.rebuildcache)
+        sys.stdout.write('Caching the subject data in ' + cache.cache_dir + '.\n')
+    bss_run(args.modelspec, args.outdir, args.statsengine, args.readworkers, cache, args.blocksize, args.jobs,
+            args.permutations, args.seed, args.resume, args.colorbars, args.writeworkers, args.resultformat,
+            args.checkpoint)
     elapsed = time.time() - t
     os.sys.stdout.write("Elapsed time " + str(elapsed) + " sec.\n")
 
 
-def bss_run(modelspec, outdir, opt_statsengine):
+def bss_run_on_server(port, modelspec, outdir, opt_statsengine, opt_blocksize=20000, opt_jobs=1, opt_permutations=0,
+                      opt_seed=None, opt_resume=False, opt_colorbars=False, opt_writeworkers=4,
+                      opt_resultformat='files', opt_checkpoint=False):
+    # The server reads the files itself, so the paths are sent as absolute paths
+    request = {'modelspec': os.path.abspath(modelspec), 'outdir': os.path.abspath(outdir),
+               'statsengine': opt_statsengine, 'blocksize': opt_blocksize, 'jobs': opt_jobs,
+               'permutations': opt_permutations, 'seed': opt_seed, 'resume': opt_resume,
+               'colorbars': opt_colorbars, 'writeworkers': opt_writeworkers, 'resultformat': opt_resultformat,
+               'checkpoint': opt_checkpoint}
+    try:
+        response = StatsServer.submit('/run', request, port=port)
+    except urllib2.URLError as urlerr:
+        sys.stdout.write('Error: Could not connect to a bss server on port ' + str(port) + '. '
+                         'Please start the server with bss_server.py.\n')
+        return
+    sys.stdout.write(response['output'])
+
+
+def bss_run(modelspec, outdir, opt_statsengine, opt_readworkers=1, cache=None, opt_blocksize=20000,
+            opt_jobs=1, opt_permutations=0, opt_seed=None, opt_resume=False,
+            opt_colorbars=False, opt_writeworkers=4, opt_resultformat='files', opt_checkpoint=False):
 
     try:
-        outprefix = ''
         if not os.path.exists(outdir):
             os.mkdir(outdir)
         logging.basicConfig(filename=os.path.join(outdir, 'bss.log'), level=logging.DEBUG,
@@ -97,27 +169,29 @@ def bss_run(modelspec, outdir, opt_statsengine):
         [logging.info(model_line.rstrip('\n')) for model_line in modeltxt ]
 
         logging.info('Reading demographics file ' + model.demographics + ' and creating a data frame...')
-        statsdata = StatsData(model.demographics, model)
+        statsdata = StatsData(model.demographics, model, max_block_size=opt_blocksize,
+                              num_read_workers=opt_readworkers, cache=cache)
         if statsdata.data_read_flag:
             logging.info('Done.')
             # Save the phenotype array to a ascii file for debugging
             statsdata.write_subject_phenotype_array(os.path.join(outdir, 'phenotype_array.mat'))
-            logging.info('Computing ' + model.modeltype + ' with ' + model.stat_test + '...')
-            statsengine = StatsEngine(model, statsdata, engine=opt_statsengine)
-            statsresult = statsengine.run()
-            if model.measure_flag:
-                outprefix = model.stat_test + '_' + model.variable + '_' + os.path.splitext(os.path.split(model.atlas)[1])[0]
-            elif model.model_flag:
-                outprefix = model.stat_test + '_' + model.unique  + '_' + os.path.splitext(os.path.split(model.atlas)[1])[0]
-            elif model.hypothesis_flag:
-                if model.hypothesis_test == 'paired_ttest':
-                    outprefix = model.stat_test + '_' + model.hypothesis_pair_id + '_' + os.path.splitext(os.path.split(model.atlas)[1])[0]
-                elif model.hypothesis_test == 'unpaired_ttest':
-                    outprefix = model.stat_test + '_' + model.hypothesis_group + '_' + os.path.splitext(os.path.split(model.atlas)[1])[0]
-
-
-            statsnimgout = StatsNimgOutput(outdir, outprefix, statsresult, statsdata.mask_idx)
-            statsnimgout.save(model.atlas)
+            for design in model.designs:
+                logging.info('Computing ' + design.modeltype + ' with ' + design.stat_test + '...')
+            checkpoint = None
+            if opt_checkpoint or opt_resume:
+                checkpoint = StatsCheckpoint(outdir, resume=opt_resume)
+            statsengine = StatsEngine(model, statsdata, engine=opt_statsengine, jobs=opt_jobs,
+                                      permutations=opt_permutations, seed=opt_seed, checkpoint=checkpoint)
+            # The data is read once and the tests of all the designs in the modelspec file are run together
+            statsresults = statsengine.run_designs()
+            provenance = {'modelspec': os.path.abspath(modelspec), 'modelspec_text': ''.join(modeltxt),
+                          'statsengine': opt_statsengine, 'permutations': opt_permutations, 'seed': statsengine.seed}
+            StatsNimgOutput.save_designs(outdir, model, statsresults, statsdata.mask_idx, colorbars=opt_colorbars,
+                                         write_workers=opt_writeworkers, result_format=opt_resultformat,
+                                         provenance=provenance)
+            # The results are saved, so the checkpoint is not needed anymore
+            if checkpoint is not None:
+                checkpoint.clear()
             # Copy the modelspec to the output directory
             try:
                 shutil.copy(os.path.abspath(modelspec), outdir)
@@ -0,0 +1,86 @@
+#! /usr/local/epd/bin/python
+"""
+Start a local bss server that keeps the subject data in memory between statistical runs
+"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "sjoshi@bmap.ucla.edu"
+__credits__ = 'Contributions and ideas: Shantanu H. Joshi, Roger P. Woods, David Shattuck. ' \
+              'Inspired by the stats package rshape by Roger P. Woods'
+
+
+import argparse
+import sys
+import urllib2
+from bss.stats_data_cache import StatsDataCache
+from bss.stats_server import StatsServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start a local bss server that keeps the subject data of recently used '
+                                                 'cohorts in memory. Submit modelspec files to the server with the '
+                                                 '-server option of bss_run.py.\n')
+    parser.add_argument('-port', dest='port', help='<port on localhost>',
+                        required=False, type=int, default=StatsServer.default_port)
+    parser.add_argument('-memory', dest='memory', help='<memory budget for the subject data of the cohorts in MB>',
+                        required=False, type=int, default=StatsServer.default_memory_budget_mb)
+    parser.add_argument('-readworkers', dest='readworkers', help='<number of parallel workers for reading subject files>',
+                        required=False, type=int, default=1)
+    parser.add_argument('-jobs', dest='jobs', help='<default number of parallel processes for the np statistical engine>',
+                        required=False, type=int, default=1)
+    parser.add_argument('-cachedir', dest='cachedir',
+                        help='<directory for caching the subject data between runs [default = no caching]>',
+                        required=False, default=None)
+    parser.add_argument('-status', dest='status', help='show the status of a running server',
+                        required=False, action='store_true', default=False)
+    parser.add_argument('-stop', dest='stop', help='stop a running server',
+                        required=False, action='store_true', default=False)
+    args = parser.parse_args()
+
+    if args.status or args.stop:
+        try:
+            if args.status:
+                status = StatsServer.submit('/status', port=args.port)
+                sys.stdout.write('Cohorts loaded: ' + str(status['cohorts']) + '. Memory used: ' +
+                                 '{0:.1f} of {1:.1f} MB.\n'.format(status['memory_used_mb'], status['memory_budget_mb']))
+            if args.stop:
+                StatsServer.submit('/shutdown', {}, port=args.port)
+                sys.stdout.write('Stopped the bss server on port ' + str(args.port) + '.\n')
+        except urllib2.URLError as urlerr:
+            sys.stdout.write('Error: Could not connect to a bss server on port ' + str(args.port) + '.\n')
+        return
+
+    cache = None
+    if args.cachedir:
+        cache = StatsDataCache(args.cachedir)
+        sys.stdout.write('Caching the subject data in ' + cache.cache_dir + '.\n')
+    server = StatsServer(args.port, args.memory, num_read_workers=args.readworkers, cache=cache, jobs=args.jobs)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        server.server_close()
+        sys.stdout.write('\nbss server stopped.\n')
+
+
+if __name__ == '__main__':
+    main()
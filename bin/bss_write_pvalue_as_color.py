@@ -65,7 +65,7 @@ def bss_write_pvalue_as_log_color(nimg_datain, nimg_dataout):
         sys.stdout.write('Not implemented.\n')
         log_pvalues = NimgDataio.read(nimg_datain, attributes_only=True)
         cdict_pvalues, pex, cmap = cm.Colormap.log_pvalues_to_rgb(log_pvalues)
-        LUT = cmap._lut[0:256, 0:3]
+        LUT = cmap.lut
         fid = open(nimg_dataout, 'wt')
         for i in range(0, len(LUT)):
             fid.write("{0:f} {1:f} {2:f}\n".format(float(LUT[i, 0]), float(LUT[i, 1]), float(LUT[i, 2])))
@@ -0,0 +1,132 @@
+#! /usr/local/epd/bin/python
+
+"""Process-wide cache of atlas surfaces and images shared by the data readers and output writers"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+
+import numpy as np
+import os
+import threading
+from collections import OrderedDict
+import dfsio
+import nii_io
+
+
+class AtlasSurface(object):
+    """
+    A writer's view of a cached atlas surface. Fields that are not assigned (faces, vertices, labels, uv...) come from
+    the shared atlas and are read-only. Fields that are assigned (usually attributes and vColor) only exist in this
+    view.
+    """
+
+    def __init__(self, atlas):
+        self.atlas = atlas
+
+    def __getattr__(self, name):
+        if name == 'atlas':
+            raise AttributeError(name)
+        return getattr(self.atlas, name)
+
+
+class AtlasCache(object):
+    """
+    Least recently used cache of atlases, keyed by the path, size and modification time of the atlas file, so that an
+    atlas is only parsed once per process unless it changes on disk.
+    """
+
+    max_atlases = 4
+    atlases = OrderedDict()
+    lock = threading.Lock()
+
+    @staticmethod
+    def atlas_key(filename, kind):
+        filename = os.path.abspath(filename)
+        filestat = os.stat(filename)
+        return kind, filename, filestat.st_size, filestat.st_mtime
+
+    @staticmethod
+    def get(filename, kind, load):
+        key = AtlasCache.atlas_key(filename, kind)
+        with AtlasCache.lock:
+            if key in AtlasCache.atlases:
+                atlas = AtlasCache.atlases.pop(key)
+                AtlasCache.atlases[key] = atlas
+                return atlas
+        atlas = load(filename)
+        with AtlasCache.lock:
+            # Drop older versions of the same file, and the least recently used atlases over the bound
+            for old_key in [k for k in AtlasCache.atlases if k[0:2] == key[0:2]]:
+                del AtlasCache.atlases[old_key]
+            AtlasCache.atlases[key] = atlas
+            while len(AtlasCache.atlases) > AtlasCache.max_atlases:
+                AtlasCache.atlases.popitem(last=False)
+        return atlas
+
+    @staticmethod
+    def clear():
+        with AtlasCache.lock:
+            AtlasCache.atlases.clear()
+
+    @staticmethod
+    def load_surface(filename):
+        atlas = dfsio.readdfs_mmap(filename)
+        for field in ['faces', 'vertices', 'normals', 'vColor', 'u', 'v', 'labels', 'attributes']:
+            if hasattr(atlas, field):
+                getattr(atlas, field).setflags(write=False)
+        atlas.label_ids = np.unique(atlas.labels) if hasattr(atlas, 'labels') else np.array([], dtype=np.uint16)
+        atlas.label_ids.setflags(write=False)
+        return atlas
+
+    @staticmethod
+    def surface(filename):
+        """
+        Returns an AtlasSurface view of the dfs atlas. Also has label_ids, the unique labels of the atlas.
+        """
+        return AtlasSurface(AtlasCache.get(filename, 'surface', AtlasCache.load_surface))
+
+    @staticmethod
+    def surface_writer(filename):
+        """
+        Returns a dfsio.DfsTemplateWriter for the dfs atlas. The writer is shared and does not change after it is made.
+        """
+        return AtlasCache.get(filename, 'surface_writer', lambda fname: dfsio.DfsTemplateWriter(fname, atomic=True))
+
+    @staticmethod
+    def load_nifti_image(filename):
+        nimgobj = nii_io.readnii(filename)
+        nimgobj.get_data().setflags(write=False)
+        return nimgobj
+
+    @staticmethod
+    def nifti_image(filename):
+        """
+        Returns the nibabel image of the nifti atlas. Its data is read-only.
+        """
+        return AtlasCache.get(filename, 'nifti_image', AtlasCache.load_nifti_image)
+
+    @staticmethod
+    def nifti_image_as_array(filename):
+        nifti_img = AtlasCache.nifti_image(filename).get_data()
+        return np.reshape(nifti_img, (nifti_img.size, ))
@@ -29,17 +29,42 @@ __credits__ = 'Contributions and ideas: Shantanu H. Joshi, Roger P. Woods, David
               'Inspired by the stats package rshape by Roger P. Woods'
 
 import numpy as np
-from bss import mpl_import
-mpl_import.init()
-from matplotlib import colors as mpl_colors
-from matplotlib import pyplot as pl
-from matplotlib import colorbar
 from copy import deepcopy
-from math_ops import log10_transform
 from json import dump, load
 from os import path
 
 
+class SegmentedColormap(object):
+    """
+    NumPy implementation of matplotlib's LinearSegmentedColormap. The lookup table and the colors are identical to
+    those of matplotlib, but matplotlib is only imported when a colorbar is rendered.
+    """
+
+    def __init__(self, name, segmentdata, N=256):
+        self.name = name
+        self.segmentdata = segmentdata
+        self.N = N
+        self.lut = np.column_stack([Colormap.make_mapping_array(N, segmentdata[channel])
+                                    for channel in ['red', 'green', 'blue']])
+
+    def __call__(self, values):
+        """
+        Returns the N x 3 colors for values in [0, 1]. As in matplotlib, values below 0 and NaNs take the first color
+        of the lookup table, and values above 1 take the last.
+        """
+        lut_idx = np.asarray(values, dtype=float)*self.N
+        lut_idx[np.isnan(lut_idx)] = -1
+        np.clip(lut_idx, -1, self.N, out=lut_idx)
+        lut_idx = np.clip(lut_idx.astype(int), 0, self.N - 1)
+        return self.lut[lut_idx]
+
+    def to_mpl(self):
+        from bss import mpl_import
+        mpl_import.init()
+        from matplotlib import colors as mpl_colors
+        return mpl_colors.LinearSegmentedColormap(self.name, self.segmentdata, self.N)
+
+
 class Colormap:
 
     def __init__(self, value_type, attributes):
@@ -273,23 +298,83 @@ class Colormap:
 
         return np.array(attribute_range), np.array(red_range), np.array(green_range), np.array(blue_range)
 
+    @staticmethod
+    def make_mapping_array(N, data):
+        """
+        Creates an N-element lookup table for one channel from a list of (x, y0, y1) breakpoints with x going from 0
+        to 1, in the same way as matplotlib.colors.makeMappingArray.
+        """
+        adata = np.array(data, dtype=float)
+        if adata.ndim != 2 or adata.shape[1] != 3:
+            raise ValueError('Colormap data must be in nx3 format.')
+        x = adata[:, 0]
+        y0 = adata[:, 1]
+        y1 = adata[:, 2]
+        if x[0] != 0. or x[-1] != 1.0:
+            raise ValueError('Colormap data mapping points must start with x=0 and end with x=1.')
+        if (np.diff(x) < 0).any():
+            raise ValueError('Colormap data mapping points must have x in increasing order.')
+
+        x = x*(N - 1)
+        lut = np.zeros((N,), float)
+        xind = (N - 1)*np.linspace(0, 1, N)
+        ind = np.searchsorted(x, xind)[1:-1]
+        distance = (xind[1:-1] - x[ind - 1])/(x[ind] - x[ind - 1])
+        lut[1:-1] = distance*(y0[ind] - y1[ind - 1]) + y1[ind - 1]
+        lut[0] = y1[0]
+        lut[-1] = y0[-1]
+        return np.clip(lut, 0.0, 1.0)
+
     @staticmethod
     def get_rgb_from_attribute(attrib_range, red_range, green_range, blue_range, value):
 
-        value = float(value)
-        idx1 = np.where((attrib_range <= value) == True)[0][-1]
-        idx2 = np.where((attrib_range >= value) == True)[0][0]
-        red = (1.0 - value)*red_range[idx1] + value*red_range[idx2]
-        green = (1.0 - value)*green_range[idx1] + value*green_range[idx2]
-        blue = (1.0 - value)*blue_range[idx1] + value*blue_range[idx2]
+        red, green, blue = Colormap.get_rgb_array_from_attributes(attrib_range, red_range, green_range, blue_range,
+                                                                  np.array([value], dtype=float))[0]
         return (red, green, blue)
 
+    @staticmethod
+    def get_rgb_array_from_attributes(attrib_range, red_range, green_range, blue_range, attributes):
+        """
+        Returns an N x 3 array of colors for all attributes at once.
+        For every value, idx1 is the last breakpoint <= value and idx2 the first breakpoint >= value, and each
+        channel is (1 - value)*c[idx1] + value*c[idx2]. The value itself (not its position between the two
+        breakpoints) is the blending weight, as in the original per-vertex implementation, so the colors are
+        unchanged. Values outside the breakpoints take the color of the nearest end.
+        """
+        attrib_range = np.asarray(attrib_range, dtype=float)
+        values = np.asarray(attributes, dtype=float).ravel()
+        last = len(attrib_range) - 1
+        idx1 = np.clip(np.searchsorted(attrib_range, values, side='right') - 1, 0, last)
+        idx2 = np.clip(np.searchsorted(attrib_range, values, side='left'), 0, last)
+        values = values[:, np.newaxis]
+        channels = np.column_stack((red_range, green_range, blue_range)).astype(float)
+        return (1.0 - values)*channels[idx1] + values*channels[idx2]
+
     @staticmethod
     def get_rgb_list_from_attribute_list(attribute_list, attrib_range, red_range, green_range, blue_range):
-        rgb_list = []
-        for value in attribute_list:
-            rgb_list.append(Colormap.get_rgb_from_attribute(attrib_range, red_range, green_range, blue_range, value))
-        return rgb_list
+        rgb_array = Colormap.get_rgb_array_from_attributes(attrib_range, red_range, green_range, blue_range,
+                                                           attribute_list)
+        return [tuple(rgb) for rgb in rgb_array]
+
+    def make_lut(self, lut_size=256):
+        """
+        Samples the colormap at lut_size equally spaced attribute values between the first and the last breakpoint.
+        """
+        if lut_size < 2:
+            raise ValueError('The colormap lookup table needs at least 2 entries, got {0:d}.'.format(lut_size))
+        lut_attributes = np.linspace(self.attrib_range[0], self.attrib_range[-1], lut_size)
+        return Colormap.get_rgb_array_from_attributes(self.attrib_range, self.red_range, self.green_range,
+                                                      self.blue_range, lut_attributes)
+
+    def get_rgb_array_from_lut(self, attributes, lut_size=256):
+        """
+        Maps attributes to colors through a precomputed lookup table with integer indexing.
+        This is faster for large arrays, at the cost of quantizing the attributes to lut_size levels.
+        """
+        lut = self.make_lut(lut_size)
+        lut_idx = np.interp(np.asarray(attributes, dtype=float).ravel(),
+                            [self.attrib_range[0], self.attrib_range[-1]], [0, lut_size - 1])
+        return lut[np.rint(lut_idx).astype(np.intp)]
 
     @staticmethod
     def scale(val, src, dst):
@@ -303,15 +388,16 @@ class Colormap:
         return (val - minval) / float(maxval - minval)
 
     @staticmethod
-    def get_rgb_color_array(value_type, attributes):
+    def get_rgb_color_array(value_type, attributes, lut_size=None):
+        """
+        Returns an N x 3 array of colors for the attributes.
+        If lut_size (e.g. 256 or 4096) is given, the colors are looked up from a table of that size.
+        """
         cmap = Colormap(value_type, attributes)
-        rgb_list = cmap.get_rgb_list_from_attribute_list(attributes)
-
-        vColor = np.empty((3, len(attributes)))
-        for idx, val in enumerate(rgb_list):
-            vColor[:, idx] = [val[0], val[1], val[2]]
-        vColor = np.ndarray.transpose(vColor)
-        return vColor
+        if lut_size:
+            return cmap.get_rgb_array_from_lut(attributes, lut_size)
+        return Colormap.get_rgb_array_from_attributes(cmap.attrib_range, cmap.red_range, cmap.green_range,
+                                                      cmap.blue_range, attributes)
 
     @staticmethod
     def exportBrainSuiteLUT(filename, LUT):
@@ -535,10 +621,9 @@ class Colormap:
             for i in range(0, len(cdict['blue'])):
                 cdict['blue'][i] = ((cdict['blue'][i][0] + cex) / (2 * cex), cdict['blue'][i][1], cdict['blue'][i][2])
 
-        my_cmap = mpl_colors.LinearSegmentedColormap('my_bi_cmap', cdict, 256)
-        my_cmap._init()
+        my_cmap = SegmentedColormap('my_bi_cmap', cdict, 256)
         new_attrib_range = Colormap.normalize(attributes, -1 * cex, cex)
-        vColor = my_cmap(new_attrib_range)[:, 0:3]
+        vColor = my_cmap(new_attrib_range)
         return vColor, cex, my_cmap
 
     @staticmethod
@@ -566,10 +651,9 @@ class Colormap:
             for i in range(0, len(cdict['blue'])):
                 cdict['blue'][i] = ((cdict['blue'][i][0] - tmin) / (tmax - tmin), cdict['blue'][i][1], cdict['blue'][i][2])
 
-        my_cmap = mpl_colors.LinearSegmentedColormap('my_bi_cmap', cdict, 256)
-        my_cmap._init()
+        my_cmap = SegmentedColormap('my_bi_cmap', cdict, 256)
         new_attrib_range = Colormap.normalize(attributes, tmin, tmax)
-        vColor = my_cmap(new_attrib_range)[:, 0:3]
+        vColor = my_cmap(new_attrib_range)
         return vColor, tmin, tmax, my_cmap
 
     @staticmethod
@@ -589,38 +673,56 @@ class Colormap:
             for i in range(0, len(cdict['blue'])):
                 cdict['blue'][i] = ((cdict['blue'][i][0] + pex) / (2 * pex), cdict['blue'][i][1], cdict['blue'][i][2])
 
-        my_cmap = mpl_colors.LinearSegmentedColormap('my_bi_cmap', cdict, 256)
-        my_cmap._init()
+        my_cmap = SegmentedColormap('my_bi_cmap', cdict, 256)
         new_attrib_range = Colormap.normalize(log_pvalues, -1 * pex, pex)
-        vColor = my_cmap(new_attrib_range)[:, 0:3]
+        vColor = my_cmap(new_attrib_range)
         return vColor, pex, my_cmap
 
     @staticmethod
     def log_transform_pvalues_to_rgb(pvalues):
+        from math_ops import log10_transform
         log_pvalues = log10_transform(pvalues)
         vColor, pex, my_cmap = Colormap.log_pvalues_to_rgb(log_pvalues)
         return vColor, pex, my_cmap
 
     @staticmethod
     def save_colorbar(file, cmap, vmin, vmax, labeltxt):
+        from bss import mpl_import
+        mpl_import.init()
+        from matplotlib import colors as mpl_colors
+        from matplotlib import pyplot as pl
+        from matplotlib import colorbar
+
         fig = pl.figure(figsize=(1.2, 3.1))
         ax1 = fig.add_axes([0.05, 0.05, 0.1, 0.9])
         norm = mpl_colors.Normalize(vmin=vmin, vmax=vmax)
-        cb1 = colorbar.ColorbarBase(ax1, cmap=cmap, norm=norm, orientation='vertical')
+        cb1 = colorbar.ColorbarBase(ax1, cmap=cmap.to_mpl(), norm=norm, orientation='vertical')
         cb1.ax.tick_params(axis='y', labelsize=16)
         cb1.set_clim(vmin=vmin, vmax=vmax)
         cb1.set_label(labeltxt)
         fig.savefig(file)
+        pl.close(fig)
         jsonfilename = path.splitext(file)[0] + '.json'
         Colormap.save_colormap_to_json(jsonfilename, cmap, vmin, vmax, labeltxt)
 
+    @staticmethod
+    def save_colorbar_from_json(jsonfile, file=None):
+        """
+        Renders the colorbar pdf of a colormap saved with save_colormap_to_json. By default the pdf is written next to
+        the json file.
+        """
+        cmap_dict, vmin, vmax, labeltxt = Colormap.load_colormap_from_json(jsonfile)
+        if file is None:
+            file = path.splitext(jsonfile)[0] + '.pdf'
+        Colormap.save_colorbar(file, SegmentedColormap('my_bi_cmap', cmap_dict, 256), vmin, vmax, labeltxt)
+
     @staticmethod
     def save_colormap_to_json(jsonfile, cmap, vmin, vmax, labeltxt):
         cmap_json_dict = {
             'vmin': vmin,
             'vmax': vmax,
             'labeltxt': labeltxt,
-            'cmap_dict': cmap._segmentdata
+            'cmap_dict': cmap.segmentdata
         }
         with open(jsonfile, 'wt') as fid:
             dump(cmap_json_dict, fid, indent=2)
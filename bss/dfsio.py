@@ -28,11 +28,33 @@ import numpy as np
 import struct
 import os
 import sys
+import mmap
+import io
+from collections import namedtuple
+
+# The 184 byte dfs header: file type, header size, offsets and counts (int32), followed by unused fields
+dfs_header = struct.Struct('<12s12i124x')
+DfsHeader = namedtuple('DfsHeader', ['ftype_header', 'hdrsize', 'mdoffset', 'pdoffset', 'nTriangles', 'nVertices',
+                                     'nStrips', 'stripSize', 'normals', 'uvStart', 'vcoffset', 'labelOffset',
+                                     'vertexAttributes'])
+
+
+def parsedfsheader(header_bytes, fname=''):
+    if len(header_bytes) < dfs_header.size or 'DFS' not in bytes(header_bytes[0:12]):
+        raise ValueError('Invalid dfs file' + fname)  # TODO: Change this to a custom exception in future
+    return DfsHeader._make(dfs_header.unpack_from(header_bytes))
+
+
+def readdfsheader(fid, fname=''):
+    return parsedfsheader(fid.read(dfs_header.size), fname)
+
+
+def dfsheader_field_offset(field):
+    # Byte offset of an int32 field in the header. The fields follow the 12 byte file type.
+    return 12 + 4 * (DfsHeader._fields.index(field) - 1)
 
-def readdfs(fname):
-    class hdr:
-        pass
 
+def readdfs(fname):
     class NFV:
         pass
 
@@ -40,21 +62,7 @@ def readdfs(fname):
         raise IOError('\nIOError: File name ' + fname + ' does not exist.')
 
     fid = open(fname, 'rb')
-    hdr.ftype_header = np.fromfile(fid, dtype='S1', count=12)
-    if 'DFS' not in ''.join(hdr.ftype_header):
-        raise ValueError('Invalid dfs file' + fname)  # TODO: Change this to a custom exception in future
-    hdr.hdrsize = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.mdoffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.pdoffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.nTriangles = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.nVertices = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.nStrips = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.stripSize = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.normals = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.uvStart = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.vcoffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.labelOffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.vertexAttributes = np.fromfile(fid, dtype='int32', count=1)[0]
+    hdr = readdfsheader(fid, fname)
     fid.seek(hdr.hdrsize)
     NFV.faces = np.fromfile(fid, dtype='int32', count=3 * hdr.nTriangles).reshape((hdr.nTriangles, 3))
     NFV.vertices = np.fromfile(fid, dtype='float32', count=3 * hdr.nVertices).reshape((hdr.nVertices, 3))
@@ -86,30 +94,77 @@ def readdfs(fname):
     return (NFV)
 
 
-def readdfsattributes(fname):
+class DfsMap(object):
+    """
+    A dfs surface backed by a memory map of the file, with the same fields as the surface returned by readdfs.
+    Each section is a NumPy view into the map, created when it is first used. The map is copy-on-write, so modifying
+    a section in place only copies the modified pages and never changes the file. Assigning a section replaces the view.
+    """
 
-    class hdr:
-        pass
+    # section: (header field with the offset, dtype, number of values per vertex/face)
+    sections = {'faces': (None, '<i4', 3),
+                'vertices': (None, '<f4', 3),
+                'normals': ('normals', '<f4', 3),
+                'vColor': ('vcoffset', '<f4', 3),
+                'uv': ('uvStart', '<f4', 2),
+                'labels': ('labelOffset', '<u2', 1),
+                'attributes': ('vertexAttributes', '<f4', 1),
+                }
+
+    def __init__(self, fname):
+        if not os.path.exists(fname):
+            raise IOError('\nIOError: File name ' + fname + ' does not exist.')
+        with open(fname, 'rb') as fid:
+            self.hdr = readdfsheader(fid, fname)
+            self.map = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.name = fname
+
+    def section_view(self, section):
+        offset_field, dtype, num_values = DfsMap.sections[section]
+        num_rows = self.hdr.nTriangles if section == 'faces' else self.hdr.nVertices
+        if section == 'faces':
+            offset = self.hdr.hdrsize
+        elif section == 'vertices':
+            offset = self.hdr.hdrsize + 12 * self.hdr.nTriangles
+        else:
+            offset = getattr(self.hdr, offset_field)
+            if offset <= 0:
+                return None
+        shape = (num_rows, num_values) if num_values > 1 else (num_rows,)
+        if offset + np.dtype(dtype).itemsize * num_rows * num_values > len(self.map):
+            raise ValueError('Invalid dfs file' + self.name + '. The ' + section + ' extend past the end of the file.')
+        return np.ndarray(shape, dtype=dtype, buffer=self.map, offset=offset)
+
+    def __getattr__(self, name):
+        # Only called for fields that were not accessed or assigned yet
+        if name in ['u', 'v']:
+            uv = self.section_view('uv')
+            if uv is None:
+                raise AttributeError(name)
+            self.u = uv[:, 0]
+            self.v = uv[:, 1]
+            return self.__dict__[name]
+        if name not in DfsMap.sections or name == 'uv' or 'hdr' not in self.__dict__:
+            raise AttributeError(name)
+        view = self.section_view(name)
+        if view is None:
+            raise AttributeError(name)
+        setattr(self, name, view)
+        return view
 
-    class NFV:
-        pass
+
+def readdfs_mmap(fname):
+    """
+    Reads a dfs surface without copying the file into memory. See DfsMap. The file should not be overwritten in place
+    while the surface is in use. Replace it instead, for example with writedfs(..., atomic=True).
+    """
+    return DfsMap(fname)
+
+
+def readdfsattributes(fname):
 
     fid = open(fname, 'rb')
-    hdr.ftype_header = np.fromfile(fid, dtype='S1', count=12)
-    if 'DFS' not in ''.join(hdr.ftype_header):
-        raise ValueError('Invalid dfs file' + fname)  # TODO: Change this to a custom exception in future
-    hdr.hdrsize = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.mdoffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.pdoffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.nTriangles = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.nVertices = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.nStrips = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.stripSize = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.normals = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.uvStart = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.vcoffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.labelOffset = np.fromfile(fid, dtype='int32', count=1)[0]
-    hdr.vertexAttributes = np.fromfile(fid, dtype='int32', count=1)[0]
+    hdr = readdfsheader(fid, fname)
     attributes = []
     if (hdr.vertexAttributes > 0):
         fid.seek(hdr.vertexAttributes)
@@ -118,22 +173,140 @@ def readdfsattributes(fname):
     return attributes
 
 
-def writedfs(fname,NFV):
-    ftype_header = np.array(['D','F','S','_','L','E',' ','v','2','.','0','\x00']) #DFS_LEv2.0\0
+def readdfsheaders(fnames, nVertices):
+    """
+    Reads and checks the headers of many dfs files before their attributes are read. Every file has to be a dfs file
+    with nVertices vertices and a complete attributes section. Returns the headers, and a list of messages for all the
+    files that fail the checks.
+    """
+    headers = []
+    errors = []
+    for fname in fnames:
+        hdr = None
+        try:
+            with open(fname, 'rb') as fid:
+                hdr = readdfsheader(fid, fname)
+            file_size = os.path.getsize(fname)
+        except (IOError, OSError, ValueError) as e:
+            errors.append(fname + ': not a readable dfs file.')
+        if hdr is not None:
+            if hdr.nVertices != nVertices:
+                errors.append(fname + ': ' + str(hdr.nVertices) + ' vertices instead of ' + str(nVertices) + '.')
+            elif hdr.vertexAttributes <= 0:
+                errors.append(fname + ': no attributes.')
+            elif hdr.vertexAttributes + 4 * hdr.nVertices > file_size:
+                errors.append(fname + ': the attributes extend past the end of the file.')
+        headers.append(hdr)
+    return headers, errors
+
+
+def readdfsattributes_into(fname, hdr, attributes):
+    """
+    Reads the attributes of a dfs file with header hdr directly into attributes, a contiguous float32 array of size
+    nVertices
+    """
+    if attributes.dtype != np.float32 or not attributes.flags.c_contiguous or attributes.size != hdr.nVertices:
+        raise ValueError('The attributes of ' + fname + ' need a contiguous float32 array of size ' +
+                         str(hdr.nVertices) + '.')
+    with io.open(fname, 'rb') as fid:
+        fid.seek(hdr.vertexAttributes)
+        if fid.readinto(attributes) != attributes.nbytes:
+            raise ValueError('Invalid dfs file' + fname + '. The attributes extend past the end of the file.')
+    if sys.byteorder == 'big':
+        attributes.byteswap(True)
+    return attributes
+
+
+class DfsTemplateWriter(object):
+    """
+    Writes dfs files that only differ from a template dfs file (usually the atlas) in the attributes and the vertex
+    colors. The template is read once. If it does not have attribute or vertex color sections, they are appended and
+    the header is updated. Each file is written as the template bytes with these two sections replaced, so the geometry,
+    labels and uv coordinates are never serialized again. If atomic is True, files are written as in writebuffers.
+    """
+
+    def __init__(self, template_fname, vcolor=True, atomic=False):
+        if not os.path.exists(template_fname):
+            raise IOError('\nIOError: File name ' + template_fname + ' does not exist.')
+        with open(template_fname, 'rb') as fid:
+            self.template = bytearray(fid.read())
+        self.hdr = parsedfsheader(self.template, template_fname)
+        self.name = template_fname
+        self.atomic = atomic
+        nVertices = self.hdr.nVertices
+        sections = [('vertexAttributes', 4 * nVertices)]
+        if vcolor:
+            sections.append(('vcoffset', 12 * nVertices))
+        for field, nbytes in sections:
+            offset = getattr(self.hdr, field)
+            if offset <= 0:
+                offset = len(self.template)
+                self.template.extend(b'\0' * nbytes)
+                struct.pack_into('<i', self.template, dfsheader_field_offset(field), offset)
+            elif offset + nbytes > len(self.template):
+                raise ValueError('Invalid dfs file' + template_fname + '. The ' + field +
+                                 ' section extends past the end of the file.')
+        self.hdr = parsedfsheader(self.template, template_fname)
+
+    def write(self, fname, attributes, vColor=None):
+        """
+        Writes the template with the given attributes, and vertex colors if given
+        """
+        sections = [(self.hdr.vertexAttributes, np.asarray(attributes, '<f4'), (self.hdr.nVertices,))]
+        if vColor is not None:
+            if self.hdr.vcoffset <= 0:
+                raise ValueError('The template ' + self.name + ' was prepared without vertex colors.')
+            sections.append((self.hdr.vcoffset, np.asarray(vColor, '<f4'), (self.hdr.nVertices, 3)))
+        for offset, values, shape in sections:
+            if values.size != np.prod(shape):
+                raise ValueError('Expected ' + str(np.prod(shape)) + ' values for ' + fname + ', got ' +
+                                 str(values.size) + '.')
+
+        template_view = memoryview(self.template)
+        buffers = []
+        position = 0
+        for offset, values, shape in sorted(sections, key=lambda section: section[0]):
+            buffers.append(template_view[position:offset])
+            buffers.append(np.ascontiguousarray(values))
+            position = offset + values.nbytes
+        buffers.append(template_view[position:])
+        writebuffers(fname, buffers, self.atomic)
+
+
+def writebuffers(fname, buffers, atomic=False):
+    """
+    Writes the buffers (strings, memoryviews or contiguous arrays) one after the other to fname. If atomic is True, the
+    file is written under a temporary name and renamed, so that other processes never see a partially written file.
+    """
+    out_fname = fname
+    if atomic:
+        out_fname = fname + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(out_fname, 'wb') as fid:
+            for buf in buffers:
+                fid.write(buf.data if isinstance(buf, np.ndarray) else buf)
+        if atomic:
+            os.rename(out_fname, fname)
+    except:
+        if atomic and os.path.exists(out_fname):
+            os.remove(out_fname)
+        raise
+
+
+def writedfs(fname, NFV, atomic=False):
+    ftype_header = 'DFS_LE v2.0\x00'
     hdrsize = 184
     mdoffset = 0        # Start of metadata.
     pdoffset = 0       # Start of patient data header.
-    nTriangles = len(NFV.faces.flatten()) / 3
-    nVertices = len(NFV.vertices.flatten()) / 3
+    nTriangles = np.size(NFV.faces) / 3
+    nVertices = np.size(NFV.vertices) / 3
     nStrips = 0
     stripSize = 0
     normals = 0
     uvoffset = 0
     vcoffset = 0
-    precision = 0
     labelOffset = 0
     attributes = 0
-    orientation = np.matrix(np.identity(4), dtype='int32')
     nextarraypos = hdrsize + 12 * (nTriangles + nVertices)  # Start feilds after the header
     if (hasattr(NFV,'normals')):
         #print 'has normals'
@@ -155,36 +328,22 @@ def writedfs(fname,NFV):
         #print 'has attr'
         attributes = nextarraypos
         nextarraypos = nextarraypos + nVertices * 4  #  4 bytes per attribute (float32)
-    fid = open(fname, 'wb')
-    fid.write(np.array(ftype_header, 'S1').tostring())
-    fid.write(np.array(hdrsize, 'int32').tostring())
-    fid.write(np.array(mdoffset, 'int32').tostring())
-    fid.write(np.array(pdoffset, 'int32').tostring())
-    fid.write(np.array(nTriangles, 'int32').tostring())
-    fid.write(np.array(nVertices, 'int32').tostring())
-    fid.write(np.array(nStrips, 'int32').tostring())
-    fid.write(np.array(stripSize, 'int32').tostring())
-    fid.write(np.array(normals, 'int32').tostring())
-    fid.write(np.array(uvoffset, 'int32').tostring())
-    fid.write(np.array(vcoffset, 'int32').tostring())
-    fid.write(np.array(labelOffset, 'int32').tostring())
-    fid.write(np.array(attributes, 'int32').tostring())
-    fid.write(np.zeros([1, 4 + 15 * 8], 'uint8').tostring())
-    fid.write(np.array((NFV.faces), 'int32').tostring())
-    fid.write(np.array(NFV.vertices, 'float32').tostring())
+    buffers = [dfs_header.pack(ftype_header, hdrsize, mdoffset, pdoffset, nTriangles, nVertices, nStrips, stripSize,
+                               normals, uvoffset, vcoffset, labelOffset, attributes),
+               np.ascontiguousarray(NFV.faces, '<i4'),
+               np.ascontiguousarray(NFV.vertices, '<f4')]
     if (normals > 0):
-        #print 'writing normals' 
-        fid.write(np.array(NFV.normals, 'float32').tostring())
+        buffers.append(np.ascontiguousarray(NFV.normals, '<f4'))
     if vcoffset > 0:
-        #print 'writing color'
-        fid.write(np.array(NFV.vColor, 'float32').tostring())
+        buffers.append(np.ascontiguousarray(NFV.vColor, '<f4'))
     if uvoffset > 0:
-        #print 'writing uv'
-        fid.write(np.array([NFV.u.flatten(), NFV.v.flatten()], 'float32').tostring())
+        # uv coordinates are stored as (u, v) pairs for each vertex
+        uv = np.empty((nVertices, 2), '<f4')
+        uv[:, 0] = np.ravel(NFV.u)
+        uv[:, 1] = np.ravel(NFV.v)
+        buffers.append(uv)
     if (labelOffset > 0):
-        #print 'writing labels' 
-        fid.write(np.array(NFV.labels, 'int16').tostring())
+        buffers.append(np.ascontiguousarray(NFV.labels, '<u2'))
     if (attributes > 0):
-        #print 'writing attributes' 
-        fid.write(np.array(NFV.attributes, 'float32').tostring())
-    fid.close()
+        buffers.append(np.ascontiguousarray(NFV.attributes, '<f4'))
+    writebuffers(fname, buffers, atomic)
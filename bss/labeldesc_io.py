@@ -36,11 +36,24 @@ class LabelDesc(object):
     this_dir, this_filename = os.path.split(__file__)
     # TODO: The name brainsuite_labeldescriptions_14May2014.xml is hardcoded. Could be loaded from a conf file in future
     label_desc_file = os.path.join(this_dir, "conf", "brainsuite_labeldescriptions_14May2014.xml")
-    xmldoc = minidom.parse(label_desc_file)
-    idlist = xmldoc.getElementsByTagName('label')
-    labelids = [int(id.attributes['id'].value) for id in idlist]
-    labelnames = [id.attributes['fullname'].value for id in idlist]
-    roilabels = dict(zip(labelids, labelnames))
+    # The label descriptions are parsed on first use by load, and not when the module is imported
+    labelids = None
+    labelnames = None
+    roilabels = None
+
+    @classmethod
+    def load(cls):
+        if cls.roilabels is None:
+            xmldoc = minidom.parse(cls.label_desc_file)
+            idlist = xmldoc.getElementsByTagName('label')
+            cls.labelids = [int(id.attributes['id'].value) for id in idlist]
+            cls.labelnames = [id.attributes['fullname'].value for id in idlist]
+            cls.roilabels = dict(zip(cls.labelids, cls.labelnames))
+        return cls
+
+    @classmethod
+    def roilabel(cls, roiid):
+        return cls.load().roilabels[roiid]
 
     @classmethod
     def read_labeldesc(cls):
@@ -48,6 +61,7 @@ class LabelDesc(object):
 
     @classmethod
     def validate_roiid(cls, roiid):
+        cls.load()
         for i in roiid:
             if i not in cls.labelids:
                 return False
@@ -25,14 +25,12 @@ __copyright__ = "Copyright 2015, Shantanu H. Joshi, Ahmanson-Lovelace Brain Mapp
 __email__ = "s.joshi@g.ucla.edu"
 
 import numpy as np
-import scipy.ndimage as ndimage
 import nii_io
 from nibabel.nifti1 import Nifti1Image
 import sys
 import dfsio
 import excepts
 from nimgdata_io import NimgDataio
-from xml.dom import minidom
 
 
 def jacobian(v1, v2, v3):
@@ -67,6 +65,7 @@ def jacobian_det_image(in_file, out_file, sigma=0):
 
 def smooth_image(img_data_in, sigma=0):
     if sigma > 0:
+        import scipy.ndimage as ndimage
         img_data_out = ndimage.gaussian_filter(img_data_in, sigma)
     else:  # Do not smooth.
         img_data_out = img_data_in
@@ -253,6 +252,7 @@ def roi_sphere_to_mask(roixml, template, mask, roi_num):
     mask_values = np.zeros((1, mask_values.shape[0] * mask_values.shape[1] * mask_values.shape[2]))
     pixdim = np.asarray(nimg_template.get_header().get_zooms())
 
+    from xml.dom import minidom
     doc = minidom.parse(roixml)
     roi_array = doc.getElementsByTagName("ROI")
 
@@ -28,6 +28,7 @@ __credits__ = 'Contributions and ideas: Shantanu H. Joshi, Roger P. Woods, David
               'Inspired by the stats package rshape by Roger P. Woods'
 
 import ConfigParser
+import copy
 import re
 import sys
 from stats_data import StatsData
@@ -48,6 +49,7 @@ class ModelSpec(object):
                     'swmRD': 'swmRD',
                     'swmAD': 'swmAD',
                     }
+    design_types = ['model', 'measure', 'hypothesis']
 
     def __init__(self, modelfile):
         self.subjectid = ''
@@ -68,6 +70,15 @@ class ModelSpec(object):
         self.unique = ''
         self.factors = []
         self.analysis_type = ''
+        # Statistical designs in the modelspec file. The first design is read into this object
+        self.designs = [self]
+        self.design_name = ''
+        self.model_flag = False
+        self.measure_flag = False
+        self.hypothesis_flag = False
+        # Column names of the demographics file, and the data of the columns used by the model
+        self.demographic_columns = []
+        self.demographic_data = None
         self.valid_analysis_types = ['vbm', 'tbm', 'cbm', 'dbm', 'croi', 'droi']
         self.read_success = True
         self.read_modelfile(modelfile)
@@ -116,11 +127,13 @@ class ModelSpec(object):
             return
 
         try:
-            # Read ahead demographics.csv and check if the fileid column points to roiwisetxt files
-            demographics_data = StatsData.read_demographics(self.demographics)
+            # Read ahead the column names and the first row of demographics.csv and check if the fileid column points
+            # to roiwisetxt files. The data is read once by load_demographics after the model is parsed
+            demographics_data = StatsData.read_demographics(self.demographics, nrows=1, check_missing=False)
             if demographics_data is None:
                 self.read_success = False
                 return
+            self.demographic_columns = list(demographics_data.columns)
             if 'roiwise' in demographics_data[self.fileid][0]:
                 self.roimeasure = config.get('subjectinfo', 'roimeasure')
                 temp_roiid = config.get('subjectinfo', 'roiid')
@@ -173,95 +186,145 @@ class ModelSpec(object):
             self.read_success = False
             return
 
-        self.read_success = False
+        # Each [model], [measure] or [hypothesis] section is a separate design. More than one design of the same kind
+        # can be given by naming the sections, e.g. [model age] and [model sex]
+        design_sections = self.design_sections(config)
+        if len(design_sections) == 0:
+            sys.stdout.write('Error: ' + 'The modelspec file ' + modelfile + ' does not contain a statistical design.\n'
+                             'Please include a [model], [measure] or [hypothesis] section.\n')
+            self.read_success = False
+            return
+
+        self.designs = []
+        for section in design_sections:
+            design = self if len(self.designs) == 0 else copy.copy(self)
+            if not design.read_design(config, modelfile, section):
+                self.read_success = False
+                return
+            self.designs.append(design)
+            if design.model_flag:
+                # Null models separated by | in nullmodel= are separate contrasts against the same full model.
+                # ; is not used as a separator, since ConfigParser reads a space followed by ; as a comment
+                nullmodels = [nullmodel.strip() for nullmodel in design.nullmodel.split('|')]
+                design.nullmodel = nullmodels[0]
+                for nullmodel in nullmodels[1:]:
+                    contrast = copy.copy(design)
+                    contrast.nullmodel = nullmodel
+                    self.designs.append(contrast)
+        # The first design is this ModelSpec. The others are copies, which can be used as single design models
+        for design in self.designs[1:]:
+            design.designs = [design]
+        self.read_success = True
+
+        # factorstring = config.get('model', 'factors')
+        # for i in re.split(' ', factorstring):
+        #     self.factors.append(i.rstrip().lstrip())
+
+    @classmethod
+    def design_sections(cls, config):
+        """
+        Returns the sections of the modelspec file that contain a statistical design, optionally followed by a name
+        """
+        return [section for section in config.sections()
+                if len(section.split()) > 0 and section.split()[0] in cls.design_types]
+
+    def read_design(self, config, modelfile, section):
+        """
+        Reads the statistical design in section. Returns False if the design is incorrectly specified.
+        """
+        design_type = section.split()[0]
+        self.design_name = '_'.join(section.split()[1:])
         self.model_flag = False
         self.measure_flag = False
         self.hypothesis_flag = False
-        # Check if all the sections [model], [measure], and [hypothesis] are present
-        self.model_flag = 'model' in config.sections()
-        self.measure_flag = 'measure' in config.sections()
-        self.hypothesis_flag = 'hypothesis' in config.sections()
-        if self.model_flag and self.measure_flag and self.hypothesis_flag:
-            sys.stdout.write('The modelspec.ini can only contain one statistical design ([model] or [measure] or [hypothesis]).\n'
-                             'Multiple designs are not currently supported, but this may change in the future.\n')
-            self.read_success = False
-            return
 
         try:
-            self.modeltype = config.get('model', 'modeltype')
-            self.fullmodel = config.get('model', 'fullmodel')
-            self.nullmodel = config.get('model', 'nullmodel')
-            self.stat_test = config.get('model', 'test')
-            self.model_flag = True
-            self.read_success = True
-        except ConfigParser.NoSectionError:
-            self.read_success = False
+            if design_type == 'model':
+                self.modeltype = config.get(section, 'modeltype')
+                self.fullmodel = config.get(section, 'fullmodel')
+                self.nullmodel = config.get(section, 'nullmodel')
+                self.stat_test = config.get(section, 'test')
+                self.model_flag = True
+
+            elif design_type == 'measure':
+                self.coeff = config.get(section, 'coeff')
+                self.variable = config.get(section, 'variable')
+                self.stat_test = self.coeff
+                # Check if self.variable exists in the demographics file
+                if self.variable not in self.demographic_columns:
+                    sys.stdout.write('The covariate named ' + self.variable + ' specified in the variable= section does '
+                                                                              'not exist in the demographics file ' +
+                                     self.demographics + '. Please check for typos/spelling etc...\n')
+                    return False
+                self.measure_flag = True
+
+            elif design_type == 'hypothesis':
+                self.hypothesis_group = config.get(section, 'group')
+                self.hypothesis_test = config.get(section, 'test')
+                if self.hypothesis_test != "paired_ttest" and self.hypothesis_test != "unpaired_ttest":
+                    sys.stdout.write('Error: Incorrect value for test in {0:s}. '
+                                     '\nValid options for a hypothesis test are paired_ttest or unpaired_ttest.\n'.format(modelfile))
+                    return False
+                self.hypothesis_pair_id = None
+                if self.hypothesis_test == 'unpaired_ttest':
+                    # if test is unpaired and the option "pair=" is specified, then give a warning
+                    if config.has_option(section, 'pair'):
+                        sys.stdout.write('Warning: An unpaired t-test is specified, however the option for pair= is also specified. '
+                                         '\nWill ignore the paired column and run the independent samples t-test.\n')
+
+                if self.hypothesis_test == 'paired_ttest':
+                    # if test is paired, the option "pair=" must be specified
+                    if config.has_option(section, 'pair'):
+                        self.hypothesis_pair_id = config.get(section, 'pair')
+                        if self.hypothesis_pair_id not in self.demographic_columns:
+                            sys.stdout.write('The column for the pair field is missing from {0:s}\n'.format(self.demographics))
+                            return False
+                    else:
+                        sys.stdout.write('For a paired t-test, please specify the paired column variable. '
+                                         'It should exist in your demographics csv file.\n')
+                        return False
+
+                if self.hypothesis_group not in self.demographic_columns:
+                    sys.stdout.write('The column for the group field is missing from {0:s}\n'.format(self.demographics))
+
+                self.stat_test = self.hypothesis_test
+                self.hypothesis_flag = True
+        except ConfigParser.NoOptionError as noopterror:
+            sys.stdout.write('Error: ' + noopterror.message + ' in ' + modelfile + '.\n')
+            return False
+        return True
 
-        try:
-            self.coeff = config.get('measure', 'coeff')
-            self.variable = config.get('measure', 'variable')
-            self.stat_test = self.coeff
-            self.measure_flag = True
-            # Check if self.variable exists in the demographics file
-            if self.variable not in demographics_data.columns:
-                sys.stdout.write('The covariate named ' + self.variable + ' specified in the variable= section does '
-                                                                          'not exist in the demographics file ' +
-                                 self.demographics + '. Please check for typos/spelling etc...\n')
+    def parse_model(self):
+        for design in self.designs:
+            if not design.parse_design():
                 self.read_success = False
                 return
-            self.read_success = True
-        except ConfigParser.NoSectionError:
-            self.read_success = False
 
-        try:
-            self.hypothesis_group = config.get('hypothesis', 'group')
-            self.hypothesis_test = config.get('hypothesis', 'test')
-            if self.hypothesis_test != "paired_ttest" and self.hypothesis_test != "unpaired_ttest":
-                sys.stdout.write('Error: Incorrect value for test in {0:s}. '
-                                 '\nValid options for a hypothesis test are paired_ttest or unpaired_ttest.\n'.format(modelfile))
+        # The output files of each design are named by its prefix, so the prefixes should be different
+        result_prefixes = [design.result_prefix() for design in self.designs]
+        for result_prefix in set(result_prefixes):
+            if result_prefixes.count(result_prefix) > 1:
+                sys.stdout.write('Error: More than one design in the modelspec file would save the results as ' +
+                                 result_prefix + '.\nPlease name the designs differently, e.g. [model age] and [model sex].\n')
+                self.read_success = False
                 return
-            self.hypothesis_pair_id = None
-            if self.hypothesis_test == 'unpaired_ttest':
-                # if test is unpaired and the option "pair=" is specified, then give a warning
-                if config.has_option('hypothesis', 'pair'):
-                    sys.stdout.write('Warning: An unpaired t-test is specified, however the option for pair= is also specified. '
-                                     '\nWill ignore the paired column and run the independent samples t-test.\n')
 
-            if self.hypothesis_test == 'paired_ttest':
-                # if test is paired, the option "pair=" must be specified
-                if config.has_option('hypothesis', 'pair'):
-                    self.hypothesis_pair_id = config.get('hypothesis', 'pair')
-                    if self.hypothesis_pair_id not in demographics_data.keys():
-                        sys.stdout.write('The column for the pair field is missing from {0:s}\n'.format(self.demographics))
-                        return
-                else:
-                    sys.stdout.write('For a paired t-test, please specify the paired column variable. '
-                                     'It should exist in your demographics csv file.\n')
-                    return
-
-            if self.hypothesis_group not in demographics_data.keys():
-                sys.stdout.write('The column for the group field is missing from {0:s}\n'.format(self.demographics))
-
-            self.stat_test = self.hypothesis_test
-            self.hypothesis_flag = True
-            self.read_success = True
-        except ConfigParser.NoSectionError:
+        self.demographic_data = StatsData.read_demographics(self.demographics, usecols=self.used_demographic_columns(),
+                                                            dtype={self.fileid: object})
+        if self.demographic_data is None:
             self.read_success = False
-
-        if self.model_flag:
-            self.read_success = True
-            return
-
-        if self.measure_flag:
-            self.read_success = True
             return
 
+        for design in self.designs:
+            design.demographic_data = self.demographic_data
+            if design.model_flag:
+                # If the unique variable (the main effect in regression) is not numeric show an error and return
+                if not np.isreal(self.demographic_data[design.unique]).any():
+                    sys.stdout.write('The variable for main effect "' + design.unique + '" is not numeric. Please recode as numeric and rerun.\n\n\n')
+                    self.read_success = False
+                    return
 
-        # factorstring = config.get('model', 'factors')
-        # for i in re.split(' ', factorstring):
-        #     self.factors.append(i.rstrip().lstrip())
-
-    def parse_model(self):
+    def parse_design(self):
         if self.model_flag:
             # Parse fullmodel and nullmodel
             set_full = set()
@@ -271,35 +334,58 @@ class ModelSpec(object):
             for i in re.split('\+', self.nullmodel):
                 set_null.add(i.rstrip().lstrip())
             self.unique = list(set_full - set_null)[0]  # TODO check: only one element should be present
-            demographic_data_temp = StatsData.read_demographics(self.demographics)
-            if demographic_data_temp is None:
-                self.read_success = False
-                return
 
             # Check if the covariates specified in the full and null models exist in the demographics file
             for var in set_full:
-                if var not in demographic_data_temp.columns:
+                if var not in self.demographic_columns:
                     sys.stdout.write('The covariate named ' + var + ' specified in the fullmodel= section does '
                                                                               'not exist in the demographics file ' +
                                      self.demographics + '. Please check for typos/spelling etc...\n')
-                    self.read_success = False
-                    return
+                    return False
             for var in set_null:
-                if var not in demographic_data_temp.columns:
+                if var not in self.demographic_columns:
                     sys.stdout.write('The covariate named ' + var + ' specified in the nullmodel= section does '
                                                                               'not exist in the demographics file ' +
                                      self.demographics + '. Please check for typos/spelling etc...\n')
-                    self.read_success = False
-                    return
-
-            # If the unique variable (the main effect in regression) is not numeric show an error and return
-            if not np.isreal(demographic_data_temp[self.unique]).any():
-                sys.stdout.write('The variable for main effect "' + self.unique + '" is not numeric. Please recode as numeric and rerun.\n\n\n')
-                self.read_success = False
-                return
-        elif self.measure_flag:
-            # self.variables = set_full | set_null
-            return
+                    return False
+        return True
+
+    def used_demographic_columns(self):
+        """
+        Returns the demographics columns used by the designs, or None (all columns) for ROI analyses, whose
+        demographics are saved along with the ROI data in roidata.csv
+        """
+        if self.roiid:
+            return None
+        columns = [self.subjectid, self.fileid]
+        for design in self.designs:
+            if design.model_flag:
+                columns += [var.strip() for var in re.split('\+', design.fullmodel) + re.split('\+', design.nullmodel)]
+            if design.measure_flag:
+                columns.append(design.variable)
+            if design.hypothesis_flag:
+                columns += [getattr(design, 'hypothesis_group', None), getattr(design, 'hypothesis_pair_id', None)]
+        return [column for column in self.demographic_columns if column in columns]
+
+    def result_prefix(self):
+        """
+        Returns the prefix of the output files of the design. The name of a named design, e.g. [model age], is
+        prepended to the prefix.
+        """
+        atlas_name = os.path.splitext(os.path.split(self.atlas)[1])[0]
+        result_prefix = ''
+        if self.measure_flag:
+            result_prefix = self.stat_test + '_' + self.variable + '_' + atlas_name
+        elif self.model_flag:
+            result_prefix = self.stat_test + '_' + self.unique + '_' + atlas_name
+        elif self.hypothesis_flag:
+            if self.hypothesis_test == 'paired_ttest':
+                result_prefix = self.stat_test + '_' + self.hypothesis_pair_id + '_' + atlas_name
+            elif self.hypothesis_test == 'unpaired_ttest':
+                result_prefix = self.stat_test + '_' + self.hypothesis_group + '_' + atlas_name
+        if self.design_name:
+            result_prefix = self.design_name + '_' + result_prefix
+        return result_prefix
 
     def nump_full_model(self):  # Number of parameters of full model
         return len(self.fullmodel.split('+'))
@@ -7,6 +7,10 @@ __copyright__ = "Copyright 2016, Shantanu H. Joshi Ahmanson-Lovelace Brain Mappi
 __email__ = "s.joshi@g.ucla.edu"
 
 
+import sys
+
+
 def init():
     import matplotlib as mpl
-    mpl.use('pdf')  # Set backend to pdf
+    if 'matplotlib.backends' not in sys.modules:
+        mpl.use('pdf')  # Set backend to pdf
@@ -28,12 +28,12 @@ import numpy as np
 import struct
 import os
 import sys
+import threading
+from multiprocessing.pool import ThreadPool
 import nibabel as nib
 import dfsio
 import dfcio
 import nii_io
-import pandas
-from scipy.io import savemat, loadmat
 import excepts
 from os.path import splitext
 
@@ -139,44 +139,106 @@ class NimgDataio(object):
         nib.save(new_image, filename)
 
     @staticmethod
-    def read_aggregated_attributes_from_filelist(filelist, attrib_siz):
-        attribute_array = np.empty((len(filelist), attrib_siz), 'float')
+    def read_attributes_from_file(filename, filetype):
+        if filetype == 'surface':
+            return dfsio.readdfsattributes(filename)
+        elif filetype == 'nifti_image':
+            nimgobj = nii_io.readnii(filename)
+            nifti_img = nimgobj.get_data()
+            return np.reshape(nifti_img, (1, nifti_img.size))
+
+    @staticmethod
+    def read_aggregated_attributes_from_filelist(filelist, attrib_siz, num_workers=1, mask_idx=None):
+        # If mask_idx is given, only the masked attributes of each file are kept
+        if mask_idx is None:
+            attribute_array = np.empty((len(filelist), attrib_siz), 'float')
+        else:
+            attribute_array = np.empty((len(filelist), len(mask_idx)), 'float')
         filelist = [i.rstrip().lstrip() for i in filelist]
         for i in range(0, len(filelist)):
-            if not os.path.isfile(filelist[i].rstrip().lstrip()):
+            if not os.path.isfile(filelist[i]):
                 raise IOError('File  ' + filelist[i] + ' does not exist.\n')
-                # sys.stdout.write('File: ' + filelist[i] + ' does not exist.\n')
-                # return []
+        if len(filelist) == 0:
+            # Nothing to read. StatsData.read checks for the empty array
+            return attribute_array
+
+        filext = NimgDataio.findext(filelist[0])
+        if filext not in NimgDataio.datatype.keys():
+            raise TypeError('Error: Unsupported data type. Supported data types are: ' + ', '.join(NimgDataio.datatype.keys()))
+        filetype = NimgDataio.datatype[filext]
 
+        dfs_headers = None
+        if filetype == 'surface':
+            # Check all the surfaces before reading any attributes, and report every surface that does not match
+            dfs_headers, errors = dfsio.readdfsheaders(filelist, attrib_siz)
+            if len(errors) > 0:
+                sys.stdout.write('The following files do not match the atlas:\n' + '\n'.join(errors) +
+                                 '\nPlease check if the hemispheres match. Quitting.\n')
+                return []
+
+        # Set by the first worker that fails a check, so that the remaining workers skip their files
+        stop_event = threading.Event()
+        # Per thread buffer for reading the attributes of one surface
+        thread_buffers = threading.local()
+
+        def read_row(i):
+            if stop_event.is_set():
+                return i, None
             sys.stdout.write('Reading file ' + filelist[i] + '.\n')
             sys.stdout.flush()
-            filext = NimgDataio.findext(filelist[0])
-            # filenamewoext, ext = os.path.splitext(filelist[0])
-            if filext not in NimgDataio.datatype.keys():
-                raise TypeError('Error: Unsupported data type. Supported data types are: ' + ', '.join(NimgDataio.datatype.keys()))
-            elif NimgDataio.datatype[filext] == 'surface':
-                attributes = dfsio.readdfsattributes(filelist[i])
-            elif NimgDataio.datatype[filext] == 'nifti_image':
-                nimgobj = nii_io.readnii(filelist[i])
-                nifti_img = nimgobj.get_data()
-                attributes = np.reshape(nifti_img, (1, nifti_img.size))
+            try:
+                if dfs_headers is not None:
+                    if not hasattr(thread_buffers, 'attributes'):
+                        thread_buffers.attributes = np.empty(attrib_siz, np.float32)
+                    attributes = dfsio.readdfsattributes_into(filelist[i], dfs_headers[i], thread_buffers.attributes)
+                else:
+                    attributes = NimgDataio.read_attributes_from_file(filelist[i], filetype)
+            except:
+                stop_event.set()
+                raise
             if attributes.size != attrib_siz:
-                sys.stdout.write("Length of attributes in File " + filelist[i] + " and the atlas do not match. "
-                                                                                  "Please check if the hemispheres match. Quitting.\n")
-                attribute_array = []
-                return attribute_array
-            else:
+                stop_event.set()
+                return i, False
+            if mask_idx is None:
                 attribute_array[i, :] = attributes
+            else:
+                attribute_array[i, :] = np.ravel(attributes)[mask_idx]
+            return i, True
+
+        mismatch_file = None
+        if num_workers > 1:
+            pool = ThreadPool(min(num_workers, len(filelist)))
+            try:
+                for i, read_ok in pool.imap_unordered(read_row, range(0, len(filelist))):
+                    if read_ok is False:
+                        mismatch_file = filelist[i]
+                        break
+            finally:
+                stop_event.set()
+                pool.close()
+                pool.join()
+        else:
+            for i in range(0, len(filelist)):
+                if read_row(i)[1] is False:
+                    mismatch_file = filelist[i]
+                    break
+
+        if mismatch_file is not None:
+            sys.stdout.write("Length of attributes in File " + mismatch_file + " and the atlas do not match. "
+                                                                                "Please check if the hemispheres match. Quitting.\n")
+            attribute_array = []
         return attribute_array
 
     @staticmethod
     def read_aggregated_attributes(filename):
+        import pandas
         data_list = pandas.read_table(filename, sep='\t')
         filelist = data_list['File']
         return NimgDataio.read_aggregated_attributes_from_filelist(filelist)
 
     @staticmethod
     def export_data_to_mat(filelist, outputfile):
+        from scipy.io import savemat
         fid = open(filelist, 'rt')
         filenames = [filename.rstrip('\n') for filename in fid.readlines()]
 
@@ -194,6 +256,7 @@ class NimgDataio(object):
         if filext == '.txt':
             attributes = np.loadtxt(attribute_file)
         elif filext == '.mat':
+            from scipy.io import loadmat
             temp = loadmat(attribute_file)
             attributes = temp[temp.keys()[0]]  # Just read the first variable in the .mat file
         else:
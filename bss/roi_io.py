@@ -31,7 +31,6 @@ import numpy as np
 import struct
 import os
 import sys
-import pandas
 
 measure_dict = {'gmthickness': 'Mean_Thickness(mm)',
                 'gmvolume': 'GM_Volume(mm^3)',
@@ -56,6 +55,7 @@ def read_roistats_txt(fname, roiid='', roimeasure='gmthickness'):
     fid.close()
     # Check if first 6 characters are ROI_ID
     if first_line[:6] == 'ROI_ID':
+        import pandas
         roiwise_stats = pandas.read_table(fname, na_values='NaN', keep_default_na=False, index_col=0)
         if not roiid:  # Read all ROIs
             return np.array(roiwise_stats[measure_dict[roimeasure]])
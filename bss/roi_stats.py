@@ -26,15 +26,26 @@ __copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lov
 __email__ = "s.joshi@ucla.edu"
 
 
-from statsmodels.formula.api import ols
-import statsmodels.api as sm
+import numpy as np
+import pandas
+import scipy.stats
+from scipy.linalg import solve_triangular
+from patsy import dmatrix
 from stats_roi_result import StatsRoiResult
+import stats_glm
+import excepts
 from collections import namedtuple
 from bss.labeldesc_io import LabelDesc
 from sys import stdout
 
 
+# statsmodels is imported in the functions that use it, since importing it is slow and only ROI analyses need it
+
+
 def anova_roi_sm(model, sdata):
+    from statsmodels.formula.api import ols
+    import statsmodels.api as sm
+
     siz = sdata.phenotype_array.shape[1]
     statsresult = StatsRoiResult()
 
@@ -61,6 +72,89 @@ def anova_roi_sm(model, sdata):
     return statsresult
 
 
+class OLSColumns(object):
+    """
+    Ordinary least squares fit of one design matrix to many responses (ROIs) with a single QR factorization and solve.
+    The coefficients, residual sums of squares and residual degrees of freedom of every response come from that solve.
+    """
+
+    def __init__(self, X_design, Y):
+        self.X_design = X_design
+        self.Y = Y
+        X = np.asarray(X_design, dtype=float)
+        Q, R = stats_glm.qr_factor(X)
+        self.params = solve_triangular(R, np.dot(Q.T, np.asarray(Y, dtype=float)))
+        residual = np.asarray(Y, dtype=float) - np.dot(X, self.params)
+        self.ssr = np.einsum('ij,ij->j', residual, residual)
+        self.df_resid = float(X.shape[0] - X.shape[1])
+        R_inv = solve_triangular(R, np.eye(R.shape[0]))
+        self.normalized_cov_params = np.dot(R_inv, R_inv.T)
+
+    def result(self, column_idx):
+        """
+        Statsmodels OLS results of one response, made with the public constructors from the solved coefficients
+        """
+        from statsmodels.regression.linear_model import OLS, OLSResults, RegressionResultsWrapper
+
+        return RegressionResultsWrapper(OLSResults(OLS(self.Y.iloc[:, column_idx], self.X_design),
+                                                   self.params[:, column_idx],
+                                                   normalized_cov_params=self.normalized_cov_params))
+
+    @staticmethod
+    def anova_tables(fits_null, fits_full):
+        """
+        F tests of the null against the full model for every response, as tables laid out like sm.stats.anova_lm
+        """
+        df_diff = fits_null.df_resid - fits_full.df_resid
+        ss_diff = fits_null.ssr - fits_full.ssr
+        Fstat = ss_diff/df_diff/(fits_full.ssr/fits_full.df_resid)
+        pvalues = scipy.stats.f.sf(Fstat, df_diff, fits_full.df_resid)
+        tables = []
+        for i in range(0, len(Fstat)):
+            tables.append(pandas.DataFrame({'df_resid': [fits_null.df_resid, fits_full.df_resid],
+                                            'ssr': [fits_null.ssr[i], fits_full.ssr[i]],
+                                            'df_diff': [0.0, df_diff],
+                                            'ss_diff': [np.nan, ss_diff[i]],
+                                            'F': [np.nan, Fstat[i]],
+                                            'Pr(>F)': [np.nan, pvalues[i]]},
+                                           columns=['df_resid', 'ssr', 'df_diff', 'ss_diff', 'F', 'Pr(>F)']))
+        return tables
+
+
+def anova_roi_np(model, sdata):
+    """
+    Same as anova_roi_sm, but all ROIs are fitted together with one solve for the full and one for the null model
+    """
+    statsresult = StatsRoiResult()
+
+    stdout.write('Computing regressions for ROIs...')
+    stdout.flush()
+
+    roi_columns = ['ROI_' + str(roi_idx) for roi_idx in sdata.roiid]
+    Y = sdata.demographic_data[roi_columns]
+    try:
+        fits_full = OLSColumns(dmatrix(model.fullmodel, data=sdata.demographic_data, return_type='dataframe'), Y)
+        fits_null = OLSColumns(dmatrix(model.nullmodel, data=sdata.demographic_data, return_type='dataframe'), Y)
+    except np.linalg.LinAlgError as e:
+        raise excepts.ModelFailureError('Error in solving the linear system. Perhaps the data is insufficient to fit the model?\n')
+    model_diffs = OLSColumns.anova_tables(fits_null, fits_full)
+
+    roi_r_cmd_list = []
+    roi_cmd_result_list = []
+
+    for roi_num, roi_idx in enumerate(sdata.roiid):
+        stdout.write(str(roi_idx) + ', ')
+        stdout.flush()
+        roi_r_cmd_list.append(generate_r_commands(roi_idx, model))
+        roi_cmd_result_list.append(generate_sm_result(fits_full.result(roi_num), fits_null.result(roi_num),
+                                                      model_diffs[roi_num]))
+
+    statsresult.pvalues = 0
+    statsresult.cmd_str_list = roi_r_cmd_list
+    statsresult.cmd_result_str_list = roi_cmd_result_list
+    return statsresult
+
+
 def generate_r_commands(roi_idx, model):
 
     cmd_list = []
@@ -70,7 +164,7 @@ def generate_r_commands(roi_idx, model):
     cmd_list.append(rCmd("lm_null <- lm (\'ROI_{0:s} ~ {1:s}\', data=roidataframe)".format(str(roi_idx), model.nullmodel), False, False, ''))
     cmd_list.append(rCmd("summary(lm_null)", False, False, ''))
     cmd_list.append(rCmd('lm_compare <- anova(lm_full, lm_null)', False, False, ''))
-    cmd_list.append(rCmd('lm_compare', False, True, 'Main effect of {0:s} {1:s} on {2:s} controlling for {3:s}'.format(LabelDesc.roilabels[roi_idx], model.roimeasure, model.unique, model.nullmodel)))
+    cmd_list.append(rCmd('lm_compare', False, True, 'Main effect of {0:s} {1:s} on {2:s} controlling for {3:s}'.format(LabelDesc.roilabel(roi_idx), model.roimeasure, model.unique, model.nullmodel)))
 
     return cmd_list
 
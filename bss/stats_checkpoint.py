@@ -0,0 +1,133 @@
+#! /usr/local/epd/bin/python
+
+"""Checkpoints of partial statistical results for resuming interrupted runs"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+
+import numpy as np
+import os
+import sys
+import json
+import shutil
+import hashlib
+from stats_data_cache import StatsDataCache
+
+
+class StatsCheckpoint(object):
+    """
+    Saves finished blocks and permutation batches of a run as .npz files in the checkpoint directory inside the
+    output directory. A resumed run reuses these only if the model, the data files and the run options are unchanged.
+    """
+
+    checkpoint_version = 1
+    checkpoint_dirname = 'bss_checkpoint'
+    model_fields = ['analysis_type', 'stat_test', 'modeltype', 'demographics', 'atlas', 'fileid', 'subjectid',
+                    'fullmodel', 'nullmodel', 'unique', 'variable', 'hypothesis_test', 'hypothesis_group',
+                    'hypothesis_pair_id', 'maskfile', 'maskroiid']
+
+    def __init__(self, outdir, resume=False):
+        self.checkpoint_dir = os.path.join(outdir, StatsCheckpoint.checkpoint_dirname)
+        self.resume = resume
+        self.info = None
+
+    @staticmethod
+    def data_key(model, stats_data):
+        key = hashlib.sha1()
+        key.update(repr(StatsCheckpoint.checkpoint_version))
+        for design in getattr(model, 'designs', [model]):
+            for field in StatsCheckpoint.model_fields:
+                key.update(repr((field, getattr(design, field, None))))
+        key.update(repr(StatsDataCache.file_signature(model.demographics)))
+        # The atlas and the masks decide which vertices are in the phenotype array, so edited masks are not reused
+        key.update(repr(StatsDataCache.file_signature(model.atlas)))
+        key.update(repr(StatsDataCache.file_signature(getattr(model, 'maskfile', None))))
+        key.update(repr(getattr(model, 'maskroiid', None)))
+        for filename in stats_data.demographic_data[model.fileid]:
+            key.update(repr(StatsDataCache.file_signature(filename)))
+        key.update(repr(stats_data.phenotype_array.shape))
+        return key.hexdigest()
+
+    def info_file(self):
+        return os.path.join(self.checkpoint_dir, 'checkpoint.json')
+
+    def result_file(self, name):
+        return os.path.join(self.checkpoint_dir, name + '.npz')
+
+    def load_info(self):
+        if not os.path.isfile(self.info_file()):
+            return None
+        try:
+            with open(self.info_file(), 'rt') as fid:
+                return json.load(fid)
+        except (IOError, ValueError):
+            return None
+
+    def start(self, info):
+        """
+        Starts a new checkpoint with info (a json serializable dict describing the run). If resuming and the saved
+        checkpoint was made with the same info, its results are kept. Returns True if the run is resumed.
+        """
+        self.info = info
+        if self.resume:
+            saved_info = self.load_info()
+            if saved_info == json.loads(json.dumps(info)):
+                sys.stdout.write('Resuming from the checkpoint in ' + self.checkpoint_dir + '.\n')
+                return True
+            if saved_info is not None:
+                sys.stdout.write('Warning: The checkpoint in ' + self.checkpoint_dir + ' was made with a different '
+                                 'model, data or options. Starting over.\n')
+        self.clear()
+        try:
+            os.makedirs(self.checkpoint_dir)
+            with open(self.info_file(), 'wt') as fid:
+                json.dump(info, fid, indent=1, sort_keys=True)
+        except (IOError, OSError) as e:
+            sys.stdout.write('\nWarning: Could not create the checkpoint in ' + self.checkpoint_dir + ': ' +
+                             str(e) + '\n')
+        return False
+
+    def has(self, name):
+        return os.path.isfile(self.result_file(name))
+
+    def load(self, name):
+        try:
+            with np.load(self.result_file(name)) as npzfile:
+                return dict((key, npzfile[key]) for key in npzfile.files)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, name, **arrays):
+        # Write to a temporary file first and rename, so that an interrupted run never leaves a partial result
+        try:
+            tmp_filename = self.result_file(name) + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_filename, 'wb') as fid:
+                np.savez(fid, **arrays)
+            os.rename(tmp_filename, self.result_file(name))
+        except (IOError, OSError) as e:
+            sys.stdout.write('\nWarning: Could not save the checkpoint ' + self.result_file(name) + ': ' + str(e) + '\n')
+
+    def clear(self):
+        if os.path.isdir(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
@@ -40,12 +40,13 @@ from labeldesc_io import LabelDesc
 import scipy.io
 # from stats_roidata import StatsROIData
 from nimgdata_io import NimgDataio
+from atlas_cache import AtlasCache
 import roi_io
 
 
 class StatsData(object):
 
-    def __init__(self, demographics_file, model, max_block_size=20000, roi=False):
+    def __init__(self, demographics_file, model, max_block_size=20000, roi=False, num_read_workers=1, cache=None):
         self.demographic_data = ''
         self.dataframe = None
         self.roi_dataframe = None
@@ -59,11 +60,18 @@ class StatsData(object):
         self.phenotype_array = []
         self.data_read_flag = False
         self.max_block_size = max_block_size
+        self.num_read_workers = num_read_workers
+        self.cache = cache
         self.attrib_siz = 0
         self.datatype = NimgDataio.datatype[NimgDataio.findext(model.atlas)]
         self.mask_idx = []
+        self.read_mask_idx = None
 
-        self.demographic_data = self.read_demographics(demographics_file)
+        if getattr(model, 'demographic_data', None) is not None and model.demographics == demographics_file:
+            # The model specification has already read and checked the demographics
+            self.demographic_data = model.demographic_data
+        else:
+            self.demographic_data = self.read_demographics(demographics_file)
         if self.demographic_data is None:
             self.data_read_flag = False
             return
@@ -85,13 +93,13 @@ class StatsData(object):
             self.data_read_flag = False
             return
         if self.datatype == 'nifti_image':
-            self.atlas_data = NimgDataio.read(model.atlas, attributes_only=True)
+            self.atlas_data = AtlasCache.nifti_image_as_array(model.atlas)
         elif self.datatype == 'surface':
-            self.atlas_data = NimgDataio.read(model.atlas, attributes_only=False)
+            self.atlas_data = AtlasCache.surface(model.atlas)
 
         # If ROI masks are set, validate them if they belong to the correct atlas
         if model.maskroiid:
-            if not LabelDesc.validate_roiid_only_against_atlas_labels(model.maskroiid, self.atlas_data.labels):
+            if not LabelDesc.validate_roiid_only_against_atlas_labels(model.maskroiid, self.atlas_data.label_ids):
                 sys.stdout.write('One or more ROI labels {0:s} are not valid or do not belong to the atlas.\n'
                                  'If the ROI is valid please check if it belongs to the correct hemisphere.\n'
                                  .format(', '.join(str(x) for x in model.maskroiid)))
@@ -104,49 +112,79 @@ class StatsData(object):
         elif self.datatype == 'surface':
             self.attrib_siz = self.atlas_data.vertices.shape[0]
             self.mask_idx = np.arange(0, self.atlas_data.vertices.shape[0])
-        self.read(model)
 
-        # After the data is read and if the maskroiid is set, mask the surface attributes by the ROI labels
+        # Load the masks before reading the data, so that each subject is reduced to the masked vertices/voxels as it is read
         if model.maskroiid:
-            self.mask_idx = np.empty((0, ), dtype=np.uint16)
+            self.read_mask_idx = np.empty((0, ), dtype=np.uint16)
             for idx in model.maskroiid:
-                self.mask_idx = np.append(self.mask_idx, (self.atlas_data.labels == idx).nonzero()[0])
-            self.phenotype_array = self.phenotype_array[:, self.mask_idx]
+                self.read_mask_idx = np.append(self.read_mask_idx, (self.atlas_data.labels == idx).nonzero()[0])
 
-        # After the data is read, check if mask file exists
         if model.maskfile:
             if not os.path.exists(model.maskfile):
                 raise IOError('Mask file ' + model.maskfile + ' does not exist.')
 
-            self.mask_idx = NimgDataio.read_nifi_image_mask_idx(model.maskfile)
-            self.phenotype_array = self.phenotype_array[:, self.mask_idx]
+            maskfile_idx = NimgDataio.read_nifi_image_mask_idx(model.maskfile)
+            if self.read_mask_idx is None:
+                self.read_mask_idx = maskfile_idx
+            else:
+                self.read_mask_idx = self.read_mask_idx[maskfile_idx]
+
+        if self.read_mask_idx is not None:
+            self.mask_idx = self.read_mask_idx
+
+        # Map the masked phenotype array from the cache if the subject files and masks have not changed
+        cache_key = None
+        if self.cache is not None and not self.roi_flag:
+            cache_key = self.cache.cache_key(self.demographic_data[model.fileid], model.atlas, model.maskfile,
+                                             model.maskroiid)
+            cached_data = self.cache.load(cache_key)
+            if cached_data is not None:
+                self.phenotype_array, self.mask_idx = cached_data
+                self.data_read_flag = True
+                self.create_blocks_idx()
+                return
 
+        self.read(model)
+
+        if self.data_read_flag:
+            # Blocks are created after masking, so that they index into the masked phenotype array
+            self.create_blocks_idx()
+            if cache_key is not None:
+                self.cache.save(cache_key, self.phenotype_array, self.mask_idx)
         return
 
     @classmethod
-    def read_demographics(cls, demographics_file):
+    def read_demographics(cls, demographics_file, usecols=None, nrows=None, check_missing=True, dtype=None):
+        """
+        Reads the demographics csv/txt file. If usecols is given, only these columns are read. If check_missing is
+        True, None is returned if any of the values read are missing.
+        """
         if not os.path.isfile(demographics_file):
             sys.stdout.write('Demographics file: ' + demographics_file + ' does not exist.\n')
             demographic_data = None
             return
 
+        column_dtype = {'subjID': object}
+        if dtype is not None:
+            column_dtype.update(dtype)
         filename, ext = os.path.splitext(demographics_file)
         if ext == '.csv':
-            demographic_data = pandas.read_csv(demographics_file, dtype={'subjID': object})
+            demographic_data = pandas.read_csv(demographics_file, dtype=column_dtype, usecols=usecols, nrows=nrows)
         elif ext == '.txt':
-            demographic_data = pandas.read_table(demographics_file, dtype={'subjID': object})
+            demographic_data = pandas.read_table(demographics_file, dtype=column_dtype, usecols=usecols, nrows=nrows)
 
-        # Iterate over all columns, and check if any of the values
-        # are NaN for missing data
-        for columns in demographic_data.columns.values:
-            if len(np.where(demographic_data[columns].isnull())[0]) > 0:
+        # Check all columns at once for NaNs from missing data
+        if check_missing:
+            missing_columns = demographic_data.columns[demographic_data.isnull().any().values]
+            if len(missing_columns) > 0:
                 sys.stdout.write('Error: Some data may be missing from the demographics file: ' + demographics_file + '. ' +
+                                 '\nMissing values were found in the columns: ' +
+                                 ', '.join(str(column) for column in missing_columns) + '.' +
                                  '\nIf nothing seems wrong at the first glance and if its a csv file, please open it in a '
                                  '\nplain text editor and check if there are missing values, rows, or columns.' +
                                  '\nAlso make sure there are no extra comma\'s at the end.' +
                                  '. Will quit now.\n')
                 demographic_data = None
-                break
         return demographic_data
 
     def validate_data(self):
@@ -156,7 +194,9 @@ class StatsData(object):
     def read(self, model):
         if not self.roi_flag:
             self.phenotype_array = NimgDataio.read_aggregated_attributes_from_filelist(self.demographic_data[model.fileid],
-                                                                                       self.attrib_siz)
+                                                                                       self.attrib_siz,
+                                                                                       num_workers=self.num_read_workers,
+                                                                                       mask_idx=self.read_mask_idx)
         else:
             self.roiid = model.roiid
             self.roimeasure = model.roimeasure
@@ -169,20 +209,21 @@ class StatsData(object):
         else:
             self.data_read_flag = True
             # self.create_data_frame(model)
-
-            self.blocks_idx = []
-            # At this point the data is completely read, so create indices of blocks
-            if self.phenotype_array.shape[1] > self.max_block_size:
-                quotient, remainder = divmod(self.phenotype_array.shape[1], self.max_block_size)
-                for i in np.arange(quotient)+1:
-                    self.blocks_idx.append(((i-1)*self.max_block_size, (i-1)*self.max_block_size + self.max_block_size))
-                if remainder != 0:
-                    i = quotient + 1
-                    self.blocks_idx.append(((i-1)*self.max_block_size, (i-1)*self.max_block_size + remainder))
-            else:
-                self.blocks_idx.append((0, self.phenotype_array.shape[1]))
             return
 
+    def create_blocks_idx(self):
+        self.blocks_idx = []
+        # At this point the data is completely read, so create indices of blocks
+        if self.phenotype_array.shape[1] > self.max_block_size:
+            quotient, remainder = divmod(self.phenotype_array.shape[1], self.max_block_size)
+            for i in np.arange(quotient)+1:
+                self.blocks_idx.append(((i-1)*self.max_block_size, (i-1)*self.max_block_size + self.max_block_size))
+            if remainder != 0:
+                i = quotient + 1
+                self.blocks_idx.append(((i-1)*self.max_block_size, (i-1)*self.max_block_size + remainder))
+        else:
+            self.blocks_idx.append((0, self.phenotype_array.shape[1]))
+
     def read_subject_file(self, model):
         for filename in self.demographic_data[model.fileid]:
             self.phenotype_files.append(filename)
@@ -315,3 +356,14 @@ class StatsData(object):
         #         demographic_data_copy['ROI_'+str(roi)] = self.phenotype_array[:, idx]
         #
         #     demographic_data_copy.to_csv(filename, float_format='%10.6f', index=False)
+
+
+class StatsDataBlock(object):
+    """
+    A block of vertices/voxels of a StatsData object. Can be passed to the np statistical commands in place of StatsData.
+    """
+
+    def __init__(self, stats_data, block_start, block_end):
+        self.demographic_data = stats_data.demographic_data
+        self.phenotype_array = stats_data.phenotype_array[:, block_start:block_end]
+        self.blocks_idx = [(0, block_end - block_start)]
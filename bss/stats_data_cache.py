@@ -0,0 +1,102 @@
+#! /usr/local/epd/bin/python
+
+"""On-disk cache for the aggregated phenotype array"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+import os
+import sys
+import hashlib
+
+
+class StatsDataCache(object):
+    """
+    Stores the phenotype array (after masking) together with the mask indices as .npy files in cache_dir.
+    Cached arrays are memory-mapped read-only when loaded. Nothing is evicted from cache_dir, so the cache is only used
+    for a directory given explicitly by the user.
+    """
+
+    cache_version = 1
+
+    def __init__(self, cache_dir, rebuild=False):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.rebuild = rebuild
+
+    @staticmethod
+    def file_signature(filename):
+        if not filename:
+            return None
+        filename = os.path.abspath(filename.rstrip().lstrip())
+        if not os.path.isfile(filename):
+            return filename, None, None
+        filestat = os.stat(filename)
+        return filename, filestat.st_size, filestat.st_mtime
+
+    @staticmethod
+    def cache_key(filelist, atlas, maskfile=None, maskroiid=None):
+        key = hashlib.sha1()
+        key.update(repr(StatsDataCache.cache_version))
+        for filename in filelist:
+            key.update(repr(StatsDataCache.file_signature(filename)))
+        key.update(repr(StatsDataCache.file_signature(atlas)))
+        key.update(repr(StatsDataCache.file_signature(maskfile)))
+        key.update(repr(maskroiid))
+        return key.hexdigest()
+
+    def phenotype_array_file(self, key):
+        return os.path.join(self.cache_dir, key + '_phenotype_array.npy')
+
+    def mask_idx_file(self, key):
+        return os.path.join(self.cache_dir, key + '_mask_idx.npy')
+
+    def load(self, key):
+        if self.rebuild:
+            return None
+        if not os.path.isfile(self.phenotype_array_file(key)) or not os.path.isfile(self.mask_idx_file(key)):
+            return None
+        try:
+            phenotype_array = np.load(self.phenotype_array_file(key), mmap_mode='r')
+            mask_idx = np.load(self.mask_idx_file(key))
+        except (IOError, ValueError) as e:
+            sys.stdout.write('Warning: Could not read the data cache ' + self.phenotype_array_file(key) +
+                             '. The subject files will be read again.\n')
+            return None
+        sys.stdout.write('Using cached data from ' + self.phenotype_array_file(key) + '.\n')
+        return phenotype_array, mask_idx
+
+    def save(self, key, phenotype_array, mask_idx):
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            sys.stdout.write('Saving data cache to ' + self.phenotype_array_file(key) + '...')
+            # Write to temporary files first and rename, so that concurrent runs never map a partial file
+            for filename, array in [(self.mask_idx_file(key), mask_idx), (self.phenotype_array_file(key), phenotype_array)]:
+                tmp_filename = filename + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp_filename, 'wb') as fid:
+                    np.save(fid, np.asarray(array))
+                os.rename(tmp_filename, filename)
+            sys.stdout.write('Done.\n')
+        except (IOError, OSError) as e:
+            sys.stdout.write('\nWarning: Could not save the data cache to ' + self.cache_dir + ': ' + str(e) + '\n')
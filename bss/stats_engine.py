@@ -28,15 +28,36 @@ __credits__ = 'Contributions and ideas: Shantanu H. Joshi, Roger P. Woods, David
               'Inspired by the stats package rshape by Roger P. Woods'
 
 import sys
+import numpy as np
+from multiprocessing import Pool
 import cbm_stats
 import tbm_stats
 import roi_stats
+import stats_permutation
+from stats_checkpoint import StatsCheckpoint
+from stats_data import StatsDataBlock
+from stats_result import StatsResult
+
+# (commands, designs, stats_data) for the worker processes. Set before the pool is created, so that the workers inherit
+# the phenotype array from the parent process instead of receiving a pickled copy.
+_block_command = None
+
+
+def run_command_on_block(block):
+    commands, designs, stats_data = _block_command
+    block_start, block_end = block
+    stats_data_block = StatsDataBlock(stats_data, block_start, block_end)
+    return block_start, block_end, [command(design, stats_data_block) for command, design in zip(commands, designs)]
 
 
 class StatsEngine(object):
 
-    def __init__(self, model, stats_data, engine='sm', roi=False):
+    def __init__(self, model, stats_data, engine='sm', roi=False, jobs=1, permutations=0, seed=None, checkpoint=None):
         self.engine = engine
+        self.checkpoint = checkpoint
+        self.jobs = jobs
+        self.permutations = permutations
+        self.seed = seed
         self.model = model
         self.stats_data = stats_data
         self.commands_statmodels = None
@@ -63,14 +84,149 @@ class StatsEngine(object):
         if self.engine == 'sm':
             self.roicommands = {'anova': roi_stats.anova_roi_sm,
                                 }
+        elif self.engine == 'np':
+            self.roicommands = {'anova': roi_stats.anova_roi_np,
+                                }
 
     def run(self):
+        return self.run_designs([self.model])[0]
+
+    def run_designs(self, designs=None):
+        """
+        Runs the tests of designs (by default all the designs of the model specification) and returns a list with the
+        result of each design. The tests are computed together in one pass over the blocks of the data.
+        """
+        if designs is None:
+            designs = self.model.designs
         sys.stdout.write('Running the statistical model. This may take a while...')
         if not self.roi:
-            statsresult = self.commands[self.model.analysis_type + '_' + self.model.stat_test](self.model, self.stats_data)
-            statsresult.adjust_for_multi_comparisons()
+            commands = [self.commands[design.analysis_type + '_' + design.stat_test] for design in designs]
+            if self.checkpoint is not None:
+                self.start_checkpoint(designs)
+            if self.jobs > 1 or self.checkpoint is not None or len(designs) > 1:
+                # Several designs are run block by block, so that every block of the data is visited only once
+                statsresults = self.run_blocks(commands, designs)
+            else:
+                statsresults = [command(design, self.stats_data) for command, design in zip(commands, designs)]
+            for design_num, design in enumerate(designs):
+                statsresult = statsresults[design_num]
+                if self.permutations > 0:
+                    pvalues_fwer = stats_permutation.max_stat_pvalues(design.stat_test, design, self.stats_data,
+                                                                      self.permutations, seed=self.seed, jobs=self.jobs,
+                                                                      checkpoint=self.checkpoint,
+                                                                      checkpoint_suffix=self.checkpoint_suffix(design_num))
+                    statsresult.pvalues_fwer = np.where(statsresult.pvalues < 0, -1, 1)*pvalues_fwer
+                statsresult.adjust_for_multi_comparisons()
         else:
-            statsresult = self.roicommands[self.model.stat_test](self.model, self.stats_data)
+            statsresults = [self.roicommands[design.stat_test](design, self.stats_data) for design in designs]
         sys.stdout.write('Done.\n')
 
-        return statsresult
+        return statsresults
+
+    def parallel_blocks_idx(self):
+        blocks_idx = self.stats_data.blocks_idx
+        if len(blocks_idx) < self.jobs:
+            # Split the data further so that every worker gets a block
+            block_edges = np.linspace(0, self.stats_data.phenotype_array.shape[1], self.jobs + 1).astype(int)
+            blocks_idx = [(block_edges[i], block_edges[i+1]) for i in range(0, self.jobs) if block_edges[i+1] > block_edges[i]]
+        return blocks_idx
+
+    def start_checkpoint(self, designs):
+        if self.permutations > 0 and self.seed is None:
+            # Draw the seed here and keep it in the checkpoint, so that a resumed run continues the same permutations
+            saved_info = self.checkpoint.load_info() if self.checkpoint.resume else None
+            if saved_info is not None and saved_info.get('seed') is not None:
+                self.seed = saved_info['seed']
+            else:
+                self.seed = int(np.random.randint(0, 2**31 - 1))
+        self.checkpoint.start({'data': StatsCheckpoint.data_key(self.model, self.stats_data),
+                               'engine': self.engine,
+                               'blocks': [[int(block_start), int(block_end)]
+                                          for block_start, block_end in self.parallel_blocks_idx()],
+                               'permutations': self.permutations,
+                               'permutation_batch_size': stats_permutation.permutation_batch_size,
+                               'seed': self.seed,
+                               })
+
+    @staticmethod
+    def checkpoint_suffix(design_num):
+        # The results of the first design keep the names of a single design run
+        return '' if design_num == 0 else '_design' + str(design_num)
+
+    @staticmethod
+    def block_checkpoint_name(block_start, block_end, design_num=0):
+        return 'block_' + str(block_start) + '_' + str(block_end) + StatsEngine.checkpoint_suffix(design_num)
+
+    @staticmethod
+    def add_block_result(statsresult, block_start, block_end, block_result):
+        statsresult.pvalues[block_start:block_end] = block_result.pvalues
+        statsresult.tvalues[block_start:block_end] = block_result.tvalues
+        if len(block_result.corrvalues) > 0:
+            if len(statsresult.corrvalues) == 0:
+                statsresult.corrvalues = np.zeros(len(statsresult.pvalues))
+            statsresult.corrvalues[block_start:block_end] = block_result.corrvalues
+        if hasattr(block_result, 'file_name_string'):
+            statsresult.file_name_string = str(block_result.file_name_string)
+
+    def run_blocks(self, commands, designs):
+        """
+        Runs the commands of designs over the blocks of the data, in parallel if jobs > 1. All the commands are run on
+        a block before moving to the next block. Blocks saved in the checkpoint are not computed again, and every newly
+        finished block is added to the checkpoint.
+        """
+        global _block_command
+        blocks_idx = self.parallel_blocks_idx()
+        dim = self.stats_data.phenotype_array.shape[1]
+        statsresults = [StatsResult(dim=dim) for design in designs]
+
+        pending_blocks_idx = []
+        for block_start, block_end in blocks_idx:
+            saved_results = []
+            for design_num in range(0, len(designs)):
+                if self.checkpoint is None or not self.checkpoint.has(self.block_checkpoint_name(block_start, block_end, design_num)):
+                    break
+                saved_result = self.checkpoint.load(self.block_checkpoint_name(block_start, block_end, design_num))
+                if saved_result is None:
+                    break
+                saved_results.append(saved_result)
+            if len(saved_results) < len(designs):
+                pending_blocks_idx.append((block_start, block_end))
+                continue
+            for statsresult, saved_result in zip(statsresults, saved_results):
+                block_result = StatsResult()
+                for key in saved_result:
+                    setattr(block_result, key, saved_result[key])
+                self.add_block_result(statsresult, block_start, block_end, block_result)
+        if len(pending_blocks_idx) < len(blocks_idx):
+            sys.stdout.write(str(len(blocks_idx) - len(pending_blocks_idx)) + ' of ' + str(len(blocks_idx)) +
+                             ' blocks restored from the checkpoint...')
+        if len(pending_blocks_idx) == 0:
+            return statsresults
+
+        _block_command = (commands, designs, self.stats_data)
+        pool = None
+        try:
+            if self.jobs > 1:
+                pool = Pool(processes=min(self.jobs, len(pending_blocks_idx)))
+                block_results = pool.imap_unordered(run_command_on_block, pending_blocks_idx)
+            else:
+                block_results = (run_command_on_block(block) for block in pending_blocks_idx)
+            for block_start, block_end, design_block_results in block_results:
+                for design_num, block_result in enumerate(design_block_results):
+                    self.add_block_result(statsresults[design_num], block_start, block_end, block_result)
+                    if self.checkpoint is not None:
+                        self.checkpoint.save(self.block_checkpoint_name(block_start, block_end, design_num),
+                                             pvalues=block_result.pvalues, tvalues=block_result.tvalues,
+                                             corrvalues=block_result.corrvalues,
+                                             file_name_string=getattr(block_result, 'file_name_string', ''))
+            if pool is not None:
+                pool.close()
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+            _block_command = None
+        return statsresults
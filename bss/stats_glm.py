@@ -0,0 +1,146 @@
+#! /usr/local/epd/bin/python
+
+"""Least squares core for the numpy statistical engine"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+import scipy
+import scipy.stats
+from scipy.linalg import solve_triangular
+from patsy import dmatrix
+from stats_result import StatsResult
+import excepts
+
+
+def qr_factor(X):
+    """
+    Reduced QR factorization of a design matrix. Raises LinAlgError if the design is rank deficient.
+    """
+    Q, R = np.linalg.qr(X)
+    rdiag = np.abs(np.diag(R))
+    if rdiag.size == 0 or np.min(rdiag) <= np.max(rdiag) * max(X.shape) * np.finfo(float).eps:
+        raise np.linalg.LinAlgError('The design matrix is rank deficient.')
+    return Q, R
+
+
+class GLMModelComparison(object):
+    """
+    Comparison of a full and a null linear model fitted to many responses (vertices/voxels) at once.
+    Both designs are factored once. If the null design is nested in the full design, a single QR factorization of the
+    full design (with the null columns ordered first) is shared by both models.
+    """
+
+    def __init__(self, X_design_full, X_design_null, unique_idx):
+        X_design_full = np.asarray(X_design_full, dtype=float)
+        X_design_null = np.asarray(X_design_null, dtype=float)
+        self.N = X_design_full.shape[0]
+
+        # Find the columns of the null design in the full design
+        null_columns = []
+        for j in range(0, X_design_null.shape[1]):
+            matches = [i for i in range(0, X_design_full.shape[1])
+                       if i not in null_columns and np.allclose(X_design_full[:, i], X_design_null[:, j])]
+            if len(matches) == 0:
+                break
+            null_columns.append(matches[0])
+        self.nested = len(null_columns) == X_design_null.shape[1]
+
+        if self.nested:
+            column_order = null_columns + [i for i in range(0, X_design_full.shape[1]) if i not in null_columns]
+        else:
+            column_order = range(0, X_design_full.shape[1])
+        self.num_null_columns = X_design_null.shape[1]
+        self.Q_full, R_full = qr_factor(X_design_full[:, column_order])
+        self.unique_pos = list(column_order).index(unique_idx)
+        R_full_inv = solve_triangular(R_full, np.eye(R_full.shape[0]))
+        # Row of inv(R) that maps Q'y to the coefficient of the unique term
+        self.unique_coeff = R_full_inv[self.unique_pos, :]
+        # sqrt of the diagonal element of inv(X'X) = inv(R)inv(R)' for the unique term
+        self.se_unique_scale = np.sqrt(np.sum(self.unique_coeff**2))
+
+        self.Q_null = None
+        if not self.nested:
+            self.Q_null, R_null = qr_factor(X_design_null)
+
+    @staticmethod
+    def rss(Y, Q, QtY):
+        residual = Y - np.dot(Q, QtY)
+        return np.einsum('ij,ij->j', residual, residual)
+
+    def fit(self, Y):
+        """
+        Returns the coefficient of the unique term and the residual sum of squares of the full and the null models
+        """
+        QtY = np.dot(self.Q_full.T, Y)
+        beta_unique = np.dot(self.unique_coeff, QtY)
+        RSS_full = GLMModelComparison.rss(Y, self.Q_full, QtY)
+        if self.nested:
+            # The null model residual is the full model residual plus the part explained by the extra columns
+            RSS_null = RSS_full + np.einsum('ij,ij->j', QtY[self.num_null_columns:, :], QtY[self.num_null_columns:, :])
+        else:
+            QntY = np.dot(self.Q_null.T, Y)
+            RSS_null = GLMModelComparison.rss(Y, self.Q_null, QntY)
+        return beta_unique, RSS_full, RSS_null
+
+    def anova(self, Y, np_full, np_null):
+        """
+        Signed p-values of the F test between the full and the null model, and t-values of the unique term
+        """
+        N = self.N
+        beta_unique, RSS_full, RSS_null = self.fit(Y)
+        Fstat = (RSS_null - RSS_full)/(RSS_full + np.finfo(float).eps) * (N-np_full-1)/(np_full-np_null)  # F statistic
+        se_full_unique = self.se_unique_scale * np.sqrt(RSS_full / (N - np_full - 1))
+        tvalue_sign = (beta_unique + np.finfo(float).eps)/np.absolute(beta_unique + np.finfo(float).eps)
+        pvalues = 1.0 - scipy.stats.f.cdf(Fstat, np_full-np_null, N-np_full-1)  # pvalue under the F distribution
+        pvalues[np.isnan(pvalues)] = 1
+        tvalues = beta_unique/se_full_unique + np.finfo(float).eps
+        return pvalues*tvalue_sign, tvalues
+
+
+def design_model_comparison(model, sdata):
+    X_design_full = dmatrix(model.fullmodel, data=sdata.demographic_data)  # Design matrix for full model
+    X_design_null = dmatrix(model.nullmodel, data=sdata.demographic_data)  # Design matrix for null model
+    model_unique_idx = X_design_full.design_info.term_names.index(model.unique)
+    return GLMModelComparison(X_design_full, X_design_null, model_unique_idx)
+
+
+def anova_np(model, sdata):  # Anova using numpy/scipy
+    statsresult = StatsResult(dim=sdata.phenotype_array.shape[1])
+
+    try:
+        glm = design_model_comparison(model, sdata)
+    except np.linalg.LinAlgError as e:
+        raise excepts.ModelFailureError('Error in solving the linear system. Perhaps the data is insufficient to fit the model?\n')
+
+    np_full = model.nump_full_model()
+    np_null = model.nump_null_model()
+
+    # Process the vertices/voxels in blocks, so that the temporaries are bounded by the block size
+    for block_start, block_end in sdata.blocks_idx:
+        phenotype_block = np.asarray(sdata.phenotype_array[:, block_start:block_end])
+        statsresult.pvalues[block_start:block_end], statsresult.tvalues[block_start:block_end] = \
+            glm.anova(phenotype_block, np_full, np_null)
+
+    return statsresult
@@ -31,31 +31,105 @@ import numpy as np
 
 
 class Stats_Multi_Comparisons():
+    """
+    Adjusts signed p-values for multiple comparisons. The sign (direction of the effect) is kept, and NaN p-values
+    are left out of the number of comparisons.
+    """
+
+    methods = ['BH', 'BY', 'bonferroni', 'holm', 'hochberg']
+    # Vertices/voxels scaled by their rank at a time, to avoid a full size array of ranks
+    rank_chunk_size = 1 << 20
 
     def __init__(self):
         pass
 
     @staticmethod
-    def adjust(pvalues, method='BH'):
-        direction = np.sign(pvalues)
-        if method == 'BH':
-            p_adjust = Stats_Multi_Comparisons.adjust_BH(np.abs(pvalues))
+    def adjust(pvalues, method='BH', inplace=False):
+        """
+        Returns the adjusted p-values. If inplace is True and pvalues is a float32/float64 array, it is overwritten
+        with the adjusted p-values.
+        """
+        if method == 'hochbergh':
+            method = 'hochberg'
+        if method not in Stats_Multi_Comparisons.methods:
+            raise ValueError('method has to be one of ' + ', '.join(Stats_Multi_Comparisons.methods) + '.')
+
+        pvalues = np.asarray(pvalues)
+        if inplace and pvalues.dtype in [np.float32, np.float64]:
+            p_adjust = pvalues
+        elif pvalues.dtype == np.float32:
+            p_adjust = pvalues.copy()
+        else:
+            p_adjust = pvalues.astype(np.float64)
+        p_result = p_adjust
+        p_adjust = p_adjust.reshape(-1)
+
+        with np.errstate(invalid='ignore'):
+            negative = p_adjust < 0
+        np.abs(p_adjust, out=p_adjust)
+        if method == 'bonferroni':
+            np.multiply(p_adjust, np.count_nonzero(~np.isnan(p_adjust)), out=p_adjust)
         else:
-            raise ValueError('method has to be BH.')
-        return p_adjust*direction
+            # NaNs are sorted last, so the first m entries of idx are the valid p-values in increasing order
+            idx = np.argsort(p_adjust)
+            m = len(p_adjust) - np.count_nonzero(np.isnan(p_adjust))
+            idx = idx[0:m]
+            p_sorted = p_adjust[idx]
+            Stats_Multi_Comparisons.adjust_sorted(p_sorted, method)
+            p_adjust[idx] = p_sorted
+        np.minimum(p_adjust, 1, out=p_adjust)
+        np.negative(p_adjust, out=p_adjust, where=negative)
+        if not np.may_share_memory(p_adjust, p_result):
+            # reshape had to copy a non-contiguous array
+            p_result[...] = p_adjust.reshape(p_result.shape)
+        return p_result
 
     @staticmethod
-    def adjust_BH(pvalues):
+    def adjust_sorted(p_sorted, method):
+        """
+        Adjusts the p-values sorted in increasing order in place
+        """
+        m = len(p_sorted)
+        if m == 0:
+            return p_sorted
+        if method in ['BH', 'BY']:
+            # p(i)*m/i, followed by the cumulative minimum from the largest p-value
+            np.multiply(p_sorted, m, out=p_sorted)
+            if method == 'BY':
+                np.multiply(p_sorted, Stats_Multi_Comparisons.harmonic_number(m), out=p_sorted)
+            Stats_Multi_Comparisons.divide_by_rank(p_sorted, 1)
+            np.minimum.accumulate(p_sorted[::-1], out=p_sorted[::-1])
+        elif method == 'holm':
+            # p(i)*(m - i + 1), followed by the cumulative maximum from the smallest p-value
+            Stats_Multi_Comparisons.multiply_by_rank(p_sorted, m, -1)
+            np.maximum.accumulate(p_sorted, out=p_sorted)
+        elif method == 'hochberg':
+            # p(i)*(m - i + 1), followed by the cumulative minimum from the largest p-value
+            Stats_Multi_Comparisons.multiply_by_rank(p_sorted, m, -1)
+            np.minimum.accumulate(p_sorted[::-1], out=p_sorted[::-1])
+        return p_sorted
 
-        direction = np.sign(pvalues)
-        m = len(pvalues)
-        idx = np.argsort(np.abs(pvalues))
-        pvalues_sorted = np.sort(np.abs(pvalues))
-
-        qarray = pvalues_sorted * m / (np.arange(m) + 1)
-        new_qarray = np.minimum.accumulate(qarray[::-1])[::-1]
+    @staticmethod
+    def harmonic_number(m):
+        chunk_size = Stats_Multi_Comparisons.rank_chunk_size
+        return sum([np.sum(1.0/np.arange(i + 1, min(i + chunk_size, m) + 1)) for i in range(0, m, chunk_size)])
 
-        p_adjust = new_qarray[np.argsort(idx)]
+    @staticmethod
+    def divide_by_rank(p_sorted, start):
+        chunk_size = Stats_Multi_Comparisons.rank_chunk_size
+        for i in range(0, len(p_sorted), chunk_size):
+            p_chunk = p_sorted[i:i + chunk_size]
+            np.divide(p_chunk, np.arange(start + i, start + i + len(p_chunk), dtype=np.float64), out=p_chunk,
+                      casting='same_kind')
 
-        return p_adjust*direction
+    @staticmethod
+    def multiply_by_rank(p_sorted, start, step):
+        chunk_size = Stats_Multi_Comparisons.rank_chunk_size
+        for i in range(0, len(p_sorted), chunk_size):
+            p_chunk = p_sorted[i:i + chunk_size]
+            np.multiply(p_chunk, np.arange(start + step*i, start + step*(i + len(p_chunk)), step, dtype=np.float64),
+                        out=p_chunk, casting='same_kind')
 
+    @staticmethod
+    def adjust_BH(pvalues):
+        return Stats_Multi_Comparisons.adjust(pvalues, method='BH')
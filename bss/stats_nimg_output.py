@@ -30,17 +30,105 @@ import dfsio
 import sys
 import colormaps
 from nimgdata_io import NimgDataio
+from atlas_cache import AtlasCache
 import nibabel as nib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from stats_result_archive import StatsResultArchive
 from math_ops import log10_transform
 
 
 class StatsNimgOutput(object):
 
-    def __init__(self, outdir, outprefix, statsresult, mask_idx=np.array([]), dim=0):
+    result_formats = ['files', 'archive', 'both']
+
+    def __init__(self, outdir, outprefix, statsresult, mask_idx=np.array([]), dim=0, colorbars=False, write_workers=4,
+                 result_format='files', provenance=None):
         self.outdir = outdir
         self.outprefix = outprefix
         self.statsresult = statsresult
         self.mask_idx = mask_idx
+        self.colorbars = colorbars
+        self.write_workers = write_workers
+        # All the output maps are computed first and queued here, and then written together by write_pending
+        self.pending_writes = []
+        self.pending_colorbars = []
+        # With the archive result format, all the maps are saved in a single .npz file instead of separate files
+        if result_format not in StatsNimgOutput.result_formats:
+            raise ValueError('Unknown result format ' + result_format + '. Supported formats are: ' +
+                             ', '.join(StatsNimgOutput.result_formats) + '.')
+        self.write_files = result_format in ['files', 'both']
+        self.write_archive = result_format in ['archive', 'both']
+        self.provenance = provenance
+        self.result_maps = OrderedDict()
+
+    def add_write(self, write_func, *args):
+        if self.write_files:
+            self.pending_writes.append((write_func, args))
+
+    def add_map(self, name, values):
+        self.result_maps[name] = values
+
+    def archive_filename(self):
+        return os.path.join(self.outdir, self.outprefix + '_results.npz')
+
+    @staticmethod
+    def run_write(pending_write):
+        write_func, args = pending_write
+        write_func(*args)
+
+    def write_pending(self):
+        """
+        Writes the queued outputs with a pool of write_workers threads. Most of the time is spent in file I/O and in
+        zlib compression of the nifti images, which release the GIL. The pdf colorbars are rendered in this thread
+        meanwhile, since matplotlib is not thread safe.
+        """
+        pending_writes, self.pending_writes = self.pending_writes, []
+        pending_colorbars, self.pending_colorbars = self.pending_colorbars, []
+        if self.write_workers > 1 and len(pending_writes) > 1:
+            pool = ThreadPool(min(self.write_workers, len(pending_writes)))
+            try:
+                written = pool.imap_unordered(StatsNimgOutput.run_write, pending_writes)
+                for colorbar_args in pending_colorbars:
+                    colormaps.Colormap.save_colorbar(*colorbar_args)
+                for _ in written:
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for pending_write in pending_writes:
+                StatsNimgOutput.run_write(pending_write)
+            for colorbar_args in pending_colorbars:
+                colormaps.Colormap.save_colorbar(*colorbar_args)
+
+    @staticmethod
+    def write_text(filename, text):
+        with open(filename, "wt") as text_file:
+            text_file.write(text)
+
+    def save_colorbar(self, file, cmap, vmin, vmax, labeltxt):
+        # The colormap is always saved as json, the pdf colorbar is only rendered on request since it needs matplotlib.
+        # It can be rendered later from the json file with bss_colorbar.py
+        if self.colorbars and self.write_files:
+            self.pending_colorbars.append((file, cmap, vmin, vmax, labeltxt))
+        else:
+            self.add_write(colormaps.Colormap.save_colormap_to_json, os.path.splitext(file)[0] + '.json', cmap, vmin,
+                           vmax, labeltxt)
+
+    @classmethod
+    def save_designs(cls, outdir, model, statsresults, mask_idx, colorbars=False, write_workers=4,
+                     result_format='files', provenance=None):
+        """
+        Saves the result of each design of the model specification, named by the prefix of the design.
+        """
+        for design, statsresult in zip(model.designs, statsresults):
+            design_provenance = None
+            if provenance is not None:
+                design_provenance = dict(provenance, design=design.design_name)
+            statsnimgout = cls(outdir, design.result_prefix(), statsresult, mask_idx, colorbars=colorbars,
+                               write_workers=write_workers, result_format=result_format, provenance=design_provenance)
+            statsnimgout.save(model.atlas)
 
     def save(self, atlas_filename):
         sys.stdout.write('Saving output files...\n')
@@ -52,11 +140,18 @@ class StatsNimgOutput(object):
             self.save_nifti_image(atlas_filename)
         else:
             raise TypeError('Error: Unsupported data type. Supported data types are: ' + ', '.join(NimgDataio.datatype.keys()) + '.\n')
+        if self.write_archive:
+            self.pending_writes.append((StatsResultArchive.save, (self.archive_filename(), self.result_maps,
+                                                                  self.mask_idx, atlas_filename, self.provenance)))
+        self.write_pending()
         sys.stdout.write('Done.\n')
 
     def save_surface(self, atlas_filename):
 
-        s1 = dfsio.readdfs(atlas_filename)
+        # Only the attributes and colors are replaced, so the atlas geometry is shared with the atlas cache, and every
+        # output is written as a copy of the atlas with these two sections patched
+        s1 = AtlasCache.surface(atlas_filename)
+        dfs_writer = AtlasCache.surface_writer(atlas_filename)
         if self.mask_idx.any():
             pvalues = np.ones(s1.vertices.shape[0])
             pvalues[self.mask_idx] = self.statsresult.pvalues
@@ -72,26 +167,31 @@ class StatsNimgOutput(object):
             self.statsresult.pvalues = log10_transform(self.statsresult.pvalues)
             s1.vColor, pex, cmap = colormaps.Colormap.log_pvalues_to_rgb(self.statsresult.pvalues)
             s1.attributes = self.statsresult.pvalues
-            dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues.dfs'), s1)
-            colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_cbar.pdf'),
+            self.add_map('log_pvalues', s1.attributes)
+            self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues.dfs'), s1.attributes, s1.vColor)
+            self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_cbar.pdf'),
                                              cmap=cmap, vmin=-1*pex, vmax=pex, labeltxt='Unadjusted p-values')
             s1.attributes = self.statsresult.tvalues
             s1.vColor, tmin, tmax, cmap_tvalues = colormaps.Colormap.tvalues_to_rgb(self.statsresult.tvalues)
-            dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_all.dfs'), s1)
-            colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_all_cbar.pdf'),
+            self.add_map('tvalues_all', s1.attributes)
+            self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_all.dfs'), s1.attributes, s1.vColor)
+            self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_all_cbar.pdf'),
                                              cmap=cmap_tvalues, vmin=tmin, vmax=tmax, labeltxt='t-values (all)')
+            # The t-values written above are still queued, so they are thresholded in a copy
+            self.statsresult.tvalues = self.statsresult.tvalues.copy()
             self.statsresult.tvalues[np.abs(self.statsresult.pvalues) <= -1 * np.log10(0.05)] = 0
             s1.vColor, tmin, tmax, cmap_tvalues = colormaps.Colormap.tvalues_to_rgb(self.statsresult.tvalues)
             s1.attributes = self.statsresult.tvalues
-            dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_atlas_tvalues.dfs'), s1)
-            colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_cbar.pdf'),
+            self.add_map('tvalues', s1.attributes)
+            self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_atlas_tvalues.dfs'), s1.attributes, s1.vColor)
+            self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_cbar.pdf'),
                                              cmap=cmap_tvalues, vmin=tmin, vmax=tmax, labeltxt='t-values (unadjusted)')
-            LUT = cmap_tvalues._lut[0:256, 0:3]
-            colormaps.Colormap.exportBrainSuiteLUT(os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_cbar.lut'), LUT)
+            LUT = cmap_tvalues.lut
+            self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_cbar.lut'), LUT)
 
-            with open(os.path.join(self.outdir, self.outprefix + '_unadjusted_pvalue_range.txt'), "wt") as text_file:
-                text_file.write("Log P-value range: -{0:s} to +{1:s}\n".format(str(pex), str(pex)))
-                text_file.write("P-value range: {0:s} to +{1:s}\n".format(str(-1*10**(-1*pex)), str(10**(-1*pex))))
+            self.add_write(StatsNimgOutput.write_text, os.path.join(self.outdir, self.outprefix + '_unadjusted_pvalue_range.txt'),
+                           "Log P-value range: -{0:s} to +{1:s}\n".format(str(pex), str(pex)) +
+                           "P-value range: {0:s} to +{1:s}\n".format(str(-1*10**(-1*pex)), str(10**(-1*pex))))
 
             if len(self.statsresult.pvalues_adjusted) > 0:
                 if self.mask_idx.any():
@@ -103,21 +203,39 @@ class StatsNimgOutput(object):
                 self.statsresult.pvalues_adjusted = log10_transform(self.statsresult.pvalues_adjusted)
                 s1.vColor, pex, cmap = colormaps.Colormap.log_pvalues_to_rgb(self.statsresult.pvalues_adjusted)
                 s1.attributes = self.statsresult.pvalues_adjusted
-                dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted.dfs'), s1)
-                colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted_cbar.pdf'),
+                self.add_map('log_pvalues_adjusted', s1.attributes)
+                self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted.dfs'), s1.attributes, s1.vColor)
+                self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted_cbar.pdf'),
                     cmap=cmap, vmin=-1 * pex, vmax=pex, labeltxt='Adjusted p-values')
+                # The t-values written above are still queued, so they are thresholded in a copy
+                self.statsresult.tvalues = self.statsresult.tvalues.copy()
                 self.statsresult.tvalues[np.abs(self.statsresult.pvalues_adjusted) < -1 * np.log10(0.05)] = 0
                 s1.vColor, tmin, tmax, cmap_tvalues = colormaps.Colormap.tvalues_to_rgb(self.statsresult.tvalues)
                 s1.attributes = self.statsresult.tvalues
-                dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_adjusted.dfs'), s1)
-                colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_adjusted_cbar.pdf'),
+                self.add_map('tvalues_adjusted', s1.attributes)
+                self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_adjusted.dfs'), s1.attributes, s1.vColor)
+                self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_adjusted_cbar.pdf'),
                                                  cmap=cmap_tvalues, vmin=tmin, vmax=tmax, labeltxt='t-values (adjusted)')
-                LUT = cmap_tvalues._lut[0:256, 0:3]
-                colormaps.Colormap.exportBrainSuiteLUT(os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_adjusted_cbar.lut'), LUT)
+                LUT = cmap_tvalues.lut
+                self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_atlas_tvalues_adjusted_cbar.lut'), LUT)
 
-                with open(os.path.join(self.outdir, self.outprefix + '_adjusted_pvalue_range.txt'), "wt") as text_file:
-                    text_file.write("Log P-value range: -{0:s} to +{1:s}\n".format(str(pex), str(abs(pex))))
-                    text_file.write("P-value range: {0:s} to +{1:s}\n".format(str(-1*10**(-1*pex)), str(10**(-1*pex))))
+                self.add_write(StatsNimgOutput.write_text, os.path.join(self.outdir, self.outprefix + '_adjusted_pvalue_range.txt'),
+                               "Log P-value range: -{0:s} to +{1:s}\n".format(str(pex), str(abs(pex))) +
+                               "P-value range: {0:s} to +{1:s}\n".format(str(-1*10**(-1*pex)), str(10**(-1*pex))))
+
+            if len(self.statsresult.pvalues_fwer) > 0:
+                if self.mask_idx.any():
+                    pvalues = np.ones(s1.vertices.shape[0])
+                    pvalues[self.mask_idx] = self.statsresult.pvalues_fwer
+                    self.statsresult.pvalues_fwer = pvalues
+
+                self.statsresult.pvalues_fwer = log10_transform(self.statsresult.pvalues_fwer)
+                s1.vColor, pex, cmap = colormaps.Colormap.log_pvalues_to_rgb(self.statsresult.pvalues_fwer)
+                s1.attributes = self.statsresult.pvalues_fwer
+                self.add_map('log_pvalues_fwer', s1.attributes)
+                self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_fwer.dfs'), s1.attributes, s1.vColor)
+                self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_fwer_cbar.pdf'),
+                                                 cmap=cmap, vmin=-1 * pex, vmax=pex, labeltxt='FWER corrected p-values')
         else:
             sys.stdout.write('Error: Dimension mismatch between the p-values and the number of vertices. '
                              'Quitting without saving.\n')
@@ -130,26 +248,30 @@ class StatsNimgOutput(object):
 
             s1.attributes = self.statsresult.corrvalues
             s1.vColor, cex, cmap = colormaps.Colormap.correlation_to_rgb(self.statsresult.corrvalues)
-            dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_corr.dfs'), s1)
-            colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_corr_cbar.pdf'),
+            self.add_map('corr', s1.attributes)
+            self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_corr.dfs'), s1.attributes, s1.vColor)
+            self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_corr_cbar.pdf'),
                                              cmap=cmap, vmin=-1 * cex, vmax=cex, labeltxt='Correlations (unadjusted)')
-            with open(os.path.join(self.outdir, self.outprefix + '_corr_range.txt'), "wt") as text_file:
-                text_file.write("Correlation values range: -{0:s} to +{1:s}\n".format(str(cex), str(cex)))
+            self.add_write(StatsNimgOutput.write_text, os.path.join(self.outdir, self.outprefix + '_corr_range.txt'),
+                           "Correlation values range: -{0:s} to +{1:s}\n".format(str(cex), str(cex)))
 
             # Also write color to the field
+            # The correlations written above are still queued, so they are thresholded in a copy
+            self.statsresult.corrvalues = self.statsresult.corrvalues.copy()
             self.statsresult.corrvalues[np.abs(self.statsresult.pvalues_adjusted) < -1*np.log10(0.05)] = 0
             s1.attributes = self.statsresult.corrvalues
             s1.vColor, cex, cmap = colormaps.Colormap.correlation_to_rgb(self.statsresult.corrvalues)
-            dfsio.writedfs(os.path.join(self.outdir, self.outprefix + '_corr_adjusted.dfs'), s1)
-            colormaps.Colormap.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_corr_adjusted_cbar.pdf'),
+            self.add_map('corr_adjusted', s1.attributes)
+            self.add_write(dfs_writer.write, os.path.join(self.outdir, self.outprefix + '_corr_adjusted.dfs'), s1.attributes, s1.vColor)
+            self.save_colorbar(file=os.path.join(self.outdir, self.outprefix + '_corr_adjusted_cbar.pdf'),
                                              cmap=cmap, vmin=-1 * cex, vmax=cex, labeltxt='Correlations (adjusted)')
-            with open(os.path.join(self.outdir, self.outprefix + '_adjusted_corr_range.txt'), "wt") as text_file:
-                text_file.write("Adjusted Correlation values range: {0:s} to +{1:s}\n".format(str(cex), str(cex)))
+            self.add_write(StatsNimgOutput.write_text, os.path.join(self.outdir, self.outprefix + '_adjusted_corr_range.txt'),
+                           "Adjusted Correlation values range: {0:s} to +{1:s}\n".format(str(cex), str(cex)))
 
         sys.stdout.write('Done.\n')
 
     def save_nifti_image(self, atlas_filename):
-        nimg_atlas_nifti_obj = NimgDataio.read_nifi_image_obj(atlas_filename)
+        nimg_atlas_nifti_obj = AtlasCache.nifti_image(atlas_filename)
         nifti_img = nimg_atlas_nifti_obj.get_data()
         nifti_img_siz = nifti_img.shape[0]*nifti_img.shape[1]*nifti_img.shape[2]
 
@@ -161,12 +283,13 @@ class StatsNimgOutput(object):
 
             self.statsresult.pvalues = log10_transform(self.statsresult.pvalues)
             cdict_pvalues, pex, cmap = colormaps.Colormap.log_pvalues_to_rgb(self.statsresult.pvalues)
-            LUT = cmap._lut[0:256, 0:3]
-            colormaps.Colormap.exportBrainSuiteLUT(os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues.lut'), LUT)
+            LUT = cmap.lut
+            self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues.lut'), LUT)
 
             # Write pvalues as a nifti image
-            NimgDataio.write_nifti_image_from_array(os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues.nii.gz'),
-                                                    self.statsresult.pvalues, nimg_atlas_nifti_obj)
+            self.add_map('log_pvalues', self.statsresult.pvalues)
+            self.add_write(NimgDataio.write_nifti_image_from_array, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues.nii.gz'),
+                           self.statsresult.pvalues, nimg_atlas_nifti_obj)
 
             if len(self.statsresult.pvalues_adjusted) > 0:
                 if self.mask_idx.any():
@@ -176,12 +299,29 @@ class StatsNimgOutput(object):
 
                 self.statsresult.pvalues_adjusted = log10_transform(self.statsresult.pvalues_adjusted)
                 cdict_pvalues, pex, cmap = colormaps.Colormap.log_pvalues_to_rgb(self.statsresult.pvalues_adjusted)
-                LUT = cmap._lut[0:256, 0:3]
-                colormaps.Colormap.exportBrainSuiteLUT(os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted.lut'), LUT)
+                LUT = cmap.lut
+                self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted.lut'), LUT)
 
                 # Write adjusted pvalues as a nifti image
-                NimgDataio.write_nifti_image_from_array(os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted.nii.gz'),
-                                                        self.statsresult.pvalues_adjusted, nimg_atlas_nifti_obj)
+                self.add_map('log_pvalues_adjusted', self.statsresult.pvalues_adjusted)
+                self.add_write(NimgDataio.write_nifti_image_from_array, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_adjusted.nii.gz'),
+                               self.statsresult.pvalues_adjusted, nimg_atlas_nifti_obj)
+
+            if len(self.statsresult.pvalues_fwer) > 0:
+                if self.mask_idx.any():
+                    pvalues = np.ones(nifti_img.size)
+                    pvalues[self.mask_idx] = self.statsresult.pvalues_fwer
+                    self.statsresult.pvalues_fwer = pvalues
+
+                self.statsresult.pvalues_fwer = log10_transform(self.statsresult.pvalues_fwer)
+                cdict_pvalues, pex, cmap = colormaps.Colormap.log_pvalues_to_rgb(self.statsresult.pvalues_fwer)
+                LUT = cmap.lut
+                self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_fwer.lut'), LUT)
+
+                # Write FWER corrected pvalues as a nifti image
+                self.add_map('log_pvalues_fwer', self.statsresult.pvalues_fwer)
+                self.add_write(NimgDataio.write_nifti_image_from_array, os.path.join(self.outdir, self.outprefix + '_atlas_log_pvalues_fwer.nii.gz'),
+                               self.statsresult.pvalues_fwer, nimg_atlas_nifti_obj)
 
         if len(self.statsresult.corrvalues) > 0:
             if self.mask_idx.any():
@@ -191,19 +331,23 @@ class StatsNimgOutput(object):
 
             # cdict_corrvalues = colormaps.Colormap.create_bidirect_corr_colormap(self.statsresult.corrvalues)
             vColor, cex, cmap = colormaps.Colormap.correlation_to_rgb(self.statsresult.corrvalues)
-            LUT = cmap._lut[0:256, 0:3]
-            colormaps.Colormap.exportBrainSuiteLUT(os.path.join(self.outdir, self.outprefix + '_corrvalues.lut'), LUT)
+            LUT = cmap.lut
+            self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_corrvalues.lut'), LUT)
 
             # Write correlations as a nifti image
-            NimgDataio.write_nifti_image_from_array(os.path.join(self.outdir, self.outprefix + '_corr.nii.gz'),
-                                                    self.statsresult.corrvalues, nimg_atlas_nifti_obj)
+            self.add_map('corr', self.statsresult.corrvalues)
+            self.add_write(NimgDataio.write_nifti_image_from_array, os.path.join(self.outdir, self.outprefix + '_corr.nii.gz'),
+                           self.statsresult.corrvalues, nimg_atlas_nifti_obj)
 
+            # The correlations written above are still queued, so they are thresholded in a copy
+            self.statsresult.corrvalues = self.statsresult.corrvalues.copy()
             self.statsresult.corrvalues[np.abs(self.statsresult.pvalues_adjusted) < -1*np.log10(0.05)] = 0
             # cdict_corrvalues = colormaps.Colormap.create_bidirect_corr_colormap(self.statsresult.corrvalues)
             vColor, cex, cmap = colormaps.Colormap.correlation_to_rgb(self.statsresult.corrvalues)
-            LUT = cmap._lut[0:256, 0:3]
-            colormaps.Colormap.exportBrainSuiteLUT(os.path.join(self.outdir, self.outprefix + '_corrvalues_adjusted.lut'), LUT)
+            LUT = cmap.lut
+            self.add_write(colormaps.Colormap.exportBrainSuiteLUT, os.path.join(self.outdir, self.outprefix + '_corrvalues_adjusted.lut'), LUT)
 
             # Write adjusted correlations as a nifti image
-            NimgDataio.write_nifti_image_from_array(os.path.join(self.outdir, self.outprefix + '_corr_adjusted.nii.gz'),
-                                                    self.statsresult.corrvalues, nimg_atlas_nifti_obj)
+            self.add_map('corr_adjusted', self.statsresult.corrvalues)
+            self.add_write(NimgDataio.write_nifti_image_from_array, os.path.join(self.outdir, self.outprefix + '_corr_adjusted.nii.gz'),
+                           self.statsresult.corrvalues, nimg_atlas_nifti_obj)
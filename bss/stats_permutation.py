@@ -0,0 +1,269 @@
+#! /usr/local/epd/bin/python
+
+"""Permutation testing with family-wise error control by the maximum statistic"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import sys
+import numpy as np
+from multiprocessing import Pool
+import stats_glm
+import excepts
+
+
+class AnovaPermutation(object):
+    """
+    F statistic of the full vs. null model comparison. Residuals of the null model are permuted (Freedman-Lane).
+    Permuting the residuals is equivalent to permuting the rows of the factored full design, so a batch of
+    permutations is computed with one matrix product per block of vertices.
+    """
+
+    def __init__(self, model, sdata):
+        try:
+            self.glm = stats_glm.design_model_comparison(model, sdata)
+        except np.linalg.LinAlgError as e:
+            raise excepts.ModelFailureError('Error in solving the linear system. Perhaps the data is insufficient to fit the model?\n')
+        if not self.glm.nested:
+            raise excepts.ModelFailureError('Permutation testing requires the null model to be nested in the full model.\n')
+        self.num_obs = self.glm.N
+        self.num_null_columns = self.glm.num_null_columns
+        self.dof_scale = float(self.num_obs - model.nump_full_model() - 1)/(model.nump_full_model() - model.nump_null_model())
+
+    def identity(self):
+        return np.arange(self.num_obs)[np.newaxis, :]
+
+    def permutations(self, rng, batch_size):
+        return np.array([rng.permutation(self.num_obs) for i in range(0, batch_size)])
+
+    def statistics(self, Y, permutations):
+        Q = self.glm.Q_full
+        Q_null = Q[:, 0:self.num_null_columns]
+        residual_null = Y - np.dot(Q_null, np.dot(Q_null.T, Y))
+        RSS_null = np.einsum('ij,ij->j', residual_null, residual_null)
+
+        # Q'(P r) = (P'Q)'r, stacked for all permutations in the batch
+        num_perms, num_columns = permutations.shape[0], Q.shape[1]
+        Q_perm = Q[np.argsort(permutations, axis=1)]
+        QtPR = np.dot(Q_perm.transpose(0, 2, 1).reshape(num_perms*num_columns, self.num_obs), residual_null)
+        QtPR = QtPR.reshape(num_perms, num_columns, Y.shape[1])**2
+        RSS_diff = np.sum(QtPR[:, self.num_null_columns:, :], axis=1)
+        RSS_full = RSS_null - np.sum(QtPR, axis=1)
+        return RSS_diff/(RSS_full + np.finfo(float).eps) * self.dof_scale
+
+
+class CorrPermutation(object):
+    """
+    Absolute correlation with the covariate. The covariate is permuted.
+    """
+
+    def __init__(self, model, sdata):
+        covariate = np.array(sdata.demographic_data[model.variable], dtype=float)
+        covariate -= np.mean(covariate)
+        self.covariate = covariate/np.sqrt(np.sum(covariate**2))
+        self.num_obs = len(covariate)
+
+    def identity(self):
+        return np.arange(self.num_obs)[np.newaxis, :]
+
+    def permutations(self, rng, batch_size):
+        return np.array([rng.permutation(self.num_obs) for i in range(0, batch_size)])
+
+    def statistics(self, Y, permutations):
+        Y_centered = Y - np.mean(Y, axis=0)
+        Y_norm = np.sqrt(np.einsum('ij,ij->j', Y_centered, Y_centered))
+        return np.abs(np.dot(self.covariate[permutations], Y_centered) / Y_norm)
+
+
+class UnpairedTtestPermutation(object):
+    """
+    Absolute two sample t statistic with pooled variance. The group labels are permuted.
+    """
+
+    def __init__(self, model, sdata):
+        group1 = list(set(sdata.demographic_data[model.hypothesis_group]))[0]
+        self.labels = np.array(sdata.demographic_data[model.hypothesis_group] == group1, dtype=float)
+        self.num_obs = len(self.labels)
+        self.n1 = np.sum(self.labels)
+        self.n2 = self.num_obs - self.n1
+
+    def identity(self):
+        return np.arange(self.num_obs)[np.newaxis, :]
+
+    def permutations(self, rng, batch_size):
+        return np.array([rng.permutation(self.num_obs) for i in range(0, batch_size)])
+
+    def statistics(self, Y, permutations):
+        Y_centered = Y - np.mean(Y, axis=0)
+        labels = self.labels[permutations]
+        sum1 = np.dot(labels, Y_centered)
+        sumsq1 = np.dot(labels, Y_centered**2)
+        sum2 = np.sum(Y_centered, axis=0) - sum1
+        sumsq2 = np.sum(Y_centered**2, axis=0) - sumsq1
+        mean1 = sum1/self.n1
+        mean2 = sum2/self.n2
+        pooled_var = (sumsq1 - self.n1*mean1**2 + sumsq2 - self.n2*mean2**2)/(self.num_obs - 2)
+        return np.abs(mean1 - mean2)/np.sqrt(pooled_var*(1.0/self.n1 + 1.0/self.n2))
+
+
+class PairedTtestPermutation(object):
+    """
+    Absolute paired t statistic. The signs of the paired differences are flipped.
+    """
+
+    def __init__(self, model, sdata):
+        pair_column = sdata.demographic_data[model.hypothesis_pair_id]
+        pair1 = list(set(pair_column))[0]
+        pair2 = list(set(pair_column))[1]
+        self.idx_pair1 = np.where(pair_column == pair1)[0]
+        self.idx_pair2 = np.where(pair_column == pair2)[0]
+        self.num_pairs = len(self.idx_pair1)
+
+    def identity(self):
+        return np.ones((1, self.num_pairs))
+
+    def permutations(self, rng, batch_size):
+        return 2.0*rng.randint(0, 2, size=(batch_size, self.num_pairs)) - 1
+
+    def statistics(self, Y, sign_flips):
+        D = Y[self.idx_pair1, :] - Y[self.idx_pair2, :]
+        mean_diff = np.dot(sign_flips, D)/self.num_pairs
+        var_diff = (np.sum(D**2, axis=0) - self.num_pairs*mean_diff**2)/(self.num_pairs - 1)
+        return np.abs(mean_diff)/np.sqrt(var_diff/self.num_pairs)
+
+
+permutation_tests = {'anova': AnovaPermutation,
+                     'corr': CorrPermutation,
+                     'unpaired_ttest': UnpairedTtestPermutation,
+                     'paired_ttest': PairedTtestPermutation,
+                     }
+
+# (permutation_test, sdata) for the worker processes. Set before the pool is created, so that the workers inherit
+# the phenotype array from the parent process.
+_permutation_state = None
+
+# Number of permutations drawn from one seed and computed together
+permutation_batch_size = 100
+
+
+def max_statistics(permutation_test, sdata, permutations):
+    """
+    Maximum of the statistic over all vertices/voxels for each permutation
+    """
+    max_stats = np.empty(permutations.shape[0])
+    max_stats.fill(np.nan)
+    for block_start, block_end in sdata.blocks_idx:
+        phenotype_block = np.asarray(sdata.phenotype_array[:, block_start:block_end])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            block_stats = permutation_test.statistics(phenotype_block, permutations)
+            max_stats = np.fmax(max_stats, np.nanmax(block_stats, axis=1))
+    return max_stats
+
+
+def run_permutation_batch(batch):
+    permutation_test, sdata = _permutation_state
+    batch_num, batch_seed, batch_size = batch
+    permutations = permutation_test.permutations(np.random.RandomState(batch_seed), batch_size)
+    return batch_num, max_statistics(permutation_test, sdata, permutations)
+
+
+def permutation_batches(num_permutations, batch_size, seed=None):
+    """
+    List of (batch number, seed, size). Each batch draws its permutations from its own seed, so that the result does
+    not depend on the number of parallel jobs.
+    """
+    num_batches = int(np.ceil(float(num_permutations)/batch_size))
+    batch_seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=num_batches)
+    return [(i, batch_seeds[i], min(batch_size, num_permutations - i*batch_size)) for i in range(0, num_batches)]
+
+
+def batch_checkpoint_name(batch_num, checkpoint_suffix=''):
+    return 'permutations_' + str(batch_num) + checkpoint_suffix
+
+
+def max_stat_pvalues(stat_test, model, sdata, num_permutations, seed=None, jobs=1,
+                     batch_size=permutation_batch_size, checkpoint=None, checkpoint_suffix=''):
+    """
+    Returns p-values corrected for the family-wise error rate by the maximum statistic over all vertices/voxels.
+    If checkpoint is given, batches saved in it are not computed again and every finished batch is saved to it.
+    checkpoint_suffix distinguishes the batches of different tests saved in the same checkpoint.
+    """
+    global _permutation_state
+    if stat_test not in permutation_tests:
+        raise excepts.ModelFailureError('Permutation testing is not available for ' + stat_test + '.\n')
+    permutation_test = permutation_tests[stat_test](model, sdata)
+
+    observed_stats = np.empty(sdata.phenotype_array.shape[1])
+    for block_start, block_end in sdata.blocks_idx:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            observed_stats[block_start:block_end] = permutation_test.statistics(
+                np.asarray(sdata.phenotype_array[:, block_start:block_end]), permutation_test.identity())[0]
+
+    sys.stdout.write('Running ' + str(num_permutations) + ' permutations...')
+    sys.stdout.flush()
+    batches = permutation_batches(num_permutations, batch_size, seed)
+    max_stats = np.empty(num_permutations)
+    pending_batches = []
+    for batch in batches:
+        saved_batch = None
+        if checkpoint is not None and checkpoint.has(batch_checkpoint_name(batch[0], checkpoint_suffix)):
+            saved_batch = checkpoint.load(batch_checkpoint_name(batch[0], checkpoint_suffix))
+        if saved_batch is None or len(saved_batch['max_stats']) != batch[2]:
+            pending_batches.append(batch)
+        else:
+            max_stats[batch[0]*batch_size:batch[0]*batch_size + batch[2]] = saved_batch['max_stats']
+    if len(pending_batches) < len(batches):
+        sys.stdout.write(str(num_permutations - sum([batch[2] for batch in pending_batches])) +
+                         ' permutations restored from the checkpoint...')
+
+    _permutation_state = (permutation_test, sdata)
+    pool = None
+    try:
+        if jobs > 1 and len(pending_batches) > 0:
+            pool = Pool(processes=min(jobs, len(pending_batches)))
+            batch_results = pool.imap_unordered(run_permutation_batch, pending_batches)
+        else:
+            batch_results = (run_permutation_batch(batch) for batch in pending_batches)
+        for batch_num, batch_max_stats in batch_results:
+            max_stats[batch_num*batch_size:batch_num*batch_size + len(batch_max_stats)] = batch_max_stats
+            if checkpoint is not None:
+                checkpoint.save(batch_checkpoint_name(batch_num, checkpoint_suffix), max_stats=batch_max_stats)
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+        _permutation_state = None
+    sys.stdout.write('Done.\n')
+
+    # Fraction of permutations whose maximum statistic is at least the observed statistic, counting the observed data.
+    # Permutations without a maximum (all statistics NaN) are left out of both counts
+    max_stats_sorted = np.sort(max_stats[~np.isnan(max_stats)])
+    num_exceed = len(max_stats_sorted) - np.searchsorted(max_stats_sorted, observed_stats, side='left')
+    pvalues_fwer = (1.0 + num_exceed)/(1.0 + len(max_stats_sorted))
+    pvalues_fwer[np.isnan(observed_stats)] = 1
+    return pvalues_fwer
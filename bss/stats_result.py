@@ -42,6 +42,7 @@ class StatsResult(object):
         self.pvalues_adjusted = np.zeros(dim)
         self.tvalues = np.zeros(dim)
         self.corrvalues = []
+        self.pvalues_fwer = []
 
     def adjust_for_multi_comparisons(self):
             self.pvalues_adjusted = Stats_Multi_Comparisons.adjust(self.pvalues)
@@ -0,0 +1,98 @@
+#! /usr/local/epd/bin/python
+
+"""Single file archive of all the statistical maps of a run"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+
+import numpy as np
+import os
+import json
+from collections import OrderedDict
+from stats_data_cache import StatsDataCache
+
+
+class StatsResultArchive(object):
+    """
+    Reads a result archive, a .npz file with all the per-vertex or per-voxel maps of a run as float32 arrays, the
+    mask indices and a json info record with the atlas reference and the model provenance. Each map is only read from
+    the file when it is requested.
+    """
+
+    archive_version = 1
+    info_key = '__info__'
+    mask_idx_key = '__mask_idx__'
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.npzfile = np.load(filename, allow_pickle=False)
+        if StatsResultArchive.info_key not in self.npzfile.files:
+            self.close()
+            raise ValueError('The file ' + filename + ' is not a bss result archive.')
+        self.info = json.loads(self.npzfile[StatsResultArchive.info_key].item())
+        self.map_names = self.info['maps']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.npzfile.close()
+
+    def read_map(self, name):
+        if name not in self.map_names:
+            raise KeyError('The result archive ' + self.filename + ' has no map ' + name + '. Available maps are: ' +
+                           ', '.join(self.map_names) + '.')
+        return self.npzfile[name]
+
+    def read_mask_idx(self):
+        return self.npzfile[StatsResultArchive.mask_idx_key]
+
+    @staticmethod
+    def load_map(filename, name):
+        with StatsResultArchive(filename) as archive:
+            return archive.read_map(name)
+
+    @staticmethod
+    def save(filename, maps, mask_idx, atlas_filename, provenance=None):
+        """
+        Saves maps (an ordered dict of map name and values) as float32 arrays. The atlas is referenced by its path,
+        size and modification time, and provenance (a json serializable dict) records how the maps were computed.
+        """
+        info = OrderedDict([('version', StatsResultArchive.archive_version),
+                            ('maps', list(maps.keys())),
+                            ('atlas', os.path.abspath(atlas_filename)),
+                            ('atlas_signature', StatsDataCache.file_signature(atlas_filename)),
+                            ('provenance', provenance or {})])
+        arrays = OrderedDict((name, np.asarray(values, dtype=np.float32)) for name, values in maps.items())
+        arrays[StatsResultArchive.mask_idx_key] = np.asarray(mask_idx, dtype=np.int64)
+        arrays[StatsResultArchive.info_key] = np.array(json.dumps(info))
+
+        # Write to a temporary file first and rename, so that readers never see a partial archive
+        tmp_filename = filename + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_filename, 'wb') as fid:
+            np.savez(fid, **arrays)
+        os.rename(tmp_filename, filename)
@@ -43,12 +43,16 @@ class StatsRoiResult(object):
 
     def save_r_cmds(self, filename, statsdata, modelspec_file, pandoc_dir=''):
         outdir = os.path.dirname(filename)
-        sys.stdout.write('Saving commands to ' + outdir + '/r_cmds.R' + '...')
-        with open(outdir + '/r_cmds.R', 'wt') as fid:
+        # The commands for prefix_results.txt are saved in prefix_r_cmds.R
+        prefix = ''
+        if os.path.basename(filename).endswith('results.txt'):
+            prefix = os.path.basename(filename)[:-len('results.txt')]
+        sys.stdout.write('Saving commands to ' + outdir + '/' + prefix + 'r_cmds.R' + '...')
+        with open(outdir + '/' + prefix + 'r_cmds.R', 'wt') as fid:
             fid.write('# ROI analysis commands\n')
             fid.write("roidataframe = read.csv('{0:s}')\n".format(outdir+'/roidata.csv'))
             for num, roi_idx in enumerate(self.cmd_str_list):
-                fid.write('# ROI: ' + str(statsdata.roiid[num]) + ' - ' + LabelDesc.roilabels[statsdata.roiid[num]] + '\n')
+                fid.write('# ROI: ' + str(statsdata.roiid[num]) + ' - ' + LabelDesc.roilabel(statsdata.roiid[num]) + '\n')
                 for jj in self.cmd_str_list[num]:
                     fid.write(jj.text + '\n')
                 fid.write('\n#--------------------------------------------------------------------------------\n')
@@ -58,7 +62,7 @@ class StatsRoiResult(object):
         with open(filename, 'wt') as fid:
             fid.write('# ROI results\n')
             for num, roi_idx in enumerate(self.cmd_result_str_list):
-                fid.write('# ROI: ' + str(statsdata.roiid[num]) + ' - ' + LabelDesc.roilabels[statsdata.roiid[num]] + '\n')
+                fid.write('# ROI: ' + str(statsdata.roiid[num]) + ' - ' + LabelDesc.roilabel(statsdata.roiid[num]) + '\n')
                 for jj in self.cmd_result_str_list[num]:
                     fid.write(jj)
                 fid.write('\n##__________________________________________________________\n')
@@ -81,7 +85,7 @@ class StatsRoiResult(object):
             fid.write("```\n")
             ctr = 1
             for num, roi_idx in enumerate(self.cmd_str_list):
-                fid.write('\n#### ROI: ' + str(statsdata.roiid[num]) + ' - ' + LabelDesc.roilabels[statsdata.roiid[num]] + '\n')
+                fid.write('\n#### ROI: ' + str(statsdata.roiid[num]) + ' - ' + LabelDesc.roilabel(statsdata.roiid[num]) + '\n')
                 for jj in self.cmd_str_list[num]:
                     if jj.display:
                         fid.write("```{r}\n")
@@ -0,0 +1,255 @@
+#! /usr/local/epd/bin/python
+
+"""Local server that keeps the subject data of recently used cohorts in memory between statistical runs"""
+
+"""Copyright (C) Shantanu H. Joshi, David Shattuck,
+Brain Mapping Center, University of California Los Angeles
+
+Bss is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+Bss is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA."""
+
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson Lovelace Brain Mapping Center" \
+                "University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import sys
+import traceback
+import urllib2
+from collections import OrderedDict
+from StringIO import StringIO
+import numpy as np
+import excepts
+from modelspec import ModelSpec
+from stats_data import StatsData
+from stats_data_cache import StatsDataCache
+from stats_checkpoint import StatsCheckpoint
+from stats_engine import StatsEngine
+from stats_nimg_output import StatsNimgOutput
+
+
+class StatsCohortCache(object):
+    """
+    Least recently used cache of StatsData objects, keyed by the subject files, the atlas and the masks. The least
+    recently used cohorts are dropped when the phenotype arrays take more than memory_budget bytes.
+    """
+
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.cohorts = OrderedDict()
+
+    @staticmethod
+    def cohort_key(model):
+        return StatsDataCache.cache_key(model.demographic_data[model.fileid], model.atlas, model.maskfile,
+                                        model.maskroiid)
+
+    @staticmethod
+    def cohort_size(stats_data):
+        return stats_data.phenotype_array.nbytes + np.asarray(stats_data.mask_idx).nbytes
+
+    def memory_used(self):
+        return sum([self.cohort_size(stats_data) for stats_data in self.cohorts.values()])
+
+    def get(self, model, max_block_size=20000, num_read_workers=1, cache=None):
+        """
+        Returns the StatsData of the cohort of model, reading the subject files only if the cohort is not loaded.
+        """
+        key = self.cohort_key(model)
+        if key in self.cohorts:
+            stats_data = self.cohorts.pop(key)
+            self.cohorts[key] = stats_data
+            sys.stdout.write('Using the subject data loaded by the server.\n')
+            # The phenotype array and the masks are shared, the demographics and the blocks come from this model
+            stats_data.demographic_data = model.demographic_data
+            stats_data.max_block_size = max_block_size
+            stats_data.create_blocks_idx()
+            return stats_data
+
+        stats_data = StatsData(model.demographics, model, max_block_size=max_block_size,
+                               num_read_workers=num_read_workers, cache=cache)
+        if stats_data.data_read_flag:
+            self.add(key, stats_data)
+            if key not in self.cohorts:
+                sys.stdout.write('Warning: The subject data is larger than the memory budget of the server and will '
+                                 'not be kept.\n')
+        return stats_data
+
+    def add(self, key, stats_data):
+        # Drop the least recently used cohorts until the memory budget is met. A cohort larger than the budget is
+        # dropped as well.
+        self.cohorts[key] = stats_data
+        while len(self.cohorts) > 0 and self.memory_used() > self.memory_budget:
+            self.cohorts.popitem(last=False)
+
+    def clear(self):
+        self.cohorts.clear()
+
+
+class StatsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    GET /status returns the loaded cohorts. POST /run runs a modelspec file given as json and returns the messages of
+    the run. POST /shutdown stops the server.
+    """
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(self.server.status())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path == '/run':
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            except ValueError:
+                self.send_error(400, 'The request is not valid json')
+                return
+            self.send_json(self.server.run_request(request))
+        elif self.path == '/shutdown':
+            self.send_json({'success': True})
+            self.server.stop_requested = True
+        else:
+            self.send_error(404)
+
+    def send_json(self, response):
+        response_text = json.dumps(response)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_text)))
+        self.end_headers()
+        self.wfile.write(response_text)
+
+    def log_message(self, format, *args):
+        sys.stdout.write(self.client_address[0] + ' - ' + format % args + '\n')
+
+
+class StatsServer(BaseHTTPServer.HTTPServer):
+    """
+    Runs modelspec files submitted over http on localhost. The subject data of recently used cohorts stays in memory,
+    so that runs with different models on the same cohort do not read the subject files again. Requests are handled
+    one at a time.
+    """
+
+    default_port = 8765
+    default_memory_budget_mb = 4096
+
+    def __init__(self, port=default_port, memory_budget_mb=default_memory_budget_mb, num_read_workers=1, cache=None,
+                 jobs=1):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), StatsRequestHandler)
+        self.cohorts = StatsCohortCache(memory_budget_mb*1024*1024)
+        self.num_read_workers = num_read_workers
+        self.cache = cache
+        self.jobs = jobs
+        self.stop_requested = False
+
+    def serve(self):
+        sys.stdout.write('bss server listening on ' + self.server_address[0] + ':' + str(self.server_address[1]) + '.\n')
+        while not self.stop_requested:
+            self.handle_request()
+        self.server_close()
+        sys.stdout.write('bss server stopped.\n')
+
+    def status(self):
+        return {'cohorts': len(self.cohorts.cohorts),
+                'memory_used_mb': self.cohorts.memory_used()/(1024.0*1024),
+                'memory_budget_mb': self.cohorts.memory_budget/(1024.0*1024)}
+
+    def run_request(self, request):
+        """
+        Runs the modelspec file of request. The messages written during the run are returned in output.
+        """
+        missing_fields = [field for field in ['modelspec', 'outdir'] if field not in request]
+        if missing_fields:
+            output = 'Error: The request is missing ' + ' and '.join(missing_fields) + '.\n'
+            sys.stdout.write(output)
+            return {'success': False, 'output': output}
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            success = self.run_modelspec(request['modelspec'], request['outdir'],
+                                         request.get('statsengine', 'np'), request.get('blocksize', 20000),
+                                         request.get('jobs', self.jobs), request.get('permutations', 0),
+                                         request.get('seed'), request.get('resume', False),
+                                         request.get('colorbars', False), request.get('writeworkers', 4),
+                                         request.get('resultformat', 'files'), request.get('checkpoint', False))
+        except (IOError, excepts.ModelFailureError, excepts.FileZeroElementsReadError,
+                excepts.DemographicsDataError) as ioerr:
+            sys.stdout.write('\nError: ' + ioerr.message + '\n')
+            success = False
+        except:
+            sys.stdout.write("\nSomething went wrong. Please send this error message to the developers."
+                             "\nUnexpected error: " + str(sys.exc_info()[0]) + '\n')
+            traceback.print_exc(file=sys.stdout)
+            success = False
+        finally:
+            output = sys.stdout.getvalue()
+            sys.stdout = stdout
+        sys.stdout.write(output)
+        return {'success': success, 'output': output}
+
+    def run_modelspec(self, modelspec, outdir, statsengine='np', blocksize=20000, jobs=1, permutations=0, seed=None,
+                      resume=False, colorbars=False, writeworkers=4, resultformat='files', checkpoint=False):
+        if not os.path.exists(outdir):
+            os.mkdir(outdir)
+        model = ModelSpec(modelspec)
+        if model.read_success == False:
+            return False
+        if model.roiid:
+            sys.stdout.write('Error: ROI analyses are not run by the server. Please use bss_roi.py.\n')
+            return False
+        with open(modelspec, 'rt') as fid:
+            modeltxt = fid.read()
+
+        statsdata = self.cohorts.get(model, max_block_size=blocksize, num_read_workers=self.num_read_workers,
+                                     cache=self.cache)
+        if not statsdata.data_read_flag:
+            sys.stdout.write('Problem in reading either the model or the data.\n'
+                             'Exiting the statistical analysis.\n')
+            return False
+
+        stats_checkpoint = None
+        if checkpoint or resume:
+            stats_checkpoint = StatsCheckpoint(outdir, resume=resume)
+        engine = StatsEngine(model, statsdata, engine=statsengine, jobs=jobs, permutations=permutations, seed=seed,
+                             checkpoint=stats_checkpoint)
+        statsresults = engine.run_designs()
+        provenance = {'modelspec': os.path.abspath(modelspec), 'modelspec_text': modeltxt,
+                      'statsengine': statsengine, 'permutations': permutations, 'seed': engine.seed}
+        StatsNimgOutput.save_designs(outdir, model, statsresults, statsdata.mask_idx, colorbars=colorbars,
+                                     write_workers=writeworkers, result_format=resultformat, provenance=provenance)
+        if stats_checkpoint is not None:
+            stats_checkpoint.clear()
+        try:
+            shutil.copy(os.path.abspath(modelspec), outdir)
+        except shutil.Error as err:  # This error is raised if both file names are the same. Do nothing.
+            pass
+        return True
+
+    @staticmethod
+    def submit(path, request=None, port=default_port):
+        """
+        Sends request (a json serializable dict) to the server on localhost and returns its json response. Raises
+        urllib2.URLError if the server is not running.
+        """
+        data = json.dumps(request) if request is not None else None
+        http_request = urllib2.Request('http://127.0.0.1:' + str(port) + path, data,
+                                       {'Content-Type': 'application/json'})
+        return json.loads(urllib2.urlopen(http_request).read())
@@ -13,8 +13,9 @@ import numpy as np
 import dfsio
 import re
 import StringIO
-import pandas as pd
-import nibabel
+import base64
+import zlib
+from xml.etree import cElementTree
 
 # Optionally import the vtk module
 try:
@@ -22,12 +23,6 @@ try:
 except ImportError:
     vtk_module_exists = False
 
-# Optionally import the parse module
-try:
-    import parse
-except ImportError:
-    parse_module_exists = False
-
 
 
 FORMATS_TYPES = {
@@ -47,6 +42,16 @@ FORMATS_REGEXES = {
 FORMAT_FIELD_REGEX = re.compile(r'%(s|d|f)')
 
 
+# Data array formats of the vtp writer and the size of the zlib compressed blocks of binary data arrays
+vtp_formats = ['ascii', 'binary', 'appended']
+vtp_block_size = 32768
+
+VTP_TYPES = {
+    'Int8': 'i1', 'UInt8': 'u1', 'Int16': 'i2', 'UInt16': 'u2', 'Int32': 'i4', 'UInt32': 'u4',
+    'Int64': 'i8', 'UInt64': 'u8', 'Float32': 'f4', 'Float64': 'f8',
+}
+
+
 def scan_input(format_string, stream, max_size=float('+inf'), chunk_size=1024):
     """Scan an input stream and retrieve formatted input."""
 
@@ -80,6 +85,7 @@ def _get_chunk(stream, chunk_size):
         return ''
 
 def ReadPial(filename):
+    import nibabel
     coords, faces = nibabel.freesurfer.io.read_geometry(filename)
     return coords, faces
 
@@ -166,71 +172,49 @@ def WriteUCF(coords,attriblabel,attributes,filename):
 def ReadMincObj(filename):
     fid = open(filename,'rt')
 
-
     shape_type = fid.readline().split()
 
     if shape_type[0] == 'P':
         num_pts = int(shape_type[-1])
 
-        # Read vertices
-        coords = []
-        for i in range(0,num_pts):
-            line_split = fid.readline().split()
-            Xtemp = [float(line_split[0]),float(line_split[1]),float(line_split[2])]
-            coords.append(Xtemp)
-
-        # Read a blank line
-        fid.readline()
-
-        # Read normals
-        normals = []
-        for i in range(0,num_pts):
-            line_split = fid.readline().split()
-            Xtemp = [float(line_split[0]),float(line_split[1]),float(line_split[2])]
-            normals.append(Xtemp)
-
-        # Read a blank line
-        fid.readline()
-        # Read number of triangles
-        line = fid.readline()
-        num_triangles = int(line.split()[0])
-        line = fid.readline()
-        color_type = int(line.split()[0])
+        # The rest of the file is a sequence of numbers: vertices, normals, number of triangles, color type, colors,
+        # end indices of the triangles and the triangles. Parse all of them at once.
+        values = np.fromstring(fid.read(), sep=' ')
+        fid.close()
+        if len(values) < 6*num_pts + 2:
+            raise ValueError('The obj file ' + filename + ' is incomplete or not formatted correctly.')
+
+        coords = values[0:3*num_pts].reshape(num_pts, 3)
+        # The normals follow the vertices
+        ctr = 6*num_pts
+        num_triangles = int(values[ctr])
+        color_type = int(values[ctr + 1])
+        ctr += 2
 
         if color_type == 2:
-        # Read colors
-            pt_colors = []
-            for i in range(0,num_pts):
-                line_split = fid.readline().split()
-                Xtemp = [float(line_split[0]),float(line_split[1]),float(line_split[2]),float(line_split[3])]
-                pt_colors.append(Xtemp)
-        elif color_type == 0:
-            line = fid.readline()
-            line_split = line.split()
-            pt_colors = [float(line_split[0]),float(line_split[1]),float(line_split[2]),float(line_split[3])]
-
-        # Read a blank line
-        dummy = fid.readline()
-
-        # Till the next blank line, read all lines
-        dummy = fid.readline()
-        while dummy != '':
-            dummy = fid.readline().rstrip('\n')
-
-        faces = []
-        for i in range(0,num_triangles):
-            line_split = fid.readline().split()
-            Xtemp = [int(line_split[0]),int(line_split[1]),int(line_split[2])]
-            faces.append(Xtemp)
+            # Read colors
+            pt_colors = values[ctr:ctr + 4*num_pts].reshape(-1, 4).tolist()
+            ctr += 4*num_pts
+        elif color_type == 1:
+            pt_colors = values[ctr:ctr + 4*num_triangles].reshape(-1, 4).tolist()
+            ctr += 4*num_triangles
+        else:
+            pt_colors = values[ctr:ctr + 4].tolist()
+            ctr += 4
+
+        # Skip the end indices of the triangles
+        ctr += num_triangles
+        if len(values) < ctr + 3*num_triangles:
+            raise ValueError('The obj file ' + filename + ' is incomplete or not formatted correctly.')
+        faces = values[ctr:ctr + 3*num_triangles].astype(int).reshape(num_triangles, 3).tolist()
 
-        fid.close()
         isMultilevelUCF = False
-        coords = np.array(coords)
         attributes = pt_colors
         return coords, faces, attributes, isMultilevelUCF
 
 
     elif shape_type[0] == 'L': # This means the obj file contains lines
+        fid.close()
         sys.stdout.write('This surface file ' + filename + ' contains obj curves. Exiting without reading...\n')
         coords =  faces = attributes = isMultilevelUCF = False
         return coords, faces, attributes, isMultilevelUCF
@@ -271,102 +255,69 @@ def ReadCCBBM_sphere(filename):
     coords = np.array(coords)
 
 
-def readccbbm(filename):
+def read_ccbbm_sections(filename, attribute_regex):
+    """
+    Returns the vertices and faces of a CCBBM file, and the attribute of each vertex. attribute_regex is a regular
+    expression with one group, matched against the rest of each Vertex line after the coordinates. The attribute of
+    a vertex is '' if it does not match. Each section is tokenized in one pass and converted with np.fromstring.
+    """
     fid = open(filename, 'rt')
-    lines = fid.readlines()
-    coords = []
-
-    # Skip all lines until vertex
-    ctr = 0
-    while lines[ctr][0:6] != 'Vertex':
-        ctr += 1
+    text = fid.read()
+    fid.close()
 
-    # First read the vertices
-    line = lines[ctr]
-    line_split = line.split()
-    ctr += 1
-    # ctr = 1;
-    attributes = []
-    while line_split[0] == 'Vertex':
-        vtx1 = float(line_split[2])
-        vtx2 = float(line_split[3])
-        vtx3 = float(line_split[4])
-        radial_dist = float(re.findall('\d*\.?\d+', line_split[5])[0])
-        coords.append([vtx1, vtx2, vtx3])
-        attributes.append(radial_dist)
-        line = lines[ctr]
-        line_split = line.split()
-        ctr += 1
+    # Skip all lines until vertex. The vertices are followed by the faces.
+    vertex_start = re.search('^Vertex', text, re.M).start()
+    face_start = text.find('\nFace', vertex_start)
+    if face_start < 0:
+        raise ValueError('The CCBBM file ' + filename + ' does not contain any faces.')
+    num_vertices = text.count('\n', vertex_start, face_start) + 1
+
+    vertex_regex = re.compile(r'^Vertex[ \t]+\S+[ \t]+(\S+[ \t]+\S+[ \t]+\S+)(?:' + attribute_regex + ')?', re.M)
+    vertices = vertex_regex.findall(text, vertex_start, face_start)
+    coords = np.fromstring(' '.join([vertex[0] for vertex in vertices]), sep=' ')
+    if len(vertices) != num_vertices or len(coords) != 3*num_vertices:
+        raise ValueError('Could not read the vertices of the CCBBM file ' + filename + '.')
+    coords = coords.reshape(num_vertices, 3)
+    attributes = [vertex[1] for vertex in vertices]
+
+    # Faces are lines of Face index vertex1 vertex2 vertex3
+    num_faces = text.count('\nFace', face_start)
+    faces = np.fromstring(text[face_start:].replace('Face', ' '), dtype=int, sep=' ')
+    if len(faces) != 4*num_faces:
+        # Some lines have more fields, so pick the vertex indices from each line
+        face_regex = re.compile(r'^Face[ \t]+\S+[ \t]+(\S+[ \t]+\S+[ \t]+\S+)', re.M)
+        faces = np.fromstring(' '.join(face_regex.findall(text, face_start)), dtype=int, sep=' ')
+        if len(faces) != 3*num_faces:
+            raise ValueError('Could not read the faces of the CCBBM file ' + filename + '.')
+        faces = faces.reshape(num_faces, 3)
+    else:
+        faces = faces.reshape(num_faces, 4)[:, 1:4]
 
-    coords = np.array(coords)
-    # The rest of the lines are faces
-    faces = []
-    ctr -= 1
-    for ii in range(ctr, len(lines)):
-        line_split = lines[ii].split()
-        faces.append([int(line_split[2]), int(line_split[3]), int(line_split[4])])
-
-    faces = np.array(faces)
     if faces.min() == 1:
         faces -= 1
-
-    isMultilevelUCF = False
-    return coords, faces, attributes, isMultilevelUCF
-
+    return coords, faces, attributes
 
 
-def readccbbm_using_parse(filename):
-
-    fid = open(filename, 'rt')
-    lines = fid.readlines()
-    regex=r'[-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?'
+def readccbbm(filename):
+    # The attribute is the first number in the field after the coordinates, e.g. the radial distance in
+    # {Jfeature=(r ...)}, without its sign or exponent
+    coords, faces, radial_dist = read_ccbbm_sections(filename, r'[ \t]+[^\d\s]*?(\d*\.?\d+)')
 
-    coords = []
+    attributes = []
+    if any(radial_dist):
+        if not all(radial_dist):
+            raise ValueError('Could not read the attributes of the vertices in ' + filename + '.')
+        attributes = np.array(radial_dist, dtype=float).tolist()
 
-    # Skip all lines until vertex
-    ctr = 0
-    parser1 = parse.compile("Vertex {:d} {:g} {:g} {:g} {Jfeature=({:g} {:g} {:g} {:g} {:g} {:g} {:g})}")
-    parser2 = parse.compile("Vertex {:d} {:g} {:g} {:g}")
+    isMultilevelUCF = False
+    return coords, faces, attributes, isMultilevelUCF
 
-    while lines[ctr][0:6] != 'Vertex':
-        ctr += 1
 
-    # First read the vertices
-    line = lines[ctr]
-    line_split = line.split()
-    ctr += 1
-    # ctr = 1;
-    attributes = []
-    while line_split[0] == 'Vertex':
-        result = parser1.parse(line)
-        if result is not None:
-            (idx, vtx1, vtx2, vtx3, radial_dist, mTBM1, mTBM2, mTBM3, detJacobian, eig1Jacobian, eig2Jacobian) = result.fixed
-            attributes.append(radial_dist)
-        else:
-            result = parser2.parse(line)
-            if result is not None:
-                (idx, vtx1, vtx2, vtx3) = result.fixed
-            else:
-                sys.stdout.write('Cannot parse the line' + line)
-
-        coords.append([vtx1, vtx2, vtx3])
-        line = lines[ctr]
-        line_split = line.split()
-        ctr += 1
+def readccbbm_using_parse(filename):
+    # The attributes are the radial distances of the vertices with a {Jfeature=(...)} field of seven values
+    coords, faces, radial_dist = read_ccbbm_sections(filename, r'[ \t]+\{Jfeature=\((\S+)(?:[ \t]+\S+){6}\)\}[ \t]*$')
 
-    coords = np.array(coords)
-    # The rest of the lines are faces
-    faces = []
-    ctr -= 1
-    for ii in range(ctr, len(lines)):
-        line = lines[ii]
-        result = parse.search("Face {:d} {:d} {:d} {:d}", line)
-        (idx, face1, face2, face3) = result.fixed
-        faces.append([face1, face2, face3])
-
-    faces = np.array(faces)
-    if faces.min() == 1:
-        faces -= 1
+    attributes = np.array([r for r in radial_dist if r], dtype=float).tolist()
 
     isMultilevelUCF = False
     return coords, faces, attributes, isMultilevelUCF
@@ -383,32 +334,35 @@ def ReadUCFMultipleLevelsWithData(filename):
     """
     #sys.stdout.write('Reading UCF file ' + filename+'...')
     fid = open(filename,'rt')
-    dummy = ''
+    lines = fid.read().splitlines()
+    fid.close()
+    ctr = 0
     # Read all the preamble till you reach contour_data
-    while dummy != '<levels>':
-        dummy = fid.readline().rstrip('\n')
-        dummy = dummy.rstrip()
+    while lines[ctr].rstrip() != '<levels>':
+        ctr += 1
     # The next line is the number of levels
-    num_levels = int(fid.readline().rstrip('\n'))
+    num_levels = int(lines[ctr + 1])
 
     X = []
     attributes = []
-    for ctr in np.arange(0,num_levels):
-        while dummy != '<point_num=>':
-            dummy = fid.readline().rstrip('\n');
-            dummy=dummy.rstrip()
-        N = int(fid.readline().rstrip('\n'))
-        dummy = fid.readline()
-        Xtemp = [fid.readline().rstrip().split(' ') for i in np.arange(0,N)]
-
-        Xtemp = np.array(Xtemp,dtype=float)
+    for level in np.arange(0,num_levels):
+        while lines[ctr].rstrip() != '<point_num=>':
+            ctr += 1
+        N = int(lines[ctr + 1])
+        # Skip <contour_data=> and parse all the points of the level at once
+        level_lines = lines[ctr + 3:ctr + 3 + N]
+        ctr += 3 + N
+        num_columns = len(level_lines[0].split()) if N > 0 else 3
+        Xtemp = np.fromstring(' '.join(level_lines), sep=' ')
+        if len(Xtemp) != N*num_columns:
+            raise ValueError('Could not read the points of level ' + str(level) + ' in ' + filename + '.')
+        Xtemp = Xtemp.reshape(N, num_columns)
 
         X.append(np.array(Xtemp[:,0:3]))
         if Xtemp.shape[1] == 4:
             attributes.append(np.array(Xtemp[:,3]))
 
     sys.stdout.write('Done.\n')
-    fid.close()
     return X,attributes
 
 
@@ -434,7 +388,7 @@ def readsurface_new(filename):
         return coords,faces,attributes,isMultilevelUCF
 
     def vtp(filename):
-        coords,faces,attributes, labels = vtkio.ReadVTK_XML_Polydata(filename)
+        coords,faces,attributes = ReadVTK_XML_Polydata(filename)
         isMultilevelUCF = False
         return coords,faces,attributes,isMultilevelUCF
 
@@ -504,7 +458,7 @@ def readsurface_new(filename):
 def readsurface(filename):
 
     def vtp(filename):
-        return vtkio.ReadVTK_XML_Polydata(filename)
+        return ReadVTK_XML_Polydata(filename)
 
     def ucf(filename):
         X,attributes = ReadUCFMultipleLevelsWithData(filename)
@@ -574,6 +528,7 @@ def writesurface(filename,coords,faces,attributes):
         return None
 
     def pial(filename):
+        import nibabel
         nibabel.freesurfer.io.write_geometry(filename, coords, faces)
         return None
 
@@ -593,7 +548,7 @@ def writesurface(filename,coords,faces,attributes):
         return None
 
 
-def writesurface_new(filename,coords,faces,attributes=[],isMultilevelUCF=False):
+def writesurface_new(filename,coords,faces,attributes=[],isMultilevelUCF=False,vtp_format='ascii',compress=False):
 
     def mincobj(filename):
         pass
@@ -619,9 +574,11 @@ def writesurface_new(filename,coords,faces,attributes=[],isMultilevelUCF=False):
         return None
 
     def vtp(filename):
-        WriteVTK_XML_Polydata(filename, coords, faces, '', attributes)
+        WriteVTK_XML_Polydata(filename, coords, faces, '', attributes, ascii_flag=(vtp_format == 'ascii'),
+                              appended=(vtp_format == 'appended'), compress=compress)
 
     def pial(filename):
+        import nibabel
         sys.stdout.write('Writing pial file ' + filename)
         nibabel.freesurfer.io.write_geometry(filename, coords, faces)
         return None
@@ -711,6 +668,7 @@ def read_aggregated_attributes_from_surfacefilelist(surfacefilelist):
 
 
 def read_aggregated_attributes_from_surfaces(filename):
+    import pandas as pd
     data_list = pd.read_table(filename, sep='\t')
 
     # Read first file
@@ -774,9 +732,121 @@ def write_pvalues_to_surface(pvalue_array, s1, filename):
     s1.write(filename)
 
 
-def WriteVTK_XML_Polydata(vtkfile,coords,faces,attriblabel,attrib,ascii_flag=True):
+def vtp_encode_data_array(values, compress=False):
+    """
+    Returns the UInt32 header and the bytes of a binary vtp data array. Compressed data is split into zlib
+    compressed blocks of vtp_block_size bytes and the header lists the number of blocks, the block size,
+    the size of the last block and the compressed size of each block.
+    """
+    data = values.tostring()
+    if not compress:
+        return np.array([len(data)], dtype='<u4').tostring(), data
+
+    blocks = [zlib.compress(data[i:i + vtp_block_size]) for i in range(0, len(data), vtp_block_size)]
+    last_block_size = len(data) - (len(blocks) - 1)*vtp_block_size if blocks else 0
+    header = [len(blocks), vtp_block_size, last_block_size] + [len(block) for block in blocks]
+    return np.array(header, dtype='<u4').tostring(), ''.join(blocks)
+
+
+def vtp_decode_data_array(data, header_dtype, compressed, encoding):
+    """
+    Returns the bytes of the binary vtp data array at the start of data, which is a base64 string or raw bytes.
+    """
+    header_size = header_dtype.itemsize
+
+    def read(start, nbytes):
+        if encoding == 'base64':
+            nchars = 4*((nbytes + 2)/3)
+            return base64.b64decode(data[start:start + nchars]), start + nchars
+        return data[start:start + nbytes], start + nbytes
+
+    if not compressed:
+        header, pos = read(0, header_size)
+        nbytes = int(np.frombuffer(header[0:header_size], dtype=header_dtype)[0])
+        if encoding == 'base64':
+            return read(0, header_size + nbytes)[0][header_size:]
+        return read(pos, nbytes)[0]
+
+    header, pos = read(0, 3*header_size)
+    num_blocks = int(np.frombuffer(header, dtype=header_dtype)[0])
+    header, pos = read(0, (3 + num_blocks)*header_size)
+    block_sizes = np.frombuffer(header, dtype=header_dtype)[3:].astype('int')
+    compressed_data = read(pos, block_sizes.sum())[0]
+    block_starts = np.concatenate(([0], np.cumsum(block_sizes)))
+    return ''.join([zlib.decompress(compressed_data[block_starts[i]:block_starts[i + 1]])
+                    for i in range(num_blocks)])
+
+
+def ReadVTK_XML_Polydata(vtkfile):
+    """
+    Reads a triangulated surface from a VTK XML polydata (.vtp) file with ascii, binary or appended data arrays,
+    optionally zlib compressed. Returns the coordinates, the faces and the first point data array as attributes,
+    or [] if the file has no point data.
+    """
+
+    fid = open(vtkfile, mode='rb')
+    text = fid.read()
+    fid.close()
+
+    # The raw appended data is not valid xml, so it is cut off before parsing the rest of the file
+    appended_data = ''
+    appended_encoding = 'raw'
+    appended_start = text.find('<AppendedData')
+    if appended_start >= 0:
+        data_start = text.index('_', appended_start) + 1
+        appended_encoding = cElementTree.fromstring(text[appended_start:data_start - 1] +
+                                                    '</AppendedData>').get('encoding', 'raw')
+        appended_data = text[data_start:]
+        text = text[0:appended_start] + '</VTKFile>'
+
+    root = cElementTree.fromstring(text)
+    byte_order = '>' if root.get('byte_order') == 'BigEndian' else '<'
+    header_dtype = np.dtype(byte_order + VTP_TYPES[root.get('header_type', 'UInt32')])
+    compressed = root.get('compressor') is not None
+
+    def read_data_array(element):
+        dtype = np.dtype(byte_order + VTP_TYPES[element.get('type')])
+        data_format = element.get('format', 'ascii')
+        if data_format == 'ascii':
+            return np.fromstring(element.text, dtype=dtype.newbyteorder('='), sep=' ')
+        elif data_format == 'binary':
+            data = vtp_decode_data_array(''.join(element.text.split()), header_dtype, compressed, 'base64')
+        else:
+            offset = int(element.get('offset'))
+            data = vtp_decode_data_array(appended_data[offset:], header_dtype, compressed, appended_encoding)
+        return np.frombuffer(data, dtype=dtype)
+
+    piece = root.find('PolyData/Piece')
+    coords = read_data_array(piece.find('Points/DataArray')).astype('float').reshape(-1, 3)
+
+    polys = dict([(element.get('Name'), element) for element in piece.findall('Polys/DataArray')])
+    connectivity = read_data_array(polys['connectivity']).astype('int')
+    offsets = read_data_array(polys['offsets']).astype('int')
+    if not np.array_equal(offsets, np.arange(3, len(connectivity) + 1, 3)):
+        raise ValueError('Only triangulated surfaces are supported in vtp file ' + vtkfile)
+    faces = connectivity.reshape(-1, 3)
+
+    attributes = []
+    point_data = piece.find('PointData')
+    if point_data is not None:
+        arrays = point_data.findall('DataArray')
+        scalars = [element for element in arrays if element.get('Name') == point_data.get('Scalars')]
+        if scalars or arrays:
+            attributes = read_data_array((scalars or arrays)[0]).astype('float')
+
+    return coords, faces, attributes
+
+
+def WriteVTK_XML_Polydata(vtkfile,coords,faces,attriblabel,attrib,ascii_flag=True,appended=False,compress=False):
+    """
+    Writes a triangulated surface as a VTK XML polydata (.vtp) file. If ascii_flag is False, the data arrays are
+    written in binary, either base64 encoded inline or, if appended is True, as raw bytes in an appended data section.
+    Binary data arrays are zlib compressed if compress is True.
+    """
 
     sys.stdout.write('Writing vtp file ' + vtkfile + '...')
+    coords = np.asarray(coords)
+    faces = np.asarray(faces)
     T = coords.shape[0]
     F = faces.shape[0]
 
@@ -784,57 +854,78 @@ def WriteVTK_XML_Polydata(vtkfile,coords,faces,attriblabel,attrib,ascii_flag=Tru
         print "Attribute length " + str(len(attrib)) + " not the same as the length of coordinate vertices " + str(coords.shape[0]) +  " . Not saving file"
         return None
 
-    fid = open(vtkfile,mode='wt')
-    fid.write('<?xml version="1.0"?>\n')
-    fid.write('<VTKFile type="PolyData" version="0.1" byte_order="LittleEndian">\n');
-    fid.write('<PolyData>\n');
-    fid.write('<Piece NumberOfPoints="{0}" NumberOfVerts="0" NumberOfLines="0" NumberOfStrips="0" NumberOfPolys="{1}">\n'.format(T,F))
-    fid.write('<Points>\n');
-    fid.write('<DataArray type="Float32" NumberOfComponents="3" format="ascii">\n');
+    if faces.min() == 1:
+        faces = faces - 1
 
-    for i in coords:
-        fid.write("{0:f} {1:f} {2:f}\n".format(float(i[0]),float(i[1]),float(i[2])))
+    triangles = np.ravel(faces,'C').astype('int')
+    idx_array = np.arange(3,3*faces.shape[0]+3,3)
 
-    fid.write('</DataArray>\n');
-    fid.write('</Points>\n');
+    if ascii_flag:
+        data_format = ' format="ascii"'
+    elif appended:
+        data_format = ' format="appended" offset="{0}"'
+    else:
+        data_format = ' format="binary"'
+
+    appended_data = []
+    appended_offset = [0]
+
+    def write_data_array(tag, values, dtype, ascii_format, components=1):
+        if ascii_flag:
+            fid.write(tag.format(data_format) + '\n')
+            fid.write((ascii_format * (len(values)/components)) % tuple(values))
+            if components == 1:
+                fid.write('\n')
+            fid.write('</DataArray>\n')
+            return
+
+        header, data = vtp_encode_data_array(values.astype(dtype), compress)
+        if appended:
+            fid.write(tag.format(data_format.format(appended_offset[0]))[0:-1] + '/>\n')
+            appended_data.extend([header, data])
+            appended_offset[0] += len(header) + len(data)
+        else:
+            fid.write(tag.format(data_format) + '\n')
+            if compress:
+                fid.write(base64.b64encode(header) + base64.b64encode(data))
+            else:
+                fid.write(base64.b64encode(header + data))
+            fid.write('\n</DataArray>\n')
+
+    fid = open(vtkfile,mode='wb')
+    fid.write('<?xml version="1.0"?>\n')
+    if compress and not ascii_flag:
+        fid.write('<VTKFile type="PolyData" version="0.1" byte_order="LittleEndian" '
+                  'compressor="vtkZLibDataCompressor">\n')
+    else:
+        fid.write('<VTKFile type="PolyData" version="0.1" byte_order="LittleEndian">\n')
+    fid.write('<PolyData>\n')
+    fid.write('<Piece NumberOfPoints="{0}" NumberOfVerts="0" NumberOfLines="0" NumberOfStrips="0" NumberOfPolys="{1}">\n'.format(T,F))
+    fid.write('<Points>\n')
+    write_data_array('<DataArray type="Float32" NumberOfComponents="3"{0}>', np.ravel(coords,'C'), '<f4',
+                     '%f %f %f\n', components=3)
+    fid.write('</Points>\n')
 
     if len(attrib) > 0:
         if attriblabel == "":
             attriblabel = "attrib-label"
 
         fid.write('<PointData Scalars="{0}">\n'.format(attriblabel))
-        fid.write('<DataArray type="Float32" Name="{0}" format="ascii">\n'.format(attriblabel))
-        for i in attrib:
-            fid.write("{0:f} ".format(float(i)))
-
-        fid.write('\n</DataArray>\n')
+        write_data_array('<DataArray type="Float32" Name="' + attriblabel + '"{0}>', np.ravel(attrib).astype('float'), '<f4', '%f ')
         fid.write('</PointData>\n')
 
-    fid.write('<Polys>\n');
-    fid.write('<DataArray type="Int32" Name="connectivity" format="ascii">\n');
-
-    if faces.min() == 1:
-        faces -= 1
-
-    triangles = np.ravel(faces,'C').astype('int')
-
-    for i in triangles:
-        fid.write("{0:d} ".format(i))
-
-
-    fid.write('\n</DataArray>\n');
-    fid.write('<DataArray type="Int32" Name="offsets" format="ascii">\n')
-
-    idx_array = np.arange(3,3*faces.shape[0]+3,3)
-
-    for i in idx_array:
-        fid.write("{0:d} ".format(i))
-
-    fid.write('\n</DataArray>\n')
+    fid.write('<Polys>\n')
+    write_data_array('<DataArray type="Int32" Name="connectivity"{0}>', triangles, '<i4', '%d ')
+    write_data_array('<DataArray type="Int32" Name="offsets"{0}>', idx_array, '<i4', '%d ')
     fid.write('</Polys>\n')
 
     fid.write('</Piece>\n')
     fid.write('</PolyData>\n')
+    if appended_data:
+        fid.write('<AppendedData encoding="raw">\n_')
+        for data in appended_data:
+            fid.write(data)
+        fid.write('\n</AppendedData>\n')
     fid.write('</VTKFile>\n')
 
     fid.close()
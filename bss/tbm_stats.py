@@ -32,6 +32,7 @@ from sys import float_info
 import scipy
 from patsy import dmatrix
 import excepts
+import stats_glm
 from scipy.stats import ttest_ind, ttest_rel
 
 
@@ -80,40 +81,7 @@ def corr_fast(model, sdata):
 
 
 def anova_np(model, sdata):  # Anova using numpy/scipy
-    N = sdata.phenotype_array.shape[0]  # Number of observations
-    statsresult = StatsResult(dim=sdata.phenotype_array.shape[1])
-
-    try:
-
-        # Create a design matrix
-        X_design_full = dmatrix(model.fullmodel, data=sdata.demographic_data)  # Design matrix for full model
-        Xtemp = np.dot(np.linalg.inv(np.dot(X_design_full.T, X_design_full)), X_design_full.T)  # Pre Hat matrix
-        beta_full = np.dot(Xtemp, sdata.phenotype_array)  # beta coefficients
-        y_full = np.dot(X_design_full, beta_full)  # Predicted response
-        RSS_full = np.sum((sdata.phenotype_array - y_full)**2, axis=0)
-
-        X_design_null = dmatrix(model.nullmodel, data=sdata.demographic_data)  # Design matrix for null model
-        Xtemp = np.dot(np.linalg.inv(np.dot(X_design_null.T, X_design_null)), X_design_null.T)  # Pre Hat matrix
-        beta_null = np.dot(Xtemp, sdata.phenotype_array)  # beta coefficients
-        y_null = np.dot(X_design_null, beta_null)  # Predicted response
-        RSS_null = np.sum((sdata.phenotype_array - y_null)**2, axis=0)
-
-        np_full = model.nump_full_model()
-        np_null = model.nump_null_model()
-
-        Fstat = (RSS_null - RSS_full)/(RSS_full + +np.finfo(float).eps) * (N-np_full-1)/(np_full-np_null)  # F statistic
-        model_unique_idx = X_design_full.design_info.term_names.index(model.unique)
-        se_full_unique = np.diag(np.sqrt(np.linalg.inv(np.dot(X_design_full.T, X_design_full))))[model_unique_idx] * np.sqrt(RSS_full / (N - np_full - 1))
-        tvalue_sign = (beta_full[model_unique_idx, :] + np.finfo(float).eps)/np.absolute(beta_full[model_unique_idx, :] + np.finfo(float).eps)
-        pvalues = 1.0 - scipy.stats.f.cdf(Fstat, np_full-np_null, N-np_full-1)  # pvalue under the F distribution
-        pvalues[np.isnan(pvalues)] = 1
-        statsresult.pvalues = pvalues*tvalue_sign
-        statsresult.tvalues = beta_full[model_unique_idx, :]/se_full_unique + np.finfo(float).eps
-
-    except np.linalg.LinAlgError as e:
-        raise excepts.ModelFailureError('Error in solving the linear system. Perhaps the data is insufficient to fit the model?\n')
-
-    return statsresult
+    return stats_glm.anova_np(model, sdata)
 
 
 # Independent samples t-test
@@ -0,0 +1,64 @@
+""" This module measures the startup time of the bss command line tools
+    Each tool in bin is imported (without running main) in a fresh interpreter, and the import time and the heavy
+    packages that were loaded are reported. Run as python -m bss.test.benchmark_startup [-repeat N] [tool ...]
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+heavy_packages = ['scipy', 'pandas', 'patsy', 'statsmodels', 'matplotlib', 'nibabel', 'rpy2', 'vtk']
+
+import_script = '''
+import imp, json, os, sys, time
+# Like running the script, its directory is searched first for imports
+sys.path.insert(0, os.path.dirname(sys.argv[1]))
+t = time.time()
+imp.load_source('bss_startup_entry_point', sys.argv[1])
+elapsed = time.time() - t
+print(json.dumps({'time': elapsed, 'loaded': [pkg for pkg in %r if pkg in sys.modules]}))
+''' % heavy_packages
+
+
+def time_entry_point(filename, repeat=3):
+    bss_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([bss_dir] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    times = []
+    loaded = []
+    for i in range(0, repeat):
+        output = subprocess.check_output([sys.executable, '-c', import_script, filename], env=env)
+        result = json.loads(output.splitlines()[-1])
+        times.append(result['time'])
+        loaded = result['loaded']
+    return sorted(times)[len(times) // 2], loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of the bss command line tools.\n')
+    parser.add_argument('tools', nargs='*', help='<tools in bin to measure [all]>')
+    parser.add_argument('-repeat', dest='repeat', help='<number of runs per tool, the median is reported>',
+                        required=False, type=int, default=3)
+    args = parser.parse_args()
+
+    bin_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bin')
+    tools = args.tools or sorted(os.path.basename(f) for f in glob.glob(os.path.join(bin_dir, '*.py')))
+    sys.stdout.write('{0:<40s} {1:>8s}  {2:s}\n'.format('tool', 'time (s)', 'heavy packages loaded'))
+    for tool in tools:
+        try:
+            elapsed, loaded = time_entry_point(os.path.join(bin_dir, tool), args.repeat)
+            sys.stdout.write('{0:<40s} {1:>8.3f}  {2:s}\n'.format(tool, elapsed, ', '.join(loaded)))
+        except subprocess.CalledProcessError:
+            sys.stdout.write('{0:<40s} {1:>8s}  {2:s}\n'.format(tool, '-', 'import failed'))
+
+
+if __name__ == '__main__':
+    main()
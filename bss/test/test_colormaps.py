@@ -0,0 +1,59 @@
+""" This module implements tests for the colormaps
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+from bss.colormaps import Colormap
+
+
+def rgb_from_attribute_loop(attrib_range, red_range, green_range, blue_range, value):
+    idx1 = np.where((attrib_range <= value) == True)[0][-1]
+    idx2 = np.where((attrib_range >= value) == True)[0][0]
+    return [(1.0 - value)*red_range[idx1] + value*red_range[idx2],
+            (1.0 - value)*green_range[idx1] + value*green_range[idx2],
+            (1.0 - value)*blue_range[idx1] + value*blue_range[idx2]]
+
+
+def test_rgb_color_array_matches_per_vertex_loop():
+    rng = np.random.RandomState(0)
+    attributes = {'pvalue': np.where(rng.rand(2000) < 0.5, -1, 1)*rng.uniform(1e-4, 1, 2000),
+                  'corr': rng.uniform(-0.8, 0.6, 2000)}
+    for value_type in ['pvalue', 'corr']:
+        cmap = Colormap(value_type, attributes[value_type])
+        # Include the breakpoints themselves
+        values = np.concatenate([attributes[value_type], cmap.attrib_range])
+        vColor = Colormap.get_rgb_color_array(value_type, values)
+        vColor_loop = [rgb_from_attribute_loop(cmap.attrib_range, cmap.red_range, cmap.green_range,
+                                               cmap.blue_range, value) for value in values]
+        assert vColor.shape == (len(values), 3)
+        assert np.allclose(vColor, vColor_loop)
+
+        for lut_size in [256, 4096]:
+            vColor_lut = Colormap.get_rgb_color_array(value_type, values, lut_size=lut_size)
+            lut = cmap.make_lut(lut_size)
+            assert vColor_lut.shape == vColor.shape
+            assert np.all([np.any(np.all(lut == rgb, axis=1)) for rgb in vColor_lut[:50]])
+
+
+def test_segmented_colormap_matches_matplotlib():
+    from matplotlib import colors as mpl_colors
+    rng = np.random.RandomState(0)
+    log_pvalues = np.where(rng.rand(2000) < 0.5, -1, 1)*rng.uniform(0, 6, 2000)
+    tvalues = rng.normal(0, 3, 2000)
+    corrvalues = rng.uniform(-0.7, 0.5, 2000)
+    vColor_pvalues, pex, cmap_pvalues = Colormap.log_pvalues_to_rgb(log_pvalues)
+    vColor_tvalues, tmin, tmax, cmap_tvalues = Colormap.tvalues_to_rgb(tvalues)
+    vColor_corr, cex, cmap_corr = Colormap.correlation_to_rgb(corrvalues)
+    for vColor, cmap, values in [(vColor_pvalues, cmap_pvalues, log_pvalues), (vColor_tvalues, cmap_tvalues, tvalues),
+                                 (vColor_corr, cmap_corr, corrvalues)]:
+        mpl_cmap = mpl_colors.LinearSegmentedColormap('my_bi_cmap', cmap.segmentdata, 256)
+        mpl_cmap._init()
+        assert np.array_equal(cmap.lut, mpl_cmap._lut[0:256, 0:3])
+        x = np.concatenate([np.linspace(-0.1, 1.1, 1000), [np.nan]])
+        assert np.array_equal(cmap(x), mpl_cmap(x)[:, 0:3])
+        assert vColor.shape == (len(values), 3)
@@ -0,0 +1,116 @@
+""" This module implements tests for reading and writing dfs surfaces
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+import os
+from bss import dfsio
+from bss.atlas_cache import AtlasCache
+from bss.nimgdata_io import NimgDataio
+
+
+def make_surface(num_vertices=50, num_faces=80, seed=0):
+    rng = np.random.RandomState(seed)
+
+    class NFV:
+        pass
+
+    NFV.faces = rng.randint(0, num_vertices, (num_faces, 3))
+    NFV.vertices = rng.randn(num_vertices, 3).astype('float32')
+    NFV.labels = rng.randint(0, 200, num_vertices).astype('uint16')
+    NFV.attributes = rng.randn(num_vertices).astype('float32')
+    return NFV
+
+
+def test_readdfs_mmap_matches_readdfs(tmpdir):
+    fname = str(tmpdir.join('surface.dfs'))
+    dfsio.writedfs(fname, make_surface())
+    s1 = dfsio.readdfs(fname)
+    s1_map = dfsio.readdfs_mmap(fname)
+    for field in ['faces', 'vertices', 'labels', 'attributes']:
+        assert np.array_equal(getattr(s1, field), getattr(s1_map, field))
+    assert not hasattr(s1_map, 'vColor') and not hasattr(s1_map, 'normals')
+    assert s1_map.hdr.nVertices == 50 and s1_map.hdr.nTriangles == 80
+
+    # Modifying a section in place does not change the file
+    s1_map.vertices[0, :] = 100
+    assert np.array_equal(dfsio.readdfs(fname).vertices, s1.vertices)
+    s1_map.attributes = np.zeros(50)
+    dfsio.writedfs(str(tmpdir.join('surface_out.dfs')), s1_map)
+    s2 = dfsio.readdfs(str(tmpdir.join('surface_out.dfs')))
+    assert np.all(s2.vertices[0, :] == 100) and np.all(s2.attributes == 0)
+    assert np.array_equal(s2.faces, s1.faces) and np.array_equal(s2.labels, s1.labels)
+
+
+def test_read_aggregated_attributes_reports_all_mismatches(tmpdir, capsys):
+    fnames = [str(tmpdir.join('surface' + str(i) + '.dfs')) for i in range(0, 4)]
+    for i, fname in enumerate(fnames):
+        dfsio.writedfs(fname, make_surface(num_vertices=60 if i in [1, 3] else 50, seed=i))
+    attribute_array = NimgDataio.read_aggregated_attributes_from_filelist([fnames[0], fnames[2]], 50, num_workers=2)
+    assert np.array_equal(attribute_array[1, :], dfsio.readdfsattributes(fnames[2]))
+
+    assert NimgDataio.read_aggregated_attributes_from_filelist(fnames, 50) == []
+    output = capsys.readouterr()[0]
+    assert fnames[1] + ':' in output and fnames[3] + ':' in output and fnames[0] + ':' not in output
+
+
+def test_read_aggregated_attributes_from_an_empty_filelist():
+    attribute_array = NimgDataio.read_aggregated_attributes_from_filelist([], 50, num_workers=2)
+    assert attribute_array.shape == (0, 50)
+    attribute_array = NimgDataio.read_aggregated_attributes_from_filelist([], 50, mask_idx=np.arange(0, 10))
+    assert attribute_array.shape == (0, 10)
+
+
+def test_dfs_template_writer_patches_attributes_and_colors(tmpdir):
+    template = str(tmpdir.join('template.dfs'))
+    surface = make_surface()
+    del surface.attributes
+    dfsio.writedfs(template, surface)
+    dfs_writer = dfsio.DfsTemplateWriter(template)
+    attributes = np.arange(50, dtype='float64')
+    vColor = np.random.RandomState(1).rand(50, 3)
+    for i in range(0, 2):
+        dfs_writer.write(str(tmpdir.join('out' + str(i) + '.dfs')), attributes + i, vColor)
+    s1 = dfsio.readdfs(str(tmpdir.join('out1.dfs')))
+    assert np.allclose(s1.attributes, attributes + 1) and np.allclose(s1.vColor, vColor)
+    for field in ['faces', 'vertices', 'labels']:
+        assert np.array_equal(getattr(s1, field), getattr(surface, field))
+    # The template itself is not changed
+    assert not hasattr(dfsio.readdfs(template), 'vColor')
+
+
+def test_writedfs_round_trip(tmpdir):
+    surface = make_surface()
+    rng = np.random.RandomState(2)
+    surface.u = rng.rand(50)
+    surface.v = rng.rand(50)
+    surface.vColor = rng.rand(50, 3)
+    fname = str(tmpdir.join('surface.dfs'))
+    dfsio.writedfs(fname, surface, atomic=True)
+    assert tmpdir.listdir() == [tmpdir.join('surface.dfs')]
+    s1 = dfsio.readdfs(fname)
+    for field in ['faces', 'vertices', 'labels', 'attributes', 'u', 'v', 'vColor']:
+        assert np.allclose(getattr(s1, field), getattr(surface, field))
+
+
+def test_atlas_cache_shares_geometry_with_overlays(tmpdir):
+    fname = str(tmpdir.join('atlas.dfs'))
+    dfsio.writedfs(fname, make_surface())
+    s1 = AtlasCache.surface(fname)
+    s2 = AtlasCache.surface(fname)
+    assert s1.atlas is s2.atlas
+    assert not s1.vertices.flags.writeable
+    s1.attributes = np.zeros(50)
+    assert np.all(s1.attributes == 0) and np.array_equal(s2.attributes, dfsio.readdfs(fname).attributes)
+    assert np.array_equal(s1.label_ids, np.unique(s1.labels))
+
+    # A changed file is parsed again
+    dfsio.writedfs(fname, make_surface(seed=1), atomic=True)
+    os.utime(fname, (os.stat(fname).st_atime, os.stat(fname).st_mtime + 10))
+    assert AtlasCache.surface(fname).atlas is not s1.atlas
+    assert np.array_equal(AtlasCache.surface(fname).vertices, make_surface(seed=1).vertices)
@@ -0,0 +1,87 @@
+""" This module implements tests for reading the model specification
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+from bss.modelspec import ModelSpec
+
+modelspec_txt = '''[subjectinfo]
+subjectid = subjID
+demographics = {0:s}
+fileid = file
+atlas = {1:s}
+maskfile =
+
+[analysis]
+type = cbm
+
+[model]
+modeltype = modelcomparison
+fullmodel = age + sex
+nullmodel = sex
+test = anova
+'''
+
+
+def write_modelspec(tmpdir, demographics_txt, designs_txt=''):
+    demographics_file = tmpdir.join('demographics.csv')
+    demographics_file.write(demographics_txt)
+    atlas_file = tmpdir.join('atlas.dfs')
+    atlas_file.write('')
+    modelspec_file = tmpdir.join('modelspec.ini')
+    modelspec_file.write(modelspec_txt.format(str(demographics_file), str(atlas_file)) + designs_txt)
+    return str(modelspec_file)
+
+
+def test_modelspec_reads_only_used_demographics(tmpdir):
+    # Missing values in columns that the model does not use are ignored
+    model = ModelSpec(write_modelspec(tmpdir, 'subjID,age,sex,notes,file\n'
+                                              '001,20,1,,s1.dfs\n'
+                                              '002,30,0,left handed,s2.dfs\n'))
+    assert model.read_success
+    assert model.demographic_columns == ['subjID', 'age', 'sex', 'notes', 'file']
+    assert list(model.demographic_data.columns) == ['subjID', 'age', 'sex', 'file']
+    assert list(model.demographic_data['subjID']) == ['001', '002']
+
+
+def test_modelspec_fails_for_missing_values_in_model(tmpdir):
+    model = ModelSpec(write_modelspec(tmpdir, 'subjID,age,sex,file\n'
+                                              '001,,1,s1.dfs\n'
+                                              '002,30,0,s2.dfs\n'))
+    assert not model.read_success
+
+
+def test_modelspec_reads_multiple_designs(tmpdir):
+    model = ModelSpec(write_modelspec(tmpdir, 'subjID,age,sex,iq,file\n'
+                                              '001,20,1,100,s1.dfs\n'
+                                              '002,30,0,110,s2.dfs\n',
+                                      '\n[model sexeffect]\n'
+                                      'modeltype = modelcomparison\n'
+                                      'fullmodel = age + sex\n'
+                                      'nullmodel = age | sex\n'
+                                      'test = anova\n'
+                                      '\n[measure]\n'
+                                      'coeff = corr\n'
+                                      'variable = iq\n'))
+    assert model.read_success
+    assert model.designs[0] is model
+    assert [design.result_prefix() for design in model.designs] == ['anova_age_atlas', 'sexeffect_anova_sex_atlas',
+                                                                    'sexeffect_anova_age_atlas', 'corr_iq_atlas']
+    assert all([design.demographic_data is model.demographic_data for design in model.designs])
+    assert list(model.demographic_data.columns) == ['subjID', 'age', 'sex', 'iq', 'file']
+
+
+def test_modelspec_fails_for_designs_with_the_same_prefix(tmpdir):
+    model = ModelSpec(write_modelspec(tmpdir, 'subjID,age,sex,file\n'
+                                              '001,20,1,s1.dfs\n'
+                                              '002,30,0,s2.dfs\n',
+                                      '\n[model covariates]\n'
+                                      'modeltype = modelcomparison\n'
+                                      'fullmodel = age + sex\n'
+                                      'nullmodel = sex|sex\n'
+                                      'test = anova\n'))
+    assert not model.read_success
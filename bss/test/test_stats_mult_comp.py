@@ -0,0 +1,35 @@
+""" This module implements tests for the multiple comparisons adjustment
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+from statsmodels.sandbox.stats.multicomp import multipletests
+from bss.stats_mult_comp import Stats_Multi_Comparisons
+
+
+def test_adjust_matches_statsmodels():
+    rng = np.random.RandomState(0)
+    pvalues = np.concatenate([rng.uniform(0, 1e-3, 50), rng.uniform(0, 1, 950)])
+    signs = np.where(rng.rand(len(pvalues)) < 0.5, -1, 1)
+    sm_methods = {'BH': 'fdr_bh', 'BY': 'fdr_by', 'bonferroni': 'bonferroni', 'holm': 'holm',
+                  'hochberg': 'simes-hochberg'}
+    for method in Stats_Multi_Comparisons.methods:
+        p_adjust = Stats_Multi_Comparisons.adjust(signs*pvalues, method=method)
+        assert np.allclose(p_adjust, signs*multipletests(pvalues, method=sm_methods[method])[1])
+
+        # Chunked ranks, float32 in place and NaNs left out of the number of comparisons
+        rank_chunk_size = Stats_Multi_Comparisons.rank_chunk_size
+        Stats_Multi_Comparisons.rank_chunk_size = 64
+        try:
+            p_inplace = np.append(signs*pvalues, np.nan).astype(np.float32)
+            p_adjust_inplace = Stats_Multi_Comparisons.adjust(p_inplace, method=method, inplace=True)
+        finally:
+            Stats_Multi_Comparisons.rank_chunk_size = rank_chunk_size
+        assert p_adjust_inplace is p_inplace
+        assert np.isnan(p_inplace[-1])
+        assert np.allclose(p_inplace[:-1], p_adjust, rtol=1e-5)
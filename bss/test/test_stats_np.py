@@ -0,0 +1,261 @@
+""" This module implements tests for the numpy statistical engine
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+import pandas
+from bss import cbm_stats
+from bss import tbm_stats
+from bss import stats_glm
+from bss import stats_permutation
+from bss import roi_stats
+from bss.stats_checkpoint import StatsCheckpoint
+from bss import stats_engine
+from bss.stats_engine import StatsEngine
+from scipy.stats import ttest_ind
+
+
+class Model(object):
+    fullmodel = 'age + sex'
+    roimeasure = 'gmthickness'
+    nullmodel = 'sex'
+    unique = 'age'
+    variable = 'age'
+    hypothesis_group = 'sex'
+
+    def nump_full_model(self):
+        return 2
+
+    def nump_null_model(self):
+        return 1
+
+
+class Data(object):
+
+    def __init__(self, num_subjects=30, num_vertices=1000, block_size=None, seed=0):
+        rng = np.random.RandomState(seed)
+        self.demographic_data = pandas.DataFrame({'age': rng.randint(20, 80, num_subjects),
+                                                  'sex': rng.randint(0, 2, num_subjects)})
+        self.phenotype_array = rng.randn(num_subjects, num_vertices)
+        self.phenotype_array[:, 0:100] += 0.05*self.demographic_data['age'].values[:, np.newaxis]
+        if block_size is None:
+            block_size = num_vertices
+        self.blocks_idx = [(i, min(i + block_size, num_vertices)) for i in range(0, num_vertices, block_size)]
+
+
+def test_anova_np_blocks_match_single_block():
+    model = Model()
+    for stats_module in [cbm_stats, tbm_stats]:
+        result_single = stats_module.anova_np(model, Data())
+        result_blocks = stats_module.anova_np(model, Data(block_size=77))
+        assert np.allclose(result_single.pvalues, result_blocks.pvalues)
+        assert np.allclose(result_single.tvalues, result_blocks.tvalues)
+        # The vertices with an age effect should be significant
+        assert np.all(np.abs(result_single.pvalues[0:100]) < 0.05)
+
+
+def test_glm_model_comparison_matches_normal_equations():
+    rng = np.random.RandomState(1)
+    X_full = np.column_stack([np.ones(40), rng.randn(40), rng.randn(40)])
+    Y = rng.randn(40, 50)
+    for X_null in [X_full[:, [0, 2]], np.column_stack([np.ones(40), rng.randn(40)])]:
+        glm = stats_glm.GLMModelComparison(X_full, X_null, 1)
+        beta_unique, RSS_full, RSS_null = glm.fit(Y)
+        beta_full = np.dot(np.linalg.solve(np.dot(X_full.T, X_full), X_full.T), Y)
+        beta_null = np.dot(np.linalg.solve(np.dot(X_null.T, X_null), X_null.T), Y)
+        assert np.allclose(beta_unique, beta_full[1, :])
+        assert np.allclose(RSS_full, np.sum((Y - np.dot(X_full, beta_full))**2, axis=0))
+        assert np.allclose(RSS_null, np.sum((Y - np.dot(X_null, beta_null))**2, axis=0))
+        assert np.allclose(glm.se_unique_scale, np.sqrt(np.linalg.inv(np.dot(X_full.T, X_full))[1, 1]))
+    assert stats_glm.GLMModelComparison(X_full, X_full[:, [0, 2]], 1).nested
+
+
+def test_glm_rank_deficient_design_fails():
+    X_full = np.column_stack([np.ones(10), np.arange(10), 2*np.arange(10)])
+    try:
+        stats_glm.GLMModelComparison(X_full, X_full[:, [0]], 1)
+        assert False
+    except np.linalg.LinAlgError:
+        pass
+
+
+def test_permutation_statistics_match_parametric():
+    model = Model()
+    sdata = Data(num_vertices=200)
+    Y = sdata.phenotype_array
+    sex = sdata.demographic_data['sex'].values
+    anova_perm = stats_permutation.AnovaPermutation(model, sdata)
+    beta_unique, RSS_full, RSS_null = anova_perm.glm.fit(Y)
+    Fstat = (RSS_null - RSS_full)/RSS_full*(30 - 2 - 1)
+    assert np.allclose(anova_perm.statistics(Y, anova_perm.identity())[0], Fstat)
+
+    # Permuting the null model residuals by refitting equals the fast path
+    permutations = anova_perm.permutations(np.random.RandomState(0), 3)
+    residual_null = Y - np.dot(anova_perm.glm.Q_full[:, 0:2], np.dot(anova_perm.glm.Q_full[:, 0:2].T, Y))
+    for i in range(0, 3):
+        Y_perm = (Y - residual_null) + residual_null[permutations[i], :]
+        beta_unique, RSS_full, RSS_null_perm = anova_perm.glm.fit(Y_perm)
+        assert np.allclose(anova_perm.statistics(Y, permutations[i:i+1])[0], (RSS_null_perm - RSS_full)/RSS_full*27)
+
+    corr_perm = stats_permutation.CorrPermutation(model, sdata)
+    age = sdata.demographic_data['age'].values
+    assert np.allclose(corr_perm.statistics(Y, corr_perm.identity())[0],
+                       np.abs([np.corrcoef(age, Y[:, i])[0, 1] for i in range(0, Y.shape[1])]))
+
+    ttest_perm = stats_permutation.UnpairedTtestPermutation(model, sdata)
+    group1 = list(set(sex))[0]
+    tvalues = ttest_ind(Y[sex == group1, :], Y[sex != group1, :])[0]
+    assert np.allclose(ttest_perm.statistics(Y, ttest_perm.identity())[0], np.abs(tvalues))
+
+
+def test_max_stat_pvalues_seeded_and_independent_of_jobs():
+    model = Model()
+    sdata = Data(num_vertices=300, block_size=128)
+    pvalues_serial = stats_permutation.max_stat_pvalues('anova', model, sdata, 150, seed=5, batch_size=40)
+    pvalues_parallel = stats_permutation.max_stat_pvalues('anova', model, sdata, 150, seed=5, jobs=2, batch_size=40)
+    assert np.array_equal(pvalues_serial, pvalues_parallel)
+    assert np.median(pvalues_serial[0:100]) < 0.05
+    assert np.median(pvalues_serial[100:]) > 0.5
+    assert np.all(pvalues_serial >= 1.0/151)
+
+
+def test_max_stat_pvalues_leave_out_permutations_without_a_maximum(monkeypatch):
+    model = Model()
+    sdata = Data(num_vertices=300, block_size=128)
+    valid_max_stats = []
+    run_permutation_batch = stats_permutation.run_permutation_batch
+
+    def nan_first_batch(batch):
+        batch_num, batch_max_stats = run_permutation_batch(batch)
+        if batch_num == 0:
+            return batch_num, np.nan*batch_max_stats
+        valid_max_stats.extend(batch_max_stats)
+        return batch_num, batch_max_stats
+    monkeypatch.setattr(stats_permutation, 'run_permutation_batch', nan_first_batch)
+    pvalues = stats_permutation.max_stat_pvalues('anova', model, sdata, 150, seed=5, batch_size=40)
+
+    permutation_test = stats_permutation.AnovaPermutation(model, sdata)
+    observed_stats = permutation_test.statistics(sdata.phenotype_array, permutation_test.identity())[0]
+    valid_max_stats = np.array(valid_max_stats)
+    assert len(valid_max_stats) == 110
+    num_exceed = np.sum(valid_max_stats[np.newaxis, :] >= observed_stats[:, np.newaxis], axis=1)
+    assert np.allclose(pvalues, (1.0 + num_exceed)/(1.0 + 110))
+
+
+def test_max_stat_pvalues_resume_from_checkpoint(tmpdir):
+    model = Model()
+    sdata = Data(num_vertices=300, block_size=128)
+    checkpoint = StatsCheckpoint(str(tmpdir))
+    checkpoint.start({'permutations': 150, 'seed': 5})
+    pvalues = stats_permutation.max_stat_pvalues('anova', model, sdata, 150, seed=5, batch_size=40,
+                                                 checkpoint=checkpoint)
+    assert all([checkpoint.has(stats_permutation.batch_checkpoint_name(i)) for i in range(0, 4)])
+
+    # Drop one batch as if the run was interrupted
+    tmpdir.join(StatsCheckpoint.checkpoint_dirname, stats_permutation.batch_checkpoint_name(3) + '.npz').remove()
+    checkpoint = StatsCheckpoint(str(tmpdir), resume=True)
+    assert checkpoint.start({'permutations': 150, 'seed': 5})
+    pvalues_resumed = stats_permutation.max_stat_pvalues('anova', model, sdata, 150, seed=5, batch_size=40,
+                                                         checkpoint=checkpoint)
+    assert np.array_equal(pvalues, pvalues_resumed)
+    checkpoint.save(stats_permutation.batch_checkpoint_name(0), max_stats=np.zeros(40))
+    pvalues_zeros = stats_permutation.max_stat_pvalues('anova', model, sdata, 150, seed=5, batch_size=40,
+                                                       checkpoint=checkpoint)
+    assert np.all(pvalues_zeros <= pvalues) and np.any(pvalues_zeros < pvalues)
+
+    # A checkpoint made with different options is discarded
+    checkpoint = StatsCheckpoint(str(tmpdir), resume=True)
+    assert not checkpoint.start({'permutations': 150, 'seed': 6})
+    assert not checkpoint.has(stats_permutation.batch_checkpoint_name(0))
+
+
+def test_stats_engine_parallel_blocks_match_serial():
+    sdata = Data(num_vertices=300, block_size=128)
+    for analysis_type in ['cbm', 'tbm']:
+        for stat_test in ['anova', 'corr']:
+            model = Model()
+            model.analysis_type = analysis_type
+            model.stat_test = stat_test
+            result_serial = StatsEngine(model, sdata, engine='np', jobs=1).run()
+            result_parallel = StatsEngine(model, sdata, engine='np', jobs=3).run()
+            assert np.allclose(result_serial.pvalues, result_parallel.pvalues)
+            assert np.allclose(result_serial.tvalues, result_parallel.tvalues)
+            assert np.allclose(result_serial.pvalues_adjusted, result_parallel.pvalues_adjusted)
+            if stat_test == 'corr':
+                assert np.allclose(result_serial.corrvalues, result_parallel.corrvalues)
+
+
+def test_checkpoint_data_key_depends_on_the_mask(tmpdir):
+    model = Model()
+    model.demographics = str(tmpdir.join('demographics.csv'))
+    model.atlas = str(tmpdir.join('atlas.dfs'))
+    model.maskfile = str(tmpdir.join('mask.dfs'))
+    model.fileid = 'file'
+    model.maskroiid = None
+    sdata = Data(num_vertices=300)
+    sdata.demographic_data['file'] = ''
+    tmpdir.join('mask.dfs').write('mask')
+    key = StatsCheckpoint.data_key(model, sdata)
+    assert StatsCheckpoint.data_key(model, sdata) == key
+    # A replaced mask with the same number of vertices gives a different key
+    tmpdir.join('mask.dfs').write('other mask')
+    assert StatsCheckpoint.data_key(model, sdata) != key
+
+
+def test_stats_engine_runs_designs_together():
+    designs = [Model(), Model()]
+    for design, stat_test in zip(designs, ['anova', 'corr']):
+        design.analysis_type = 'cbm'
+        design.stat_test = stat_test
+    model = designs[0]
+    model.designs = designs
+    sdata = Data(num_vertices=300, block_size=128)
+    results = StatsEngine(model, sdata, engine='np', jobs=2).run_designs()
+    assert len(results) == 2
+    result_anova = cbm_stats.anova_np(model, sdata)
+    result_corr = cbm_stats.corr_fast(model, sdata)
+    assert np.allclose(results[0].pvalues, result_anova.pvalues)
+    assert np.allclose(results[1].pvalues, result_corr.pvalues)
+    assert np.allclose(results[1].corrvalues, result_corr.corrvalues)
+
+
+def test_stats_engine_visits_each_block_once_for_several_designs(monkeypatch):
+    designs = [Model(), Model()]
+    for design, stat_test in zip(designs, ['anova', 'corr']):
+        design.analysis_type = 'cbm'
+        design.stat_test = stat_test
+    model = designs[0]
+    model.designs = designs
+    sdata = Data(num_vertices=300, block_size=128)
+
+    visited_blocks = []
+    run_command_on_block = stats_engine.run_command_on_block
+
+    def count_block(block):
+        visited_blocks.append(block)
+        return run_command_on_block(block)
+    monkeypatch.setattr(stats_engine, 'run_command_on_block', count_block)
+    results = StatsEngine(model, sdata, engine='np', jobs=1).run_designs()
+    assert visited_blocks == sdata.blocks_idx
+    assert np.allclose(results[0].pvalues, cbm_stats.anova_np(model, sdata).pvalues)
+    assert np.allclose(results[1].pvalues, cbm_stats.corr_fast(model, sdata).pvalues)
+
+
+def test_anova_roi_np_matches_sm():
+    model = Model()
+    sdata = Data(num_vertices=4)
+    sdata.roiid = [120, 121, 130, 131]
+    for roi_num, roi_idx in enumerate(sdata.roiid):
+        sdata.demographic_data['ROI_' + str(roi_idx)] = sdata.phenotype_array[:, roi_num]
+    result_sm = roi_stats.anova_roi_sm(model, sdata)
+    result_np = roi_stats.anova_roi_np(model, sdata)
+    assert result_sm.cmd_str_list == result_np.cmd_str_list
+    for roi_result_sm, roi_result_np in zip(result_sm.cmd_result_str_list, result_np.cmd_result_str_list):
+        # Skip the time stamp of the summaries
+        strip_time = lambda text: [line for line in text.splitlines() if not line.startswith('Time:')]
+        assert [strip_time(text) for text in roi_result_sm] == [strip_time(text) for text in roi_result_np]
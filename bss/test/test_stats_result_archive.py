@@ -0,0 +1,34 @@
+""" This module implements tests for the result archive
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+import pytest
+from collections import OrderedDict
+from bss.stats_result_archive import StatsResultArchive
+
+
+def test_result_archive_round_trip(tmpdir):
+    rng = np.random.RandomState(0)
+    atlas_filename = str(tmpdir.join('atlas.dfs'))
+    open(atlas_filename, 'wb').close()
+    maps = OrderedDict([('log_pvalues', rng.randn(100)), ('tvalues', rng.randn(100)), ('corr', rng.rand(100))])
+    archive_filename = str(tmpdir.join('results.npz'))
+    StatsResultArchive.save(archive_filename, maps, np.arange(10, 20), atlas_filename, {'statsengine': 'np'})
+
+    with StatsResultArchive(archive_filename) as archive:
+        assert archive.map_names == list(maps.keys())
+        assert archive.info['atlas'] == atlas_filename
+        assert archive.info['provenance'] == {'statsengine': 'np'}
+        assert np.array_equal(archive.read_mask_idx(), np.arange(10, 20))
+        tvalues = archive.read_map('tvalues')
+        assert tvalues.dtype == np.float32
+        assert np.array_equal(tvalues, maps['tvalues'].astype(np.float32))
+        with pytest.raises(KeyError):
+            archive.read_map('pvalues')
+    assert np.array_equal(StatsResultArchive.load_map(archive_filename, 'corr'), maps['corr'].astype(np.float32))
@@ -0,0 +1,53 @@
+""" This module implements tests for the cohort cache of the bss server
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+from bss.stats_server import StatsCohortCache, StatsServer
+
+
+class Data(object):
+
+    def __init__(self, num_subjects, num_vertices):
+        self.phenotype_array = np.zeros((num_subjects, num_vertices))
+        self.mask_idx = np.arange(0, num_vertices)
+
+
+def test_cohort_cache_drops_least_recently_used():
+    cohort_size = StatsCohortCache.cohort_size(Data(10, 100))
+    cohorts = StatsCohortCache(2*cohort_size)
+    cohorts.add('a', Data(10, 100))
+    cohorts.add('b', Data(10, 100))
+    assert list(cohorts.cohorts.keys()) == ['a', 'b']
+    assert cohorts.memory_used() == 2*cohort_size
+
+    cohorts.add('c', Data(10, 100))
+    assert list(cohorts.cohorts.keys()) == ['b', 'c']
+
+    # A cohort larger than the budget is not kept
+    cohorts.add('d', Data(10, 300))
+    assert len(cohorts.cohorts) == 0
+
+
+def test_run_request_reports_missing_fields_and_errors(monkeypatch):
+    server = StatsServer(port=0)
+    try:
+        response = server.run_request({'modelspec': 'modelspec.ini'})
+        assert not response['success']
+        assert 'missing outdir' in response['output']
+
+        # A KeyError raised while running the model is an error of the run, not of the request
+        def run_modelspec(*args):
+            raise KeyError('age')
+        monkeypatch.setattr(server, 'run_modelspec', run_modelspec)
+        response = server.run_request({'modelspec': 'modelspec.ini', 'outdir': 'out'})
+        assert not response['success']
+        assert 'missing' not in response['output']
+        assert 'KeyError' in response['output']
+    finally:
+        server.server_close()
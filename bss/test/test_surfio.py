@@ -0,0 +1,123 @@
+""" This module implements tests for the surface readers and the vtp writer in surfio
+    Also see http://brainsuite.bmap.ucla.edu for the software
+"""
+
+__author__ = "Shantanu H. Joshi"
+__copyright__ = "Copyright 2016, Shantanu H. Joshi, David Shattuck, Ahmanson-Lovelace Brain Mapping Center, \
+                 University of California Los Angeles"
+__email__ = "s.joshi@g.ucla.edu"
+
+import numpy as np
+from bss import surfio
+
+ccbbm_txt = '''# CCBBM 1.0
+Vertex 1 1.5 -2.25 3.0 {Jfeature=(0.5 1 2 3 4 5 6)}
+Vertex 2 4.0 5.0 -6.5 {Jfeature=(-1.25 1 2 3 4 5 6)}
+Vertex 3 7.0 8.0 9.0 {Jfeature=(2e-3 1 2 3 4 5 6)}
+Face 1 1 2 3
+Face 2 3 2 1
+'''
+
+obj_txt = '''P 0.3 0.3 0.4 10 1 3
+ 1.5 -2.25 3
+ 4 5 -6.5
+ 7 8 9
+
+ 0 0 1
+ 0 0 1
+ 0 0 1
+
+ 2
+ 2
+ 1 0 0 1
+ 0 1 0 1
+ 0 0 1 1
+
+ 3 6
+
+ 0 1 2
+ 2 1 0
+'''
+
+ucf_txt = '''#UCF
+<levels>
+2
+<level number=>
+0.0
+<point_num=>
+2
+<contour_data=>
+1.5 -2.25 3.0 0.5
+4.0 5.0 -6.5 1.5
+<end of level>
+<level number=>
+1.0
+<point_num=>
+1
+<contour_data=>
+7.0 8.0 9.0 2.5
+<end of level>
+<end>
+'''
+
+coords = [[1.5, -2.25, 3.0], [4.0, 5.0, -6.5], [7.0, 8.0, 9.0]]
+
+
+def test_readccbbm(tmpdir):
+    filename = tmpdir.join('surface.m')
+    filename.write(ccbbm_txt)
+    read_coords, faces, attributes, isMultilevelUCF = surfio.readccbbm(str(filename))
+    assert np.array_equal(read_coords, coords)
+    assert faces.tolist() == [[0, 1, 2], [2, 1, 0]]
+    # The first number of the Jfeature field is read without the sign and exponent
+    assert attributes == [0.5, 1.25, 2.0]
+    assert not isMultilevelUCF
+
+    read_coords, faces, attributes, isMultilevelUCF = surfio.readccbbm_using_parse(str(filename))
+    assert np.array_equal(read_coords, coords)
+    assert attributes == [0.5, -1.25, 0.002]
+
+
+def test_readccbbm_without_attributes(tmpdir):
+    filename = tmpdir.join('surface.m')
+    filename.write(''.join([line.split(' {')[0] + '\n' for line in ccbbm_txt.splitlines()]))
+    read_coords, faces, attributes, isMultilevelUCF = surfio.readccbbm(str(filename))
+    assert np.array_equal(read_coords, coords)
+    assert faces.tolist() == [[0, 1, 2], [2, 1, 0]]
+    assert attributes == []
+
+
+def test_read_minc_obj(tmpdir):
+    filename = tmpdir.join('surface.obj')
+    filename.write(obj_txt)
+    read_coords, faces, attributes, isMultilevelUCF = surfio.ReadMincObj(str(filename))
+    assert np.array_equal(read_coords, coords)
+    assert faces == [[0, 1, 2], [2, 1, 0]]
+    assert attributes == [[1, 0, 0, 1], [0, 1, 0, 1], [0, 0, 1, 1]]
+
+
+def test_read_ucf_multiple_levels(tmpdir):
+    filename = tmpdir.join('curves.ucf')
+    filename.write(ucf_txt)
+    X, attributes = surfio.ReadUCFMultipleLevelsWithData(str(filename))
+    assert len(X) == 2
+    assert np.array_equal(X[0], coords[0:2])
+    assert np.array_equal(X[1], coords[2:3])
+    assert np.array_equal(attributes[0], [0.5, 1.5])
+    assert np.array_equal(attributes[1], [2.5])
+
+
+def test_vtp_round_trip(tmpdir):
+    faces = np.array([[1, 2, 3], [3, 2, 1]])
+    attributes = np.array([0.5, -1.25, 0.002])
+    for vtp_format in surfio.vtp_formats:
+        for compress in [False, True]:
+            filename = str(tmpdir.join('surface_{0}_{1}.vtp'.format(vtp_format, compress)))
+            surfio.writesurface_new(filename, np.array(coords), faces, attributes, vtp_format=vtp_format,
+                                    compress=compress)
+            read_coords, read_faces, read_attributes, isMultilevelUCF = surfio.readsurface_new(filename)
+            assert np.allclose(read_coords, coords)
+            assert read_faces.tolist() == [[0, 1, 2], [2, 1, 0]]
+            assert np.allclose(read_attributes, attributes)
+    # The faces of the caller are not changed when they are made zero based
+    assert faces.tolist() == [[1, 2, 3], [3, 2, 1]]
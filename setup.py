@@ -38,7 +38,7 @@ setup(
              'bin/bss_prepare_data_for_cbm.py', 'bin/bss_prepare_data_for_tbm.py', 'bin/bss_export_data.py',
              'bin/bss_prepare_data_for_roi.py', 'bin/bss_write_pvalue_as_color.py', 'bin/bss_convert_surface.py',
              'bin/bss_append_swm_to_roistat.py', 'bin/bss_write_attrib_to_surface.py', 'bin/bss_image_to_shape.py',
-             'bin/bss_roi_sphere_to_mask.py'
+             'bin/bss_roi_sphere_to_mask.py', 'bin/bss_colorbar.py', 'bin/bss_server.py'
              ],
     package_data = {'bss': ['conf/*']},
     license='GPLv2',